@@ -0,0 +1,64 @@
+from fastapi import APIRouter, BackgroundTasks, Depends, status
+
+from app.core.domain.reindex_model import ReindexStatus
+from app.core.services.reindex_service import ReindexService
+from app.adapters.repositories.agent_repository import AgentRepository
+from app.adapters.repositories.storage_repository import StorageRepository
+from app.adapters.repositories.ingestion_job_repository import IngestionJobRepository
+from app.infrastructure.database import get_db
+from app.infrastructure.storage import get_blob_service_client
+from app.infrastructure.answer_cache import get_answer_cache
+from app.infrastructure.vector_store import get_vector_store
+
+router = APIRouter(
+    prefix="/admin",
+    tags=["Admin"],
+)
+
+def get_reindex_service(
+    db=Depends(get_db),
+    blob_client=Depends(get_blob_service_client)
+) -> ReindexService:
+    # Sin la caché de agentes: el estado de la reindexación se lee siempre al día
+    return ReindexService(
+        AgentRepository(db),
+        StorageRepository(blob_client),
+        IngestionJobRepository(db),
+        get_vector_store(),
+        get_answer_cache(),
+    )
+
+@router.post("/reindex", status_code=status.HTTP_202_ACCEPTED)
+async def reindex_all_agents(
+    background_tasks: BackgroundTasks,
+    service: ReindexService = Depends(get_reindex_service)
+):
+    """
+    Reindexa (o reanuda la reindexación de) todos los agentes. Listar los blobs de todos puede
+    tardar, así que se hace en segundo plano; el estado se consulta por agente.
+    """
+    background_tasks.add_task(service.start_all)
+    return {"message": "Reindex is being started for every agent in the background"}
+
+@router.post("/reindex/{agent_id}", response_model=ReindexStatus, status_code=status.HTTP_202_ACCEPTED)
+async def reindex_agent(
+    agent_id: str,
+    service: ReindexService = Depends(get_reindex_service)
+):
+    """
+    Reindexa los documentos del agente en una versión nueva de su índice, a partir de sus blobs.
+    Las búsquedas siguen usando la versión actual hasta que la nueva está completa. Si hay una
+    reindexación sin terminar, se reanuda.
+    """
+    return await service.start(agent_id)
+
+@router.get("/reindex/{agent_id}", response_model=ReindexStatus)
+async def get_reindex_status(
+    agent_id: str,
+    service: ReindexService = Depends(get_reindex_service)
+):
+    """
+    Fase, archivos por estado, chunks y ritmo (archivos y chunks por segundo) de la última
+    reindexación del agente.
+    """
+    return await service.get_status(agent_id)
@@ -1,38 +1,61 @@
-from fastapi import APIRouter, Depends, UploadFile, File, HTTPException, status
-from typing import List
+import json
+import logging
+from fastapi import APIRouter, BackgroundTasks, Depends, UploadFile, File, HTTPException, Query, Request, Response, status
+from fastapi.responses import StreamingResponse
+from typing import AsyncIterator, List, Optional
 
 from app.core.domain.agent_model import AgentCreate, Agent, AgentList, AgentUpdate
-from app.core.services.agent_service import AgentService
+from app.core.services.agent_service import ALLOWED_EXTENSIONS, AgentService, is_allowed_file
+from app.core.services.chat_session_service import ChatSessionService
 from app.adapters.repositories.agent_repository import AgentRepository
 from app.adapters.repositories.storage_repository import StorageRepository
+from app.adapters.repositories.ingestion_job_repository import IngestionJobRepository
+from app.adapters.repositories.cached_agent_repository import CachedAgentRepository
+from app.adapters.repositories.chat_session_repository import ChatSessionRepository
 from app.infrastructure.database import get_db
 from app.infrastructure.storage import get_blob_service_client
-from fastapi import BackgroundTasks
-from app.core.domain.agent_model import ChatQuery, ChatResponse
+from app.infrastructure.answer_cache import get_answer_cache
+from app.infrastructure.agent_cache import get_agent_cache
+from app.infrastructure.admission import get_admission_controller, get_request_coalescer
+from app.infrastructure.vector_store import get_vector_store
+from app.core.domain.agent_model import ChatBatchRequest, ChatBatchResponse, ChatQuery, ChatResponse
+from app.core.domain.job_model import BulkUploadResponse, IngestionJob, UploadBatchStatus
+from app.core.domain.session_model import ChatSession
 from app.adapters.repositories.agent_repository import AgentRepository # Se instancian los adaptadores concretos
 from app.adapters.repositories.storage_repository import StorageRepository
 
+logger = logging.getLogger(__name__)
+
+# Lo que ve el cliente cuando el stream falla por un error interno; el detalle queda en el log
+STREAM_ERROR_MESSAGE = "The response could not be completed"
+
 router = APIRouter(
     prefix="/agents",
     tags=["Agents"],
 )
 
+def get_chat_session_service(db=Depends(get_db)) -> ChatSessionService:
+    return ChatSessionService(ChatSessionRepository(db))
+
 # Helper para la inyección de dependencias
 def get_agent_service(
     db=Depends(get_db),
-    blob_client=Depends(get_blob_service_client)
+    blob_client=Depends(get_blob_service_client),
+    sessions: ChatSessionService = Depends(get_chat_session_service)
 ) -> AgentService:
-    agent_repo = AgentRepository(db)
+    # Caché de lectura compartida por el proceso + deduplicación de consultas dentro de la petición
+    agent_repo = CachedAgentRepository(AgentRepository(db), get_agent_cache())
     storage_repo = StorageRepository(blob_client)
     # El AgentService pide un IAgentRepository, y tú le das un AgentRepository
     # que ES un IAgentRepository. ¡Funciona perfecto!
-    return AgentService(agent_repo, storage_repo)
-
+    job_repo = IngestionJobRepository(db)
+    return AgentService(
+        agent_repo, storage_repo, job_repo, get_vector_store(), get_answer_cache(),
+        get_admission_controller(), get_request_coalescer(), sessions,
+    )
 
-ALLOWED_EXTENSIONS = {"pdf", "docx", "xlsx", "pptx"}
 
-def is_allowed_file(filename: str):
-    return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
+DEFAULT_PAGE_SIZE = 100
 
 
 @router.post("/", response_model=Agent, status_code=status.HTTP_201_CREATED)
@@ -45,22 +68,49 @@ async def create_agent(
     """
     return await service.create_agent(agent_data)
 
-@router.get("/", response_model=List[AgentList])
-async def list_agents(service: AgentService = Depends(get_agent_service)):
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+@router.get("/", response_model=List[AgentList], response_model_exclude_unset=True)
+async def list_agents(
+    request: Request,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=1000, description="Agentes por página (100 por defecto en JSON)"),
+    after: Optional[str] = Query(None, description="Cursor: id del último agente de la página anterior"),
+    fields: Optional[str] = Query(None, description="Campos a devolver separados por comas (name, prompt, document_count)"),
+    service: AgentService = Depends(get_agent_service)
+):
     """
-    Devuelve la lista de todos los agentes con un contador de sus documentos.
+    Devuelve la lista de agentes con un contador de sus documentos, paginada por _id.
+    El cursor de la siguiente página viaja en la cabecera `X-Next-Cursor`.
+    Con `Accept: application/x-ndjson` las filas se envían una por línea a medida que
+    llegan del cursor de Mongo (sin `limit` se recorre toda la colección).
     """
-    return await service.get_all_agents()
+    selected_fields = [field.strip() for field in fields.split(",") if field.strip()] if fields else None
+
+    if NDJSON_MEDIA_TYPE in request.headers.get("accept", ""):
+        agents = service.stream_agents(limit, after, selected_fields)
+
+        async def generate():
+            async for agent in agents:
+                yield agent.model_dump_json(by_alias=True, exclude_unset=True) + "\n"
+        return StreamingResponse(generate(), media_type=NDJSON_MEDIA_TYPE)
+
+    agents, next_cursor = await service.get_all_agents(limit or DEFAULT_PAGE_SIZE, after, selected_fields)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return agents
 
 @router.get("/{agent_id}", response_model=Agent)
 async def get_agent_details(
     agent_id: str,
+    documents_limit: int = Query(50, ge=1, le=500, description="Documentos por página"),
+    documents_after: Optional[str] = Query(None, description="Cursor devuelto en documents_next_cursor"),
     service: AgentService = Depends(get_agent_service)
 ):
     """
-    Muestra los datos de un agente, incluyendo sus documentos.
+    Muestra los datos de un agente, incluyendo una página de sus documentos.
     """
-    return await service.get_agent_by_id(agent_id)
+    return await service.get_agent_details(agent_id, documents_limit, documents_after)
 
 @router.put("/{agent_id}", response_model=Agent)
 async def update_agent(
@@ -76,20 +126,55 @@ async def update_agent(
 @router.post("/{agent_id}/documents", response_model=Agent)
 async def upload_agent_document(
     agent_id: str,
-    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     service: AgentService = Depends(get_agent_service)
 ):
     """
     Sube un documento para un agente específico.
-    Valida la extensión del archivo.
+    Valida la extensión del archivo y encola su ingesta en la base de conocimiento.
     """
     if not is_allowed_file(file.filename):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"File extension not allowed. Allowed extensions are: {', '.join(ALLOWED_EXTENSIONS)}"
         )
-    return await service.upload_document(agent_id, file, background_tasks)
+    return await service.upload_document(agent_id, file)
+
+@router.post("/{agent_id}/documents/batch", response_model=BulkUploadResponse, status_code=status.HTTP_202_ACCEPTED)
+async def upload_agent_documents(
+    agent_id: str,
+    files: List[UploadFile] = File(...),
+    service: AgentService = Depends(get_agent_service)
+):
+    """
+    Sube varios documentos en una petición; los archivos .zip se expanden y se sube cada
+    documento que contienen. Los archivos con extensión no permitida, repetidos o que no se
+    pudieron subir vuelven en `rejected`; el resto se ingiere en segundo plano y su estado
+    se consulta con el `batch_id`.
+    """
+    return await service.upload_documents(agent_id, files)
+
+@router.get("/{agent_id}/documents/batches/{batch_id}", response_model=UploadBatchStatus)
+async def get_upload_batch_status(
+    agent_id: str,
+    batch_id: str,
+    service: AgentService = Depends(get_agent_service)
+):
+    """
+    Estado de la ingesta de cada archivo de una subida masiva y el recuento por estado.
+    """
+    return await service.get_upload_batch(agent_id, batch_id)
+
+@router.get("/{agent_id}/documents/{file_name}/status", response_model=IngestionJob)
+async def get_document_ingestion_status(
+    agent_id: str,
+    file_name: str,
+    service: AgentService = Depends(get_agent_service)
+):
+    """
+    Devuelve el estado del último trabajo de ingesta de un documento (queued, running, done o failed).
+    """
+    return await service.get_ingestion_status(agent_id, file_name)
 
 @router.delete("/{agent_id}/documents/{file_name}", status_code=status.HTTP_200_OK)
 async def delete_agent_document(
@@ -105,20 +190,108 @@ async def delete_agent_document(
 @router.delete("/{agent_id}", status_code=status.HTTP_200_OK)
 async def delete_agent(
     agent_id: str,
+    response: Response,
+    async_mode: bool = Query(False, description="Responde de inmediato y borra los archivos en segundo plano"),
     service: AgentService = Depends(get_agent_service)
 ):
     """
     Elimina un agente y todos sus archivos asociados.
+    En modo asíncrono responde 202 y la limpieza del storage la hace un worker de ingesta
+    con un trabajo de la cola (`cleanup_job_id`), que se reintenta hasta completarse.
     """
-    return await service.delete_agent(agent_id)
+    if async_mode:
+        response.status_code = status.HTTP_202_ACCEPTED
+    return await service.delete_agent(agent_id, async_mode)
 
 @router.post("/{agent_id}/chat", response_model=ChatResponse)
 async def chat_with_agent(
     agent_id: str,
     chat_query: ChatQuery,
+    background_tasks: BackgroundTasks,
     service: AgentService = Depends(get_agent_service)
 ):
     """
     Permite conversar con un agente usando su base de conocimiento (RAG).
+    Con `session_id` la conversación continúa con el historial guardado en el servidor.
+    Con demasiadas peticiones en curso responde 429 con la cabecera Retry-After.
+    """
+    return await service.chat_with_agent(agent_id, chat_query, background_tasks)
+
+@router.post("/{agent_id}/chat/batch", response_model=ChatBatchResponse)
+async def chat_batch_with_agent(
+    agent_id: str,
+    batch: ChatBatchRequest,
+    request: Request,
+    service: AgentService = Depends(get_agent_service)
+):
+    """
+    Responde varias preguntas a un mismo agente en una sola petición. El agente se carga una
+    vez y las preguntas se embeben juntas. Cada resultado lleva su `index` y, si esa pregunta
+    falló, `error` en lugar de `response`.
+    Con `Accept: application/x-ndjson` cada resultado se envía en cuanto está listo (en orden).
+    """
+    results = await service.chat_batch(agent_id, batch.queries)
+
+    if NDJSON_MEDIA_TYPE in request.headers.get("accept", ""):
+        async def generate():
+            async for item in results:
+                yield item.model_dump_json() + "\n"
+        return StreamingResponse(generate(), media_type=NDJSON_MEDIA_TYPE)
+
+    return ChatBatchResponse(results=[item async for item in results])
+
+def _format_sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def _to_sse(agent_id: str, events: AsyncIterator[dict]) -> AsyncIterator[str]:
+    async def generate():
+        try:
+            async for event in events:
+                yield _format_sse(event["event"], event["data"])
+        except Exception as e:
+            # Las cabeceras ya se enviaron: el error se comunica con un último evento en lugar de cortar el stream
+            logger.exception("Error durante el stream de chat", extra={"agent_id": agent_id})
+            message = str(e.detail) if isinstance(e, HTTPException) else STREAM_ERROR_MESSAGE
+            yield _format_sse("error", {"message": message})
+    return generate()
+
+@router.post("/{agent_id}/chat/stream")
+async def stream_chat_with_agent(
+    agent_id: str,
+    chat_query: ChatQuery,
+    background_tasks: BackgroundTasks,
+    service: AgentService = Depends(get_agent_service)
+):
+    """
+    Igual que /chat, pero responde con Server-Sent Events: primero las fuentes recuperadas,
+    después los tokens a medida que el modelo los genera y por último los tiempos. Si algo
+    falla a mitad, el stream termina con un evento `error` en lugar de `done`.
+    """
+    events = await service.stream_chat_with_agent(agent_id, chat_query, background_tasks)
+    return StreamingResponse(
+        _to_sse(agent_id, events),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@router.get("/{agent_id}/sessions/{session_id}", response_model=ChatSession)
+async def get_chat_session(
+    agent_id: str,
+    session_id: str,
+    service: ChatSessionService = Depends(get_chat_session_service)
+):
+    """
+    Resumen de los turnos antiguos de una sesión de chat y los turnos recientes guardados tal cual.
+    """
+    return await service.get_session(agent_id, session_id)
+
+@router.delete("/{agent_id}/sessions/{session_id}", status_code=status.HTTP_200_OK)
+async def delete_chat_session(
+    agent_id: str,
+    session_id: str,
+    service: ChatSessionService = Depends(get_chat_session_service)
+):
+    """
+    Elimina una sesión de chat y su historial.
     """
-    return await service.chat_with_agent(agent_id, chat_query)
\ No newline at end of file
+    return await service.delete_session(agent_id, session_id)
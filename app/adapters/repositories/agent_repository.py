@@ -1,14 +1,34 @@
 from motor.motor_asyncio import AsyncIOMotorDatabase
 from bson import ObjectId
-from typing import List, Optional
-from datetime import datetime
+from typing import AsyncIterator, List, Optional, Tuple
+from datetime import datetime, timedelta
+from pymongo import ASCENDING, ReturnDocument, UpdateOne
 
 from app.core.domain.agent_model import Agent, AgentCreate, Document, AgentUpdate
+from app.core.domain.reindex_model import ReindexPhase
 from app.core.ports.agent_repository_port import IAgentRepository
 
+EPOCH = datetime(1970, 1, 1)
+
+def encode_document_cursor(document: dict) -> str:
+    # El cursor de documentos es "<uploaded_at en ms>-<_id>", el orden del índice (agent_id, uploaded_at)
+    millis = (document["uploaded_at"] - EPOCH) // timedelta(milliseconds=1)
+    return f"{millis}-{document['_id']}"
+
+def decode_document_cursor(cursor: str) -> Tuple[datetime, ObjectId]:
+    millis, document_id = cursor.split("-", 1)
+    return EPOCH + timedelta(milliseconds=int(millis)), ObjectId(document_id)
+
 class AgentRepository(IAgentRepository):
     def __init__(self, db: AsyncIOMotorDatabase):
         self.collection = db.agents
+        # Los documentos de cada agente viven en su propia colección, no en un array del agente
+        self.documents = db.agent_documents
+
+    async def ensure_indexes(self):
+        await self.documents.create_index([("agent_id", ASCENDING), ("file_name", ASCENDING)], unique=True)
+        await self.documents.create_index([("agent_id", ASCENDING), ("uploaded_at", ASCENDING), ("_id", ASCENDING)])
+        await self.documents.create_index([("agent_id", ASCENDING), ("hidden_versions", ASCENDING)])
 
     async def create_agent(self, agent_data: AgentCreate) -> dict:
         # 1. Convierte el modelo de entrada (solo name y prompt) a un diccionario.
@@ -16,7 +36,7 @@ class AgentRepository(IAgentRepository):
         
         # 2. ¡Aquí está la clave! Añade los campos que el servidor debe gestionar.
         agent_dict["created_at"] = datetime.utcnow()
-        agent_dict["documents"] = [] # Inicializa la lista de documentos vacía.
+        agent_dict["document_count"] = 0 # Contador mantenido al añadir y quitar documentos.
         
         # 3. Inserta el diccionario completo en la base de datos.
         result = await self.collection.insert_one(agent_dict)
@@ -27,45 +47,191 @@ class AgentRepository(IAgentRepository):
         return created_agent
 
     async def find_agent_by_id(self, agent_id: str) -> Optional[dict]:
-        return await self.collection.find_one({"_id": ObjectId(agent_id)})
-
-    async def get_all_agents(self) -> List[dict]:
-        # Usamos una agregación para contar los documentos eficientemente
-        pipeline = [
-            {"$project": {
-                "name": 1,
-                "prompt": 1,
-                "document_count": {"$size": "$documents"}
-            }}
-        ]
-        agents_cursor = self.collection.aggregate(pipeline)
-        return await agents_cursor.to_list(length=None)
+        # Excluye el array heredado de agentes todavía sin migrar
+        return await self.collection.find_one({"_id": ObjectId(agent_id)}, {"documents": 0})
+
+    async def find_chat_settings(self, agent_id: str) -> Optional[dict]:
+        # Proyección: solo lo que necesita el chat
+        agent = await self.collection.find_one({"_id": ObjectId(agent_id)}, {"prompt": 1, "index_version": 1})
+        return {"prompt": agent["prompt"], "index_version": agent.get("index_version", 0)} if agent else None
+
+    def _list_pipeline(self, limit: Optional[int], after: Optional[str], fields: Optional[List[str]]) -> List[dict]:
+        # Paginación por clave (keyset) sobre _id: cada página es un rango del índice, sin skip
+        pipeline = []
+        if after:
+            pipeline.append({"$match": {"_id": {"$gt": ObjectId(after)}}})
+        pipeline.append({"$sort": {"_id": 1}})
+        if limit:
+            pipeline.append({"$limit": limit})
+
+        # El contador se mantiene en el propio agente, no hace falta recorrer sus documentos
+        projection = {
+            "name": 1,
+            "prompt": 1,
+            "document_count": {"$ifNull": ["$document_count", 0]}
+        }
+        if fields:
+            projection = {field: value for field, value in projection.items() if field in fields}
+        if projection:
+            pipeline.append({"$project": projection})
+        else:
+            pipeline.append({"$project": {"_id": 1}})
+        return pipeline
+
+    async def get_all_agents(self, limit: Optional[int] = None, after: Optional[str] = None, fields: Optional[List[str]] = None) -> List[dict]:
+        agents_cursor = self.collection.aggregate(self._list_pipeline(limit, after, fields))
+        return await agents_cursor.to_list(length=limit)
+
+    async def iter_agents(self, limit: Optional[int] = None, after: Optional[str] = None, fields: Optional[List[str]] = None) -> AsyncIterator[dict]:
+        # Devuelve las filas a medida que llegan los lotes del cursor, sin construir la lista
+        async for agent in self.collection.aggregate(self._list_pipeline(limit, after, fields)):
+            yield agent
 
     async def update_agent(self, agent_id: str, update_data: AgentUpdate) -> Optional[dict]:
         update_dict = {k: v for k, v in update_data.model_dump().items() if v is not None}
         if not update_dict:
             return await self.find_agent_by_id(agent_id)
             
-        await self.collection.update_one(
+        # Actualiza y devuelve el agente en una sola operación (None si no existe)
+        return await self.collection.find_one_and_update(
             {"_id": ObjectId(agent_id)},
-            {"$set": update_dict}
+            {"$set": update_dict},
+            projection={"documents": 0},
+            return_document=ReturnDocument.AFTER
         )
-        return await self.find_agent_by_id(agent_id)
 
     async def add_document_to_agent(self, agent_id: str, document: Document) -> bool:
-        result = await self.collection.update_one(
-            {"_id": ObjectId(agent_id)},
-            {"$push": {"documents": document.model_dump()}}
+        # Subir de nuevo un archivo con el mismo nombre reemplaza su registro en lugar de duplicarlo
+        result = await self.documents.update_one(
+            {"agent_id": agent_id, "file_name": document.file_name},
+            {"$set": document.model_dump()},
+            upsert=True
         )
-        return result.modified_count > 0
+        if result.upserted_id is not None:
+            await self.collection.update_one({"_id": ObjectId(agent_id)}, {"$inc": {"document_count": 1}})
+        return True
+
+    async def add_documents_to_agent(self, agent_id: str, documents: List[Document]) -> int:
+        if not documents:
+            return 0
+        result = await self.documents.bulk_write([
+            UpdateOne({"agent_id": agent_id, "file_name": document.file_name}, {"$set": document.model_dump()}, upsert=True)
+            for document in documents
+        ], ordered=False)
+        if result.upserted_count:
+            await self.collection.update_one({"_id": ObjectId(agent_id)}, {"$inc": {"document_count": result.upserted_count}})
+        return result.upserted_count
+
+    async def list_documents(self, agent_id: str, limit: int, after: Optional[str] = None) -> List[dict]:
+        query = {"agent_id": agent_id}
+        if after:
+            uploaded_at, document_id = decode_document_cursor(after)
+            query["$or"] = [
+                {"uploaded_at": {"$gt": uploaded_at}},
+                {"uploaded_at": uploaded_at, "_id": {"$gt": document_id}},
+            ]
+        cursor = self.documents.find(query).sort([("uploaded_at", ASCENDING), ("_id", ASCENDING)]).limit(limit)
+        documents = await cursor.to_list(length=limit)
+        for document in documents:
+            document["cursor"] = encode_document_cursor(document)
+        return documents
     
     async def remove_document_from_agent(self, agent_id: str, file_name: str) -> bool:
+        result = await self.documents.delete_one({"agent_id": agent_id, "file_name": file_name})
+        if result.deleted_count == 0:
+            return False
+        await self.collection.update_one({"_id": ObjectId(agent_id)}, {"$inc": {"document_count": -1}})
+        return True
+
+    # Versiones de los chunks de cada documento: `active_versions` ({index_version: version}) es la
+    # que ven las búsquedas, `pending_versions` las que se están ingiriendo y `hidden_versions`
+    # todas las que las búsquedas excluyen (pendientes y retiradas aún sin borrar)
+
+    async def start_document_version(self, agent_id: str, file_name: str, index_version: int, version: int) -> bool:
+        result = await self.documents.update_one(
+            {"agent_id": agent_id, "file_name": file_name},
+            {"$addToSet": {
+                "pending_versions": {"index_version": index_version, "version": version},
+                "hidden_versions": version,
+            }},
+        )
+        return result.matched_count == 1
+
+    async def activate_document_version(self, agent_id: str, file_name: str, index_version: int, version: int) -> List[int]:
+        document = await self.documents.find_one(
+            {"agent_id": agent_id, "file_name": file_name}, {"active_versions": 1, "pending_versions": 1},
+        )
+        if document is None:
+            return []
+        # La activa hasta ahora y los intentos anteriores de esta versión del índice que no terminaron
+        retired = [
+            pending["version"] for pending in document.get("pending_versions", [])
+            if pending["index_version"] == index_version and pending["version"] < version
+        ]
+        active = document.get("active_versions", {}).get(str(index_version))
+        if active is not None and active != version:
+            retired.append(active)
+        # Actualización con pipeline: mostrar la versión nueva y ocultar las anteriores es una sola escritura
+        await self.documents.update_one({"_id": document["_id"]}, [{"$set": {
+            f"active_versions.{index_version}": version,
+            "pending_versions": {"$filter": {
+                "input": {"$ifNull": ["$pending_versions", []]},
+                "cond": {"$not": [{"$and": [
+                    {"$eq": ["$$this.index_version", index_version]},
+                    {"$lte": ["$$this.version", version]},
+                ]}]},
+            }},
+            "hidden_versions": {"$setUnion": [
+                {"$setDifference": [{"$ifNull": ["$hidden_versions", []]}, [version]]},
+                retired,
+            ]},
+        }}])
+        return retired
+
+    async def release_document_versions(self, agent_id: str, file_name: str, versions: List[int]) -> None:
+        if not versions:
+            return
+        await self.documents.update_one(
+            {"agent_id": agent_id, "file_name": file_name},
+            {"$pull": {"pending_versions": {"version": {"$in": versions}}, "hidden_versions": {"$in": versions}}},
+        )
+
+    async def find_hidden_versions(self, agent_id: str) -> List[int]:
+        # Las versiones son positivas: el rango usa el índice (agent_id, hidden_versions)
+        cursor = self.documents.find({"agent_id": agent_id, "hidden_versions": {"$gt": 0}}, {"hidden_versions": 1})
+        hidden = set()
+        async for document in cursor:
+            hidden.update(document["hidden_versions"])
+        return sorted(hidden)
+
+    async def start_reindex(self, agent_id: str, reindex: dict) -> bool:
+        # Condicional: dos peticiones a la vez no pueden empezar dos versiones distintas
         result = await self.collection.update_one(
-            {"_id": ObjectId(agent_id)},
-            {"$pull": {"documents": {"file_name": file_name}}}
+            {"_id": ObjectId(agent_id), "$or": [{"reindex": {"$exists": False}}, {"reindex.phase": ReindexPhase.DONE.value}]},
+            {"$set": {"reindex": reindex}},
+        )
+        return result.modified_count == 1
+
+    async def update_reindex(self, agent_id: str, index_version: int, fields: dict) -> bool:
+        result = await self.collection.update_one(
+            {"_id": ObjectId(agent_id), "reindex.index_version": index_version},
+            {"$set": {f"reindex.{key}": value for key, value in fields.items()}},
+        )
+        return result.matched_count == 1
+
+    async def switch_index_version(self, agent_id: str, index_version: int) -> bool:
+        # Una sola escritura cambia la versión activa y cierra la reindexación
+        result = await self.collection.update_one(
+            {"_id": ObjectId(agent_id), "reindex.index_version": index_version, "reindex.phase": ReindexPhase.INDEXING.value},
+            {"$set": {
+                "index_version": index_version,
+                "reindex.phase": ReindexPhase.DONE.value,
+                "reindex.finished_at": datetime.utcnow(),
+            }},
         )
-        return result.modified_count > 0
+        return result.modified_count == 1
 
     async def delete_agent(self, agent_id: str) -> bool:
         result = await self.collection.delete_one({"_id": ObjectId(agent_id)})
+        await self.documents.delete_many({"agent_id": agent_id})
         return result.deleted_count > 0
\ No newline at end of file
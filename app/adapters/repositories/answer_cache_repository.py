@@ -0,0 +1,295 @@
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+from pymongo.operations import SearchIndexModel
+
+from app.core.domain.agent_model import ChatResponse
+from app.core.ports.answer_cache_port import IAnswerCache
+
+logger = logging.getLogger(__name__)
+
+
+def _normalize(vector: List[float]) -> np.ndarray:
+    array = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(array)
+    return array / norm if norm else array
+
+
+class CacheStats:
+    def __init__(self):
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        # Respuestas no guardadas porque el agente se invalidó mientras se generaban
+        self.stale_writes = 0
+
+    def as_dict(self) -> dict:
+        return {
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "stale_writes": self.stale_writes,
+        }
+
+
+class InMemoryAnswerCache(IAnswerCache):
+    """
+    Caché LRU en memoria del proceso. Las entradas se indexan por (agent_id, consulta normalizada)
+    y se mantiene un índice por agente para la búsqueda semántica y la invalidación. La
+    generación de cada agente vive en el proceso, igual que sus entradas.
+    """
+
+    def __init__(self, max_entries: int, similarity_threshold: float, ttl_seconds: int):
+        self.max_entries = max_entries
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[np.ndarray, ChatResponse, float]]" = OrderedDict()
+        self._by_agent: Dict[str, Set[Tuple[str, str]]] = {}
+        self._generations: Dict[str, int] = {}
+        self._stats = CacheStats()
+
+    def _expired(self, stored_at: float) -> bool:
+        return time.monotonic() - stored_at > self.ttl_seconds
+
+    def _remove(self, key: Tuple[str, str]):
+        self._entries.pop(key, None)
+        keys = self._by_agent.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_agent[key[0]]
+
+    async def get_exact(self, agent_id: str, normalized_query: str) -> Optional[ChatResponse]:
+        key = (agent_id, normalized_query)
+        entry = self._entries.get(key)
+        if entry is None or self._expired(entry[2]):
+            if entry is not None:
+                self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        self._stats.exact_hits += 1
+        return entry[1]
+
+    async def get_similar(self, agent_id: str, query_embedding: List[float]) -> Optional[ChatResponse]:
+        keys = [key for key in self._by_agent.get(agent_id, ()) if not self._expired(self._entries[key][2])]
+        if keys:
+            matrix = np.stack([self._entries[key][0] for key in keys])
+            scores = matrix @ _normalize(query_embedding)
+            best = int(np.argmax(scores))
+            if scores[best] >= self.similarity_threshold:
+                self._entries.move_to_end(keys[best])
+                self._stats.semantic_hits += 1
+                return self._entries[keys[best]][1]
+        self._stats.misses += 1
+        return None
+
+    async def generation(self, agent_id: str) -> int:
+        return self._generations.get(agent_id, 0)
+
+    async def put(self, agent_id: str, normalized_query: str, query_embedding: List[float], response: ChatResponse, generation: int) -> None:
+        if generation != self._generations.get(agent_id, 0):
+            self._stats.stale_writes += 1
+            return
+        key = (agent_id, normalized_query)
+        self._entries[key] = (_normalize(query_embedding), response, time.monotonic())
+        self._entries.move_to_end(key)
+        self._by_agent.setdefault(agent_id, set()).add(key)
+        while len(self._entries) > self.max_entries:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self._stats.evictions += 1
+
+    async def invalidate_agent(self, agent_id: str) -> None:
+        self._generations[agent_id] = self._generations.get(agent_id, 0) + 1
+        for key in list(self._by_agent.get(agent_id, ())):
+            self._remove(key)
+        self._stats.invalidations += 1
+
+    def stats(self) -> dict:
+        return {"backend": "memory", "entries": len(self._entries), **self._stats.as_dict()}
+
+
+class MongoAnswerCache(IAnswerCache):
+    """
+    Caché de respuestas compartida entre procesos en la colección `answer_cache`.
+    La caducidad la gestiona un índice TTL de MongoDB y cada agente guarda como máximo
+    `max_entries_per_agent` entradas (se descartan las menos usadas). La generación de cada
+    agente se guarda en `answer_cache_generations` para que la vean todos los procesos.
+
+    La búsqueda semántica usa el índice de Atlas Vector Search `vector_index_name` sobre los
+    embeddings de las consultas y pide solo el mejor candidato. El índice se crea con la primera
+    entrada (hasta entonces no se conoce la dimensión). Sin Atlas, o si el índice no responde,
+    se comparan en el proceso los embeddings de las `max_candidates` entradas usadas más recientemente.
+    """
+
+    def __init__(
+        self,
+        db: AsyncIOMotorDatabase,
+        max_entries_per_agent: int,
+        similarity_threshold: float,
+        ttl_seconds: int,
+        vector_index_name: str,
+        max_candidates: int,
+    ):
+        self.collection = db.answer_cache
+        self.generations = db.answer_cache_generations
+        self.max_entries_per_agent = max_entries_per_agent
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.vector_index_name = vector_index_name
+        self.max_candidates = max_candidates
+        self._stats = CacheStats()
+        self._indexes_ready = False
+        # None: todavía no se ha comprobado si el índice vectorial existe
+        self._vector_search: Optional[bool] = None
+
+    async def _ensure_indexes(self):
+        if self._indexes_ready:
+            return
+        await self.collection.create_index([("agent_id", ASCENDING), ("query", ASCENDING)], unique=True)
+        await self.collection.create_index([("agent_id", ASCENDING), ("last_hit_at", DESCENDING)])
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+        self._indexes_ready = True
+
+    async def _ensure_vector_index(self, dimensions: int):
+        if self._vector_search is not None:
+            return
+        try:
+            existing = await self.collection.list_search_indexes(self.vector_index_name).to_list(length=1)
+            if not existing:
+                await self.collection.create_search_index(SearchIndexModel(
+                    definition={"fields": [
+                        {"type": "vector", "path": "embedding", "numDimensions": dimensions, "similarity": "cosine"},
+                        {"type": "filter", "path": "agent_id"},
+                        {"type": "filter", "path": "expires_at"},
+                    ]},
+                    name=self.vector_index_name,
+                    type="vectorSearch",
+                ))
+            self._vector_search = True
+        except OperationFailure as e:
+            self._disable_vector_search(e)
+
+    def _disable_vector_search(self, error: Exception):
+        self._vector_search = False
+        logger.warning(
+            "Caché de respuestas sin Atlas Vector Search: la búsqueda semántica compara solo las entradas más recientes",
+            extra={"index": self.vector_index_name, "max_candidates": self.max_candidates, "error": str(error)},
+        )
+
+    async def _touch(self, entry_id):
+        await self.collection.update_one({"_id": entry_id}, {"$set": {"last_hit_at": datetime.utcnow()}})
+
+    async def get_exact(self, agent_id: str, normalized_query: str) -> Optional[ChatResponse]:
+        await self._ensure_indexes()
+        entry = await self.collection.find_one(
+            {"agent_id": agent_id, "query": normalized_query, "expires_at": {"$gt": datetime.utcnow()}},
+            {"response": 1},
+        )
+        if entry is None:
+            return None
+        await self._touch(entry["_id"])
+        self._stats.exact_hits += 1
+        return ChatResponse.model_validate(entry["response"])
+
+    async def _search_index(self, agent_id: str, query_embedding: List[float]) -> Optional[Tuple[dict, float]]:
+        pipeline = [
+            {"$vectorSearch": {
+                "index": self.vector_index_name,
+                "path": "embedding",
+                "queryVector": query_embedding,
+                "numCandidates": self.max_candidates,
+                "limit": 1,
+                "filter": {"agent_id": agent_id, "expires_at": {"$gt": datetime.utcnow()}},
+            }},
+            {"$project": {"response": 1, "score": {"$meta": "vectorSearchScore"}}},
+        ]
+        entries = await self.collection.aggregate(pipeline).to_list(length=1)
+        # Atlas devuelve (1 + coseno) / 2
+        return (entries[0], 2 * entries[0]["score"] - 1) if entries else None
+
+    async def _search_recent(self, agent_id: str, query_embedding: List[float]) -> Optional[Tuple[dict, float]]:
+        cursor = self.collection.find(
+            {"agent_id": agent_id, "expires_at": {"$gt": datetime.utcnow()}},
+            {"embedding": 1, "response": 1},
+        ).sort("last_hit_at", DESCENDING).limit(self.max_candidates)
+        entries = await cursor.to_list(length=self.max_candidates)
+        if not entries:
+            return None
+        matrix = np.asarray([entry["embedding"] for entry in entries], dtype=np.float32)
+        scores = matrix @ _normalize(query_embedding)
+        best = int(np.argmax(scores))
+        return entries[best], float(scores[best])
+
+    async def get_similar(self, agent_id: str, query_embedding: List[float]) -> Optional[ChatResponse]:
+        await self._ensure_indexes()
+        best = None
+        if self._vector_search is not False:
+            try:
+                best = await self._search_index(agent_id, query_embedding)
+            except OperationFailure as e:
+                self._disable_vector_search(e)
+        if self._vector_search is False:
+            best = await self._search_recent(agent_id, query_embedding)
+        if best and best[1] >= self.similarity_threshold:
+            await self._touch(best[0]["_id"])
+            self._stats.semantic_hits += 1
+            return ChatResponse.model_validate(best[0]["response"])
+        self._stats.misses += 1
+        return None
+
+    async def generation(self, agent_id: str) -> int:
+        document = await self.generations.find_one({"_id": agent_id}, {"generation": 1})
+        return document["generation"] if document else 0
+
+    async def put(self, agent_id: str, normalized_query: str, query_embedding: List[float], response: ChatResponse, generation: int) -> None:
+        await self._ensure_indexes()
+        await self._ensure_vector_index(len(query_embedding))
+        if generation != await self.generation(agent_id):
+            self._stats.stale_writes += 1
+            return
+        now = datetime.utcnow()
+        await self.collection.update_one(
+            {"agent_id": agent_id, "query": normalized_query},
+            {"$set": {
+                "embedding": _normalize(query_embedding).tolist(),
+                "response": response.model_dump(),
+                "generation": generation,
+                "last_hit_at": now,
+                "expires_at": now + timedelta(seconds=self.ttl_seconds),
+            }},
+            upsert=True,
+        )
+        # Si la invalidación llegó entre la comprobación y la escritura, su borrado pudo ir antes:
+        # se quita la entrada recién escrita (solo si sigue siendo la de esta generación)
+        if generation != await self.generation(agent_id):
+            await self.collection.delete_one({"agent_id": agent_id, "query": normalized_query, "generation": generation})
+            self._stats.stale_writes += 1
+            return
+        # Recorta las entradas menos usadas del agente si supera el máximo
+        stale = await self.collection.find(
+            {"agent_id": agent_id}, {"_id": 1}
+        ).sort("last_hit_at", DESCENDING).skip(self.max_entries_per_agent).to_list(length=None)
+        if stale:
+            result = await self.collection.delete_many({"_id": {"$in": [entry["_id"] for entry in stale]}})
+            self._stats.evictions += result.deleted_count
+
+    async def invalidate_agent(self, agent_id: str) -> None:
+        # Primero la generación: desde aquí ningún put empezado antes puede dejar su entrada
+        await self.generations.update_one({"_id": agent_id}, {"$inc": {"generation": 1}}, upsert=True)
+        await self.collection.delete_many({"agent_id": agent_id})
+        self._stats.invalidations += 1
+
+    def stats(self) -> dict:
+        return {"backend": "mongo", "vector_search": bool(self._vector_search), **self._stats.as_dict()}
@@ -0,0 +1,89 @@
+from motor.motor_asyncio import AsyncIOMotorCollection
+from typing import Dict, List, Optional, Set
+from pymongo import ASCENDING, UpdateOne
+
+from app.core.domain.vector_model import VectorRecord, VectorSearchResult
+from app.core.ports.vector_store_port import IVectorStore
+
+class AtlasVectorStore(IVectorStore):
+    """
+    Adaptador sobre MongoDB Atlas Vector Search. Los chunks se guardan con el mismo formato
+    que MongoDBAtlasVectorSearch de LangChain: texto, embedding y la metadata en el nivel superior.
+    """
+
+    def __init__(self, collection: AsyncIOMotorCollection, index_name: str, text_key: str = "text", embedding_key: str = "embedding"):
+        self.collection = collection
+        self.index_name = index_name
+        self.text_key = text_key
+        self.embedding_key = embedding_key
+
+    async def initialize(self) -> None:
+        await self.collection.create_index([("document_id", ASCENDING), ("chunk_hash", ASCENDING)])
+        await self.collection.create_index([("agent_id", ASCENDING), ("source", ASCENDING)])
+
+    async def close(self) -> None:
+        # El cliente de Motor lo cierra el registro de clientes
+        pass
+
+    async def add(self, records: List[VectorRecord]) -> int:
+        if not records:
+            return 0
+        result = await self.collection.insert_many(
+            [{self.text_key: record.text, self.embedding_key: record.embedding, **record.metadata} for record in records],
+            ordered=False,
+        )
+        return len(result.inserted_ids)
+
+    async def search(
+        self,
+        agent_id: str,
+        query_embedding: List[float],
+        k: int,
+        filter: Optional[dict] = None,
+        include_embeddings: bool = False,
+    ) -> List[VectorSearchResult]:
+        pipeline = [
+            {"$vectorSearch": {
+                "index": self.index_name,
+                "path": self.embedding_key,
+                "queryVector": query_embedding,
+                "numCandidates": k * 10,
+                "limit": k,
+                "filter": {"agent_id": agent_id, **(filter or {})},
+            }},
+            {"$set": {"score": {"$meta": "vectorSearchScore"}}},
+            {"$project": {"_id": 0} if include_embeddings else {"_id": 0, self.embedding_key: 0}},
+        ]
+        results = []
+        async for document in self.collection.aggregate(pipeline):
+            results.append(VectorSearchResult(
+                text=document.pop(self.text_key, ""),
+                score=document.pop("score"),
+                embedding=document.pop(self.embedding_key, None),
+                metadata=document,
+            ))
+        return results
+
+    async def delete(self, filter: dict) -> int:
+        result = await self.collection.delete_many(filter)
+        return result.deleted_count
+
+    async def get_chunk_hashes(self, agent_id: str, document_id: str) -> Set[str]:
+        cursor = self.collection.find({"document_id": document_id, "chunk_hash": {"$exists": True}}, {"_id": 0, "chunk_hash": 1})
+        return {record["chunk_hash"] async for record in cursor}
+
+    async def update_chunks(self, agent_id: str, document_id: str, updates: Dict[str, dict]) -> int:
+        if not updates:
+            return 0
+        result = await self.collection.bulk_write(
+            [UpdateOne({"document_id": document_id, "chunk_hash": chunk_hash}, {"$set": fields}) for chunk_hash, fields in updates.items()],
+            ordered=False,
+        )
+        return result.modified_count
+
+    async def list_sources(self) -> Dict[str, Set[str]]:
+        pipeline = [{"$group": {"_id": {"agent_id": "$agent_id", "source": "$source"}}}]
+        sources: Dict[str, Set[str]] = {}
+        async for group in self.collection.aggregate(pipeline):
+            sources.setdefault(group["_id"].get("agent_id"), set()).add(group["_id"].get("source"))
+        return sources
@@ -0,0 +1,177 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from app.core.domain.agent_model import AgentCreate, AgentUpdate, Document
+from app.core.ports.agent_repository_port import IAgentRepository
+
+
+class AgentCache:
+    """
+    LRU con TTL compartida por todo el proceso. Guarda los agentes (documento completo o
+    solo lo que necesita el chat) por (tipo de lectura, agent_id). El TTL acota cuánto puede quedar
+    desactualizada respecto a escrituras hechas desde otros procesos. Cada invalidación sube la
+    generación del agente: una lectura empezada antes no puede volver a guardar el valor antiguo.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[Any, float]]" = OrderedDict()
+        self._generations: Dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Tuple[str, str]) -> Tuple[bool, Any]:
+        entry = self._entries.get(key)
+        if entry is None or time.monotonic() - entry[1] > self.ttl_seconds:
+            self._entries.pop(key, None)
+            self.misses += 1
+            return False, None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return True, entry[0]
+
+    def generation(self, agent_id: str) -> int:
+        return self._generations.get(agent_id, 0)
+
+    def set(self, key: Tuple[str, str], value: Any, generation: Optional[int] = None):
+        # Con `generation` (leída antes de cargar el valor) no se guarda si el agente se invalidó entretanto
+        if generation is not None and generation != self.generation(key[1]):
+            return
+        self._entries[key] = (value, time.monotonic())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, agent_id: str):
+        self._generations[agent_id] = self.generation(agent_id) + 1
+        for key in [key for key in self._entries if key[1] == agent_id]:
+            del self._entries[key]
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+class CachedAgentRepository(IAgentRepository):
+    """
+    Repositorio de lectura a través de caché delante de otro IAgentRepository.
+    Las escrituras invalidan la caché compartida (write-through). Además, cada instancia
+    (se crea una por petición) comparte entre llamadas concurrentes la misma consulta en vuelo.
+    Los diccionarios devueltos se comparten entre llamadas: no deben modificarse.
+    """
+
+    def __init__(self, inner: IAgentRepository, cache: AgentCache):
+        self.inner = inner
+        self.cache = cache
+        self._in_flight: Dict[Tuple[str, str], "asyncio.Future"] = {}
+
+    async def _read_through(self, key: Tuple[str, str], load: Callable[[], Awaitable[Any]]) -> Any:
+        found, value = self.cache.get(key)
+        if found:
+            return value
+        if key in self._in_flight:
+            return await self._in_flight[key]
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        # Si una escritura invalida el agente mientras se carga, el valor leído puede ser el anterior
+        generation = self.cache.generation(key[1])
+        try:
+            value = await load()
+            # No se cachean los "no existe" para que un agente recién creado se vea enseguida
+            if value is not None:
+                self.cache.set(key, value, generation)
+            future.set_result(value)
+            return value
+        except Exception as e:
+            future.set_exception(e)
+            # Evita el aviso de "excepción no recuperada" si nadie más esperaba el futuro
+            future.exception()
+            raise
+        finally:
+            self._in_flight.pop(key, None)
+
+    def _invalidate(self, agent_id: str):
+        self.cache.invalidate(agent_id)
+        for key in [key for key in self._in_flight if key[1] == agent_id]:
+            del self._in_flight[key]
+
+    async def create_agent(self, agent_data: AgentCreate) -> dict:
+        return await self.inner.create_agent(agent_data)
+
+    async def find_agent_by_id(self, agent_id: str) -> Optional[dict]:
+        return await self._read_through(("agent", agent_id), lambda: self.inner.find_agent_by_id(agent_id))
+
+    async def find_chat_settings(self, agent_id: str) -> Optional[dict]:
+        # Si el agente completo ya está en caché no hace falta otra consulta
+        found, agent = self.cache.get(("agent", agent_id))
+        if found:
+            return {"prompt": agent["prompt"], "index_version": agent.get("index_version", 0)}
+        return await self._read_through(("chat", agent_id), lambda: self.inner.find_chat_settings(agent_id))
+
+    async def get_all_agents(self, limit: Optional[int] = None, after: Optional[str] = None, fields: Optional[List[str]] = None) -> List[dict]:
+        return await self.inner.get_all_agents(limit, after, fields)
+
+    def iter_agents(self, limit: Optional[int] = None, after: Optional[str] = None, fields: Optional[List[str]] = None) -> AsyncIterator[dict]:
+        return self.inner.iter_agents(limit, after, fields)
+
+    async def update_agent(self, agent_id: str, update_data: AgentUpdate) -> Optional[dict]:
+        updated = await self.inner.update_agent(agent_id, update_data)
+        self._invalidate(agent_id)
+        return updated
+
+    async def add_document_to_agent(self, agent_id: str, document: Document) -> bool:
+        added = await self.inner.add_document_to_agent(agent_id, document)
+        self._invalidate(agent_id)
+        return added
+
+    async def add_documents_to_agent(self, agent_id: str, documents: List[Document]) -> int:
+        added = await self.inner.add_documents_to_agent(agent_id, documents)
+        self._invalidate(agent_id)
+        return added
+
+    async def list_documents(self, agent_id: str, limit: int, after: Optional[str] = None) -> List[dict]:
+        return await self.inner.list_documents(agent_id, limit, after)
+
+    async def remove_document_from_agent(self, agent_id: str, file_name: str) -> bool:
+        removed = await self.inner.remove_document_from_agent(agent_id, file_name)
+        self._invalidate(agent_id)
+        return removed
+
+    # Las versiones de los documentos no pasan por la caché: las búsquedas tienen que ver
+    # enseguida una versión recién activada u ocultada
+
+    async def start_document_version(self, agent_id: str, file_name: str, index_version: int, version: int) -> bool:
+        return await self.inner.start_document_version(agent_id, file_name, index_version, version)
+
+    async def activate_document_version(self, agent_id: str, file_name: str, index_version: int, version: int) -> List[int]:
+        return await self.inner.activate_document_version(agent_id, file_name, index_version, version)
+
+    async def release_document_versions(self, agent_id: str, file_name: str, versions: List[int]) -> None:
+        await self.inner.release_document_versions(agent_id, file_name, versions)
+
+    async def find_hidden_versions(self, agent_id: str) -> List[int]:
+        return await self.inner.find_hidden_versions(agent_id)
+
+    async def start_reindex(self, agent_id: str, reindex: dict) -> bool:
+        started = await self.inner.start_reindex(agent_id, reindex)
+        self._invalidate(agent_id)
+        return started
+
+    async def update_reindex(self, agent_id: str, index_version: int, fields: dict) -> bool:
+        updated = await self.inner.update_reindex(agent_id, index_version, fields)
+        self._invalidate(agent_id)
+        return updated
+
+    async def switch_index_version(self, agent_id: str, index_version: int) -> bool:
+        # Otros procesos siguen viendo la versión anterior hasta que caduca su caché (TTL)
+        switched = await self.inner.switch_index_version(agent_id, index_version)
+        self._invalidate(agent_id)
+        return switched
+
+    async def delete_agent(self, agent_id: str) -> bool:
+        deleted = await self.inner.delete_agent(agent_id)
+        self._invalidate(agent_id)
+        return deleted
@@ -0,0 +1,61 @@
+import os
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from typing import List, Optional
+from datetime import datetime, timedelta
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from app.core.ports.chat_session_repository_port import IChatSessionRepository
+
+# Las sesiones sin actividad durante este tiempo las borra un índice TTL
+CHAT_SESSION_TTL_SECONDS = int(os.getenv("CHAT_SESSION_TTL_SECONDS", str(7 * 24 * 3600)))
+# Turnos sin resumir que se guardan como máximo si el resumen se retrasa o falla
+CHAT_SESSION_MAX_PENDING_TURNS = 50
+
+class ChatSessionRepository(IChatSessionRepository):
+    def __init__(self, db: AsyncIOMotorDatabase):
+        self.collection = db.chat_sessions
+
+    async def ensure_indexes(self):
+        await self.collection.create_index([("agent_id", ASCENDING), ("session_id", ASCENDING)], unique=True)
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    async def find_session(self, agent_id: str, session_id: str) -> Optional[dict]:
+        return await self.collection.find_one({"agent_id": agent_id, "session_id": session_id}, {"_id": 0, "expires_at": 0})
+
+    async def append_turn(self, agent_id: str, session_id: str, turn: dict) -> dict:
+        now = datetime.utcnow()
+        update = {
+            "$push": {"turns": {"$each": [turn], "$slice": -CHAT_SESSION_MAX_PENDING_TURNS}},
+            "$set": {"updated_at": now, "expires_at": now + timedelta(seconds=CHAT_SESSION_TTL_SECONDS)},
+            "$setOnInsert": {"summary": "", "summarized_turns": 0, "created_at": now},
+        }
+        query = {"agent_id": agent_id, "session_id": session_id}
+        try:
+            return await self.collection.find_one_and_update(
+                query, update, upsert=True, return_document=ReturnDocument.AFTER, projection={"_id": 0, "expires_at": 0},
+            )
+        except DuplicateKeyError:
+            # Dos primeros turnos a la vez: el otro creó la sesión, así que ya solo hay que añadir
+            return await self.collection.find_one_and_update(
+                query, update, return_document=ReturnDocument.AFTER, projection={"_id": 0, "expires_at": 0},
+            )
+
+    async def apply_summary(self, agent_id: str, session_id: str, summarized_turns: int, summary: str, turn_ids: List[str]) -> bool:
+        result = await self.collection.update_one(
+            {"agent_id": agent_id, "session_id": session_id, "summarized_turns": summarized_turns},
+            {
+                "$set": {"summary": summary},
+                "$inc": {"summarized_turns": len(turn_ids)},
+                "$pull": {"turns": {"id": {"$in": turn_ids}}},
+            },
+        )
+        return result.modified_count == 1
+
+    async def delete_session(self, agent_id: str, session_id: str) -> bool:
+        result = await self.collection.delete_one({"agent_id": agent_id, "session_id": session_id})
+        return result.deleted_count == 1
+
+    async def delete_agent_sessions(self, agent_id: str) -> int:
+        result = await self.collection.delete_many({"agent_id": agent_id})
+        return result.deleted_count
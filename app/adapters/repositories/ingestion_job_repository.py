@@ -0,0 +1,228 @@
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from bson import ObjectId
+from typing import Dict, List, Optional, Tuple
+from datetime import datetime, timedelta
+from pymongo import ASCENDING, DESCENDING, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from app.core.domain.job_model import JobKind, JobStatus
+from app.core.ports.ingestion_job_repository_port import IIngestionJobRepository
+
+class IngestionJobRepository(IIngestionJobRepository):
+    def __init__(self, db: AsyncIOMotorDatabase):
+        self.collection = db.ingestion_jobs
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("idempotency_key", unique=True)
+        await self.collection.create_index([("status", ASCENDING), ("available_at", ASCENDING)])
+        await self.collection.create_index([("agent_id", ASCENDING), ("file_name", ASCENDING), ("created_at", DESCENDING)])
+        await self.collection.create_index([("agent_id", ASCENDING), ("file_name", ASCENDING), ("enqueued_at", DESCENDING)])
+        await self.collection.create_index([("batch_id", ASCENDING), ("status", ASCENDING)])
+
+    def _new_job(self, agent_id: str, file_name: str, max_attempts: int, now: datetime) -> dict:
+        return {
+            "agent_id": agent_id,
+            "file_name": file_name,
+            "status": JobStatus.QUEUED.value,
+            "attempts": 0,
+            "max_attempts": max_attempts,
+            "progress": {},
+            "error": None,
+            "created_at": now,
+            "updated_at": now,
+            "available_at": now,
+            "enqueued_at": now,
+        }
+
+    def _requeue(self, now: datetime) -> dict:
+        # Un trabajo fallido (o ya hecho, si el blob se sobrescribió) se vuelve a encolar desde cero
+        return {"$set": {
+            "status": JobStatus.QUEUED.value,
+            "attempts": 0,
+            "error": None,
+            "progress": {},
+            "updated_at": now,
+            "available_at": now,
+            "enqueued_at": now,
+        }}
+
+    async def _overwritten(self, job: dict) -> bool:
+        # Otro trabajo del mismo archivo se encoló después: el blob ya no tiene el contenido de `job`.
+        # Los trabajos anteriores a `enqueued_at` se comparan por su created_at
+        enqueued_at = job.get("enqueued_at", job["created_at"])
+        later = await self.collection.find_one({
+            "agent_id": job["agent_id"],
+            "file_name": job["file_name"],
+            "index_version": job.get("index_version"),
+            "_id": {"$ne": job["_id"]},
+            "$or": [
+                {"enqueued_at": {"$gt": enqueued_at}},
+                {"enqueued_at": {"$exists": False}, "created_at": {"$gt": enqueued_at}},
+            ],
+        }, {"_id": 1})
+        return later is not None
+
+    async def _requeue_if_stale(self, job: dict, now: datetime) -> dict:
+        # La clave de idempotencia solo evita reprocesar el mismo contenido si sigue siendo el del blob:
+        # subir X, sobrescribir con Y y volver a subir X tiene que volver a ingerir X
+        stale = job["status"] == JobStatus.FAILED.value or (job["status"] == JobStatus.DONE.value and await self._overwritten(job))
+        if not stale:
+            return job
+        return await self.collection.find_one_and_update(
+            {"_id": job["_id"], "status": job["status"]},
+            self._requeue(now),
+            return_document=ReturnDocument.AFTER,
+        ) or job
+
+    async def enqueue(self, agent_id: str, file_name: str, idempotency_key: str, max_attempts: int) -> dict:
+        now = datetime.utcnow()
+        try:
+            # Si ya existe un trabajo con la misma clave (mismo agente, archivo y contenido) se reutiliza
+            job = await self.collection.find_one_and_update(
+                {"idempotency_key": idempotency_key},
+                {"$setOnInsert": self._new_job(agent_id, file_name, max_attempts, now)},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            job = await self.collection.find_one({"idempotency_key": idempotency_key})
+        return await self._requeue_if_stale(job, now)
+
+    async def enqueue_many(
+        self,
+        agent_id: str,
+        files: List[Tuple[str, str]],
+        max_attempts: int,
+        batch_id: str,
+        index_version: Optional[int] = None,
+    ) -> int:
+        if not files:
+            return 0
+        now = datetime.utcnow()
+        operations = [
+            UpdateOne(
+                {"idempotency_key": idempotency_key},
+                {
+                    "$setOnInsert": {**self._new_job(agent_id, file_name, max_attempts, now), "index_version": index_version},
+                    "$set": {"batch_id": batch_id},
+                },
+                upsert=True,
+            )
+            for file_name, idempotency_key in files
+        ]
+        try:
+            await self.collection.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            if any(error.get("code") != 11000 for error in errors):
+                raise
+            # Otra subida insertó la misma clave a la vez: ahora el upsert encuentra su trabajo
+            await self.collection.bulk_write([operations[error["index"]] for error in errors], ordered=False)
+        await self.collection.update_many({"batch_id": batch_id, "status": JobStatus.FAILED.value}, self._requeue(now))
+        async for job in self.collection.find({"batch_id": batch_id, "status": JobStatus.DONE.value}):
+            await self._requeue_if_stale(job, now)
+        return len(operations)
+
+    async def enqueue_agent_cleanup(self, agent_id: str, max_attempts: int) -> dict:
+        now = datetime.utcnow()
+        idempotency_key = f"delete-agent/{agent_id}"
+        new_job = {**self._new_job(agent_id, "", max_attempts, now), "kind": JobKind.DELETE_AGENT.value}
+        try:
+            job = await self.collection.find_one_and_update(
+                {"idempotency_key": idempotency_key},
+                {"$setOnInsert": new_job},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            job = await self.collection.find_one({"idempotency_key": idempotency_key})
+
+        # Un borrado que agotó sus intentos (o ya terminó) se vuelve a lanzar desde cero
+        if job["status"] in (JobStatus.FAILED.value, JobStatus.DONE.value):
+            job = await self.collection.find_one_and_update(
+                {"_id": job["_id"], "status": job["status"]},
+                self._requeue(now),
+                return_document=ReturnDocument.AFTER,
+            ) or job
+        return job
+
+    async def claim_next(self, worker_id: str, lease_seconds: int, batch_id: Optional[str] = None) -> Optional[dict]:
+        now = datetime.utcnow()
+        query = {"$or": [
+            {"status": JobStatus.QUEUED.value, "available_at": {"$lte": now}},
+            # Trabajos de un worker que murió sin terminar: su lease ya caducó
+            {"status": JobStatus.RUNNING.value, "lease_expires_at": {"$lt": now}},
+        ]}
+        if batch_id is not None:
+            query["batch_id"] = batch_id
+        return await self.collection.find_one_and_update(
+            query,
+            {
+                "$set": {
+                    "status": JobStatus.RUNNING.value,
+                    "worker_id": worker_id,
+                    "lease_expires_at": now + timedelta(seconds=lease_seconds),
+                    "updated_at": now,
+                },
+                "$inc": {"attempts": 1},
+            },
+            sort=[("available_at", ASCENDING)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def extend_lease(self, job_id: str, worker_id: str, lease_seconds: int) -> bool:
+        now = datetime.utcnow()
+        result = await self.collection.update_one(
+            {"_id": ObjectId(job_id), "worker_id": worker_id, "status": JobStatus.RUNNING.value},
+            {"$set": {"lease_expires_at": now + timedelta(seconds=lease_seconds), "updated_at": now}},
+        )
+        return result.modified_count > 0
+
+    async def update_progress(self, job_id: str, progress: dict) -> None:
+        await self.collection.update_one(
+            {"_id": ObjectId(job_id)},
+            {"$set": {"progress": progress, "updated_at": datetime.utcnow()}},
+        )
+
+    async def mark_done(self, job_id: str) -> None:
+        await self.collection.update_one(
+            {"_id": ObjectId(job_id)},
+            {"$set": {"status": JobStatus.DONE.value, "error": None, "updated_at": datetime.utcnow()},
+             "$unset": {"lease_expires_at": "", "worker_id": ""}},
+        )
+
+    async def mark_failed(self, job_id: str, error: str, retry_at: Optional[datetime] = None) -> None:
+        # Con retry_at el trabajo vuelve a la cola; sin él queda fallido definitivamente
+        status = JobStatus.QUEUED if retry_at else JobStatus.FAILED
+        update = {"status": status.value, "error": error, "updated_at": datetime.utcnow()}
+        if retry_at:
+            update["available_at"] = retry_at
+        await self.collection.update_one(
+            {"_id": ObjectId(job_id)},
+            {"$set": update, "$unset": {"lease_expires_at": "", "worker_id": ""}},
+        )
+
+    async def find_latest(self, agent_id: str, file_name: str) -> Optional[dict]:
+        return await self.collection.find_one(
+            {"agent_id": agent_id, "file_name": file_name},
+            # Un trabajo reencolado tras sobrescribir el blob es el último aunque se creara antes
+            sort=[("enqueued_at", DESCENDING), ("created_at", DESCENDING)],
+        )
+
+    async def find_batch(self, agent_id: str, batch_id: str) -> List[dict]:
+        cursor = self.collection.find({"agent_id": agent_id, "batch_id": batch_id}).sort("file_name", ASCENDING)
+        return await cursor.to_list(length=None)
+
+    async def summarize_batch(self, agent_id: str, batch_id: str) -> Dict[str, dict]:
+        pipeline = [
+            {"$match": {"agent_id": agent_id, "batch_id": batch_id}},
+            {"$group": {"_id": "$status", "files": {"$sum": 1}, "chunks": {"$sum": {"$ifNull": ["$progress.chunks", 0]}}}},
+        ]
+        return {group["_id"]: {"files": group["files"], "chunks": group["chunks"]} async for group in self.collection.aggregate(pipeline)}
+
+    async def delete_jobs(self, agent_id: str, file_name: Optional[str] = None) -> int:
+        query = {"agent_id": agent_id}
+        if file_name is not None:
+            query["file_name"] = file_name
+        result = await self.collection.delete_many(query)
+        return result.deleted_count
@@ -0,0 +1,501 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from app.core.domain.vector_model import VectorRecord, VectorSearchResult
+from app.core.ports.vector_store_port import IVectorStore
+
+SUPPORTED_OPERATORS = {"$ne", "$in", "$nin", "$exists"}
+# Campos de la metadata que se guardan además como columnas de códigos enteros: los filtros sobre
+# ellos se evalúan con máscaras de NumPy en lugar de recorrer la metadata fila a fila
+COLUMN_FIELDS = ("agent_id", "index_version", "document_id", "source", "version")
+# Código de un campo ausente y de un valor que no se puede codificar (p. ej. una lista)
+MISSING = -1
+OPAQUE = -2
+# Segmento de las filas que aún no se han escrito a disco
+UNSAVED = -1
+# Con más segmentos que estos, el siguiente volcado los funde en uno solo
+MAX_SEGMENTS = 16
+
+
+def matches_filter(metadata: dict, filter: dict) -> bool:
+    """
+    Evalúa sobre la metadata de un chunk el subconjunto de filtros de MongoDB que admite el puerto.
+    """
+    for key, condition in filter.items():
+        if key == "$or":
+            if not any(matches_filter(metadata, branch) for branch in condition):
+                return False
+            continue
+        present = key in metadata
+        # Igual que en MongoDB, un campo ausente se compara como null: {"campo": None} y
+        # {"$in": [None]} lo aceptan, y $ne / $nin lo aceptan salvo que incluyan None
+        value = metadata.get(key)
+        if isinstance(condition, dict) and condition and all(op.startswith("$") for op in condition):
+            for op, operand in condition.items():
+                if op not in SUPPORTED_OPERATORS:
+                    raise ValueError(f"Unsupported filter operator: {op}")
+                if op == "$ne" and value == operand:
+                    return False
+                if op == "$in" and value not in operand:
+                    return False
+                if op == "$nin" and value in operand:
+                    return False
+                if op == "$exists" and present != bool(operand):
+                    return False
+        elif value != condition:
+            return False
+    return True
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _grow(buffer: np.ndarray, size: int, needed: int, width: int, dtype) -> np.ndarray:
+    capacity = max(needed, 2 * len(buffer), 64)
+    grown = np.empty((capacity, width), dtype=dtype)
+    if size:
+        grown[:size] = buffer[:size]
+    return grown
+
+
+class _Partition:
+    """
+    Los chunks de un agente: una matriz float32 contigua (filas normalizadas) con capacidad
+    de reserva para añadir sin copiar, más el texto y la metadata de cada fila.
+    Recién cargada, la matriz es un memmap de solo lectura; se copia a memoria al modificarla.
+    Los campos de COLUMN_FIELDS se codifican también en `codes` (un entero por fila y campo,
+    con un vocabulario por campo) para filtrar sin tocar la metadata.
+    En disco la partición es una lista de segmentos; `row_segments` dice en cuál está cada fila
+    (UNSAVED si aún en ninguno) y `changed` qué segmentos tienen filas borradas o modificadas.
+    """
+
+    def __init__(
+        self, buffer: np.ndarray, size: int, texts: List[str], metadata: List[dict],
+        segments: List[int], row_segments: np.ndarray, next_segment: int, legacy_generation: Optional[int] = None,
+    ):
+        self.buffer = buffer
+        self.size = size
+        self.texts = texts
+        self.metadata = metadata
+        self.segments = segments
+        self.row_segments = row_segments
+        self.next_segment = next_segment
+        self.changed: Set[int] = set()
+        # Archivo de vectores del formato anterior (un único JSON con textos y metadata), que se
+        # borra tras el primer volcado
+        self.legacy_generation = legacy_generation
+        self.lock = asyncio.Lock()
+        self.vocabularies: List[Dict[Any, int]] = [{} for _ in COLUMN_FIELDS]
+        self.codes = self._encode(metadata)
+
+    @property
+    def vectors(self) -> np.ndarray:
+        return self.buffer[:self.size]
+
+    @property
+    def columns(self) -> np.ndarray:
+        return self.codes[:self.size]
+
+    def _code(self, column: int, metadata: dict) -> int:
+        field = COLUMN_FIELDS[column]
+        if field not in metadata:
+            return MISSING
+        vocabulary = self.vocabularies[column]
+        try:
+            return vocabulary.setdefault(metadata[field], len(vocabulary))
+        except TypeError:
+            return OPAQUE
+
+    def _encode(self, metadata: List[dict]) -> np.ndarray:
+        codes = np.empty((len(metadata), len(COLUMN_FIELDS)), dtype=np.int64)
+        for row, item in enumerate(metadata):
+            for column in range(len(COLUMN_FIELDS)):
+                codes[row, column] = self._code(column, item)
+        return codes
+
+    def recode(self, row: int):
+        # Tras cambiar la metadata de una fila (p. ej. su `version`)
+        for column in range(len(COLUMN_FIELDS)):
+            self.codes[row, column] = self._code(column, self.metadata[row])
+        if self.row_segments[row] != UNSAVED:
+            self.changed.add(int(self.row_segments[row]))
+
+    def _column_mask(self, codes: np.ndarray, key: str, condition: Any) -> Optional[np.ndarray]:
+        """
+        Máscara de las filas que cumplen `condition` sobre `key`, o None si no se puede evaluar
+        con las columnas (campo sin columna, operador no soportado o valores no codificables).
+        """
+        if key not in COLUMN_FIELDS:
+            return None
+        column = COLUMN_FIELDS.index(key)
+        values = codes[:, column]
+        if np.any(values == OPAQUE):
+            return None
+        vocabulary = self.vocabularies[column]
+
+        def isin(operand: list) -> np.ndarray:
+            # Igual que en MongoDB, None también acepta el campo ausente
+            wanted = [vocabulary[value] for value in operand if _hashable(value) and value in vocabulary]
+            if any(value is None for value in operand):
+                wanted.append(MISSING)
+            return np.isin(values, wanted)
+
+        if not (isinstance(condition, dict) and condition and all(op.startswith("$") for op in condition)):
+            if isinstance(condition, (dict, list)):
+                return None
+            return isin([condition])
+        mask = np.ones(len(values), dtype=bool)
+        for op, operand in condition.items():
+            if op in ("$in", "$nin") and not isinstance(operand, list):
+                return None
+            if op == "$ne":
+                mask &= ~isin([operand])
+            elif op == "$in":
+                mask &= isin(operand)
+            elif op == "$nin":
+                mask &= ~isin(operand)
+            elif op == "$exists":
+                mask &= (values != MISSING) == bool(operand)
+            else:
+                return None
+        return mask
+
+    def filter_mask(self, codes: np.ndarray, metadata: List[dict], filter: dict) -> np.ndarray:
+        """
+        Filas de la instantánea (`codes`, `metadata`) que cumplen `filter`. Las condiciones sobre
+        columnas se evalúan vectorizadas; solo las demás (p. ej. $or) se comprueban fila a fila,
+        y únicamente en las filas que ya pasaron las vectorizadas.
+        """
+        mask = np.ones(len(codes), dtype=bool)
+        remaining = {}
+        for key, condition in filter.items():
+            column_mask = self._column_mask(codes, key, condition)
+            if column_mask is None:
+                remaining[key] = condition
+            else:
+                mask &= column_mask
+        if remaining:
+            for row in np.flatnonzero(mask):
+                if not matches_filter(metadata[row], remaining):
+                    mask[row] = False
+        return mask
+
+    def append(self, rows: np.ndarray, texts: List[str], metadata: List[dict]):
+        needed = self.size + len(rows)
+        if isinstance(self.buffer, np.memmap) or needed > len(self.buffer) or self.buffer.shape[1] != rows.shape[1]:
+            self.buffer = _grow(self.buffer, self.size, needed, rows.shape[1], np.float32)
+        if needed > len(self.codes):
+            self.codes = _grow(self.codes, self.size, needed, len(COLUMN_FIELDS), np.int64)
+            grown = np.empty(len(self.codes), dtype=np.int64)
+            grown[:self.size] = self.row_segments[:self.size]
+            self.row_segments = grown
+        # Se escribe más allá de `size`: las búsquedas en curso siguen viendo su vista anterior
+        self.buffer[self.size:needed] = rows
+        self.codes[self.size:needed] = self._encode(metadata)
+        self.row_segments[self.size:needed] = UNSAVED
+        self.texts.extend(texts)
+        self.metadata.extend(metadata)
+        self.size = needed
+
+    def keep(self, mask: np.ndarray):
+        # Compacta en arrays nuevos para no alterar lo que estén leyendo otras búsquedas
+        row_segments = self.row_segments[:self.size]
+        self.changed.update(int(segment) for segment in np.unique(row_segments[~mask]) if segment != UNSAVED)
+        self.row_segments = row_segments[mask].copy()
+        self.buffer = np.ascontiguousarray(self.vectors[mask])
+        self.codes = np.ascontiguousarray(self.columns[mask])
+        self.texts = [text for text, kept in zip(self.texts, mask) if kept]
+        self.metadata = [metadata for metadata, kept in zip(self.metadata, mask) if kept]
+        self.size = len(self.texts)
+
+    def plan_flush(self) -> Tuple[List[Tuple[int, np.ndarray]], List[int], List[int]]:
+        """
+        Qué escribir en el siguiente volcado: las filas nuevas van a un segmento nuevo y los
+        segmentos con cambios se reescriben enteros con otro nombre; el resto no se toca.
+        Devuelve los segmentos a escribir (con sus filas), la lista resultante y los que sobran.
+        """
+        row_segments = self.row_segments[:self.size]
+        if len(self.segments) >= MAX_SEGMENTS:
+            # Demasiados segmentos pequeños: se funden todos en uno
+            rows = np.arange(self.size)
+            return ([(self.next_segment, rows)] if self.size else []), ([self.next_segment] if self.size else []), list(self.segments)
+
+        writes, segments, removed = [], [], []
+        name = self.next_segment
+        for segment in self.segments:
+            if segment not in self.changed:
+                segments.append(segment)
+                continue
+            removed.append(segment)
+            rows = np.flatnonzero(row_segments == segment)
+            if len(rows):
+                writes.append((name, rows))
+                segments.append(name)
+                name += 1
+        rows = np.flatnonzero(row_segments == UNSAVED)
+        if len(rows):
+            writes.append((name, rows))
+            segments.append(name)
+        return writes, segments, removed
+
+    def saved(self, writes: List[Tuple[int, np.ndarray]], segments: List[int]):
+        for name, rows in writes:
+            self.row_segments[rows] = name
+        self.segments = segments
+        self.next_segment = max([self.next_segment - 1, *segments]) + 1
+        self.changed.clear()
+        self.legacy_generation = None
+
+
+def _hashable(value: Any) -> bool:
+    try:
+        hash(value)
+    except TypeError:
+        return False
+    return True
+
+
+class NumpyVectorStore(IVectorStore):
+    """
+    Índice vectorial en el propio proceso, particionado por agent_id. La búsqueda top-k es un
+    producto matriz-vector vectorizado sobre la partición del agente. Cada partición se persiste
+    en `directory` como segmentos (vectores float32 en crudo + textos y metadata en JSON) que
+    lista un manifiesto pequeño, y se carga la primera vez que se usa (como memmap si tiene un
+    solo segmento). Las escrituras se agrupan y se vuelcan a disco `flush_delay` segundos después
+    (y siempre en `close()`): cada volcado escribe solo las filas nuevas y los segmentos con
+    borrados o cambios de metadata, y después sustituye el manifiesto de forma atómica.
+    El índice es local al proceso: no lo comparten réplicas ni workers independientes.
+    """
+
+    def __init__(self, directory: str, flush_delay: float = 1.0):
+        self.directory = directory
+        self.flush_delay = flush_delay
+        self._partitions: Dict[str, _Partition] = {}
+        self._load_lock = asyncio.Lock()
+        self._dirty: Set[str] = set()
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def _base_path(self, agent_id: str) -> str:
+        safe = agent_id if re.fullmatch(r"[A-Za-z0-9_-]+", agent_id) else hashlib.sha256(agent_id.encode()).hexdigest()
+        return os.path.join(self.directory, safe)
+
+    def _read_partition(self, agent_id: str) -> _Partition:
+        base = self._base_path(agent_id)
+        meta_path = f"{base}.json"
+        if not os.path.exists(meta_path):
+            return _Partition(np.empty((0, 0), dtype=np.float32), 0, [], [], [], np.empty(0, dtype=np.int64), 0)
+        with open(meta_path, encoding="utf-8") as meta_file:
+            meta = json.load(meta_file)
+        dimensions = meta["dimensions"]
+        if "segments" not in meta:
+            # Formato anterior: todo se vuelve a escribir como segmentos en el primer volcado
+            size = meta["size"]
+            if size:
+                buffer = np.memmap(f"{base}.{meta['generation']}.f32", dtype=np.float32, mode="r", shape=(size, dimensions))
+            else:
+                buffer = np.empty((0, dimensions), dtype=np.float32)
+            return _Partition(
+                buffer, size, meta["texts"], meta["metadata"], [], np.full(size, UNSAVED, dtype=np.int64), meta["generation"] + 1, meta["generation"],
+            )
+
+        vectors, texts, metadata, row_segments = [], [], [], []
+        for segment in meta["segments"]:
+            with open(f"{base}.{segment}.rows", encoding="utf-8") as rows_file:
+                rows = json.load(rows_file)
+            size = len(rows["texts"])
+            vectors.append(np.memmap(f"{base}.{segment}.f32", dtype=np.float32, mode="r", shape=(size, dimensions)))
+            texts.extend(rows["texts"])
+            metadata.extend(rows["metadata"])
+            row_segments.append(np.full(size, segment, dtype=np.int64))
+        if len(vectors) == 1:
+            buffer = vectors[0]
+        elif vectors:
+            buffer = np.concatenate(vectors)
+        else:
+            buffer = np.empty((0, dimensions), dtype=np.float32)
+        row_segments = np.concatenate(row_segments) if row_segments else np.empty(0, dtype=np.int64)
+        return _Partition(buffer, len(texts), texts, metadata, list(meta["segments"]), row_segments, meta["next_segment"])
+
+    def _write_partition(
+        self, agent_id: str, writes: List[Tuple[int, np.ndarray, List[str], List[dict]]], segments: List[int],
+        removed: List[int], dimensions: int, next_segment: int, legacy_generation: Optional[int],
+    ):
+        # Los segmentos nuevos se escriben antes de sustituir el manifiesto que los referencia y
+        # los que sobran se borran después: si el proceso muere a mitad, el manifiesto anterior
+        # sigue apuntando a archivos completos (y el siguiente volcado reutiliza los nombres)
+        base = self._base_path(agent_id)
+        for segment, vectors, texts, metadata in writes:
+            np.ascontiguousarray(vectors, dtype=np.float32).tofile(f"{base}.{segment}.f32")
+            with open(f"{base}.{segment}.rows", "w", encoding="utf-8") as rows_file:
+                json.dump({"texts": texts, "metadata": metadata}, rows_file, ensure_ascii=False, default=str)
+        meta = {"agent_id": agent_id, "dimensions": dimensions, "segments": segments, "next_segment": next_segment}
+        with open(f"{base}.json.tmp", "w", encoding="utf-8") as meta_file:
+            json.dump(meta, meta_file)
+        os.replace(f"{base}.json.tmp", f"{base}.json")
+        stale = [f"{base}.{segment}.{extension}" for segment in removed for extension in ("f32", "rows")]
+        if legacy_generation is not None:
+            stale.append(f"{base}.{legacy_generation}.f32")
+        for path in stale:
+            if os.path.exists(path):
+                os.remove(path)
+
+    async def _partition(self, agent_id: str) -> _Partition:
+        partition = self._partitions.get(agent_id)
+        if partition is None:
+            async with self._load_lock:
+                partition = self._partitions.get(agent_id)
+                if partition is None:
+                    partition = await asyncio.to_thread(self._read_partition, agent_id)
+                    self._partitions[agent_id] = partition
+        return partition
+
+    async def _persist(self, agent_id: str, partition: _Partition):
+        plan, segments, removed = partition.plan_flush()
+        vectors = partition.vectors
+        writes = [
+            (name, vectors[rows], [partition.texts[row] for row in rows], [partition.metadata[row] for row in rows])
+            for name, rows in plan
+        ]
+        next_segment = max([partition.next_segment - 1, *segments]) + 1
+        await asyncio.to_thread(
+            self._write_partition, agent_id, writes, segments, removed, int(vectors.shape[1]), next_segment, partition.legacy_generation,
+        )
+        partition.saved(plan, segments)
+
+    def _mark_dirty(self, agent_id: str):
+        self._dirty.add(agent_id)
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_delay)
+        await self.flush()
+
+    async def flush(self):
+        while self._dirty:
+            agent_id = self._dirty.pop()
+            partition = self._partitions[agent_id]
+            async with partition.lock:
+                await self._persist(agent_id, partition)
+
+    def _stored_agent_ids(self) -> Set[str]:
+        agent_ids = set(self._partitions)
+        if os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                if name.endswith(".json"):
+                    with open(os.path.join(self.directory, name), encoding="utf-8") as meta_file:
+                        agent_ids.add(json.load(meta_file)["agent_id"])
+        return agent_ids
+
+    async def initialize(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+
+    async def close(self) -> None:
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+        await self.flush()
+
+    async def add(self, records: List[VectorRecord]) -> int:
+        by_agent: Dict[str, List[VectorRecord]] = {}
+        for record in records:
+            by_agent.setdefault(record.metadata["agent_id"], []).append(record)
+
+        for agent_id, agent_records in by_agent.items():
+            partition = await self._partition(agent_id)
+            rows = _normalize_rows(np.asarray([record.embedding for record in agent_records], dtype=np.float32))
+            async with partition.lock:
+                partition.append(rows, [record.text for record in agent_records], [dict(record.metadata) for record in agent_records])
+            self._mark_dirty(agent_id)
+        return len(records)
+
+    async def search(
+        self,
+        agent_id: str,
+        query_embedding: List[float],
+        k: int,
+        filter: Optional[dict] = None,
+        include_embeddings: bool = False,
+    ) -> List[VectorSearchResult]:
+        partition = await self._partition(agent_id)
+        # Instantánea: una escritura concurrente no cambia estas referencias
+        vectors, codes, texts, metadata = partition.vectors, partition.columns, partition.texts, partition.metadata
+        size = len(vectors)
+        if size == 0 or k <= 0:
+            return []
+
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query_norm = np.linalg.norm(query)
+        scores = vectors @ (query / query_norm if query_norm else query)
+        if filter:
+            mask = partition.filter_mask(codes, metadata, filter)
+            scores = np.where(mask, scores, -np.inf)
+
+        k = min(k, size)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [
+            VectorSearchResult(
+                text=texts[i],
+                metadata=dict(metadata[i]),
+                # Misma escala que el score de coseno de Atlas: (1 + coseno) / 2
+                score=float((1.0 + scores[i]) / 2.0),
+                embedding=vectors[i].tolist() if include_embeddings else None,
+            )
+            for i in top if np.isfinite(scores[i])
+        ]
+
+    async def delete(self, filter: dict) -> int:
+        agent_id = filter.get("agent_id")
+        agent_ids = [agent_id] if isinstance(agent_id, str) else await asyncio.to_thread(self._stored_agent_ids)
+        deleted = 0
+        for current in agent_ids:
+            partition = await self._partition(current)
+            async with partition.lock:
+                mask = ~partition.filter_mask(partition.columns, partition.metadata, filter)
+                removed = int(partition.size - mask.sum())
+                if removed:
+                    partition.keep(mask)
+            if removed:
+                self._mark_dirty(current)
+            deleted += removed
+        return deleted
+
+    async def get_chunk_hashes(self, agent_id: str, document_id: str) -> Set[str]:
+        partition = await self._partition(agent_id)
+        codes, metadata = partition.columns, partition.metadata
+        rows = np.flatnonzero(partition.filter_mask(codes, metadata, {"document_id": document_id}))
+        return {metadata[row]["chunk_hash"] for row in rows if "chunk_hash" in metadata[row]}
+
+    async def update_chunks(self, agent_id: str, document_id: str, updates: Dict[str, dict]) -> int:
+        if not updates:
+            return 0
+        partition = await self._partition(agent_id)
+        updated = 0
+        async with partition.lock:
+            rows = np.flatnonzero(partition.filter_mask(partition.columns, partition.metadata, {"document_id": document_id}))
+            for row in rows:
+                metadata = partition.metadata[row]
+                if metadata.get("chunk_hash") in updates:
+                    metadata.update(updates[metadata["chunk_hash"]])
+                    partition.recode(row)
+                    updated += 1
+        if updated:
+            self._mark_dirty(agent_id)
+        return updated
+
+    async def list_sources(self) -> Dict[str, Set[str]]:
+        sources: Dict[str, Set[str]] = {}
+        for agent_id in await asyncio.to_thread(self._stored_agent_ids):
+            partition = await self._partition(agent_id)
+            if partition.size:
+                sources[agent_id] = {metadata.get("source") for metadata in partition.metadata}
+        return sources
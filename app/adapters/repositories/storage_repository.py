@@ -1,8 +1,20 @@
+import asyncio
+import base64
 import os
+import uuid
+from typing import AsyncIterator, BinaryIO, List
+from azure.storage.blob import BlobBlock
 from azure.storage.blob.aio import BlobServiceClient
-from app.core.ports.storage_repository_port import IStorageRepository
+from app.core.domain.storage_model import BlobDeletionFailure, FolderDeletionResult
+from app.core.ports.storage_repository_port import AsyncReadable, IStorageRepository
 
 AZURE_CONTAINER_NAME = os.getenv("AZURE_CONTAINER_NAME", "knowledge-base")
+# Tamaño de cada bloque y bloques subiéndose en paralelo por archivo
+BLOB_UPLOAD_BLOCK_SIZE = int(os.getenv("BLOB_UPLOAD_BLOCK_SIZE", str(4 * 1024 * 1024)))
+BLOB_UPLOAD_MAX_CONCURRENCY = int(os.getenv("BLOB_UPLOAD_MAX_CONCURRENCY", "4"))
+# Blob Batch admite como máximo 256 operaciones por petición
+BLOB_DELETE_BATCH_SIZE = min(int(os.getenv("BLOB_DELETE_BATCH_SIZE", "256")), 256)
+BLOB_DELETE_MAX_CONCURRENCY = int(os.getenv("BLOB_DELETE_MAX_CONCURRENCY", "4"))
 
 class StorageRepository(IStorageRepository):
     def __init__(self, client: BlobServiceClient):
@@ -14,6 +26,65 @@ class StorageRepository(IStorageRepository):
         await blob_client.upload_blob(file_content, overwrite=True)
         return blob_client.url
 
+    async def upload_stream(self, agent_id: str, file_name: str, stream: AsyncReadable) -> str:
+        """
+        Sube el archivo en bloques (staged blocks) leyendo del stream a medida que avanza.
+        Como máximo hay BLOB_UPLOAD_MAX_CONCURRENCY bloques en memoria a la vez,
+        así que la memoria usada no depende del tamaño del archivo.
+        """
+        blob_name = f"{agent_id}/{file_name}"
+        blob_client = self.client.get_blob_client(container=AZURE_CONTAINER_NAME, blob=blob_name)
+        semaphore = asyncio.Semaphore(BLOB_UPLOAD_MAX_CONCURRENCY)
+        # Los bloques sin confirmar se guardan por blob e ID: con un prefijo propio, dos subidas
+        # a la vez del mismo archivo no se pisan los bloques (todos los IDs miden lo mismo)
+        upload_id = uuid.uuid4().hex
+        block_ids = []
+        tasks = []
+
+        async def stage(block_id: str, data: bytes):
+            try:
+                await blob_client.stage_block(block_id=block_id, data=data)
+            finally:
+                semaphore.release()
+
+        try:
+            while True:
+                # Se reserva el hueco antes de leer para no acumular bloques pendientes
+                await semaphore.acquire()
+                data = await stream.read(BLOB_UPLOAD_BLOCK_SIZE)
+                if not data:
+                    semaphore.release()
+                    break
+                block_id = base64.b64encode(f"{upload_id}{len(block_ids):08d}".encode()).decode()
+                block_ids.append(BlobBlock(block_id=block_id))
+                tasks.append(asyncio.create_task(stage(block_id, data)))
+                del data
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+        await blob_client.commit_block_list(block_ids)
+        return blob_client.url
+
+    async def download_to_file(self, agent_id: str, file_name: str, target: BinaryIO) -> int:
+        blob_name = f"{agent_id}/{file_name}"
+        blob_client = self.client.get_blob_client(container=AZURE_CONTAINER_NAME, blob=blob_name)
+        downloader = await blob_client.download_blob()
+        size = 0
+        async for chunk in downloader.chunks():
+            await asyncio.to_thread(target.write, chunk)
+            size += len(chunk)
+        target.flush()
+        return size
+
+    async def list_files(self, agent_id: str) -> AsyncIterator[str]:
+        # list_blobs pagina por sí mismo: los nombres llegan página a página
+        prefix = f"{agent_id}/"
+        container_client = self.client.get_container_client(AZURE_CONTAINER_NAME)
+        async for blob in container_client.list_blobs(name_starts_with=prefix):
+            yield blob.name[len(prefix):]
+
     async def delete_file(self, agent_id: str, file_name: str) -> bool:
         blob_name = f"{agent_id}/{file_name}"
         blob_client = self.client.get_blob_client(container=AZURE_CONTAINER_NAME, blob=blob_name)
@@ -24,12 +95,44 @@ class StorageRepository(IStorageRepository):
             # Puedes manejar excepciones más específicas de Azure si lo necesitas
             return False
             
-    async def delete_agent_folder(self, agent_id: str) -> bool:
+    async def delete_agent_folder(self, agent_id: str) -> FolderDeletionResult:
+        """
+        Borra todos los blobs del agente con Blob Batch (hasta 256 por lote), con varios lotes
+        en paralelo mientras se sigue listando. Devuelve los blobs borrados y los que fallaron.
+        """
         container_client = self.client.get_container_client(AZURE_CONTAINER_NAME)
-        blobs = container_client.list_blobs(name_starts_with=f"{agent_id}/")
+        semaphore = asyncio.Semaphore(BLOB_DELETE_MAX_CONCURRENCY)
+        result = FolderDeletionResult()
+        tasks = []
+
+        async def delete_batch(names: List[str]):
+            async with semaphore:
+                try:
+                    responses = await container_client.delete_blobs(*names, raise_on_any_failure=False)
+                    index = 0
+                    async for response in responses:
+                        # 404: el blob ya no existía, el objetivo se cumple igualmente
+                        if response.status_code in (200, 202, 404):
+                            result.deleted += 1
+                        else:
+                            result.failed.append(BlobDeletionFailure(
+                                blob_name=names[index],
+                                error=f"{response.status_code} {response.reason}",
+                            ))
+                        index += 1
+                except Exception as e:
+                    result.failed.extend(BlobDeletionFailure(blob_name=name, error=str(e)) for name in names)
+
         try:
-            async for blob in blobs:
-                await container_client.delete_blob(blob.name)
-            return True
-        except Exception:
-            return False
\ No newline at end of file
+            batch: List[str] = []
+            async for blob in container_client.list_blobs(name_starts_with=f"{agent_id}/"):
+                batch.append(blob.name)
+                if len(batch) == BLOB_DELETE_BATCH_SIZE:
+                    tasks.append(asyncio.create_task(delete_batch(batch)))
+                    batch = []
+            if batch:
+                tasks.append(asyncio.create_task(delete_batch(batch)))
+        except Exception as e:
+            result.failed.append(BlobDeletionFailure(blob_name=f"{agent_id}/", error=f"Listing failed: {e}"))
+        await asyncio.gather(*tasks)
+        return result
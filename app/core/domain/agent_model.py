@@ -22,7 +22,12 @@ class AgentCreate(AgentBase):
 class Agent(AgentBase):
     # Aquí aplicamos nuestro nuevo tipo PyObjectId
     id: PyObjectId = Field(alias="_id")
+    document_count: int = 0
+    # Versión del índice de chunks que usan las búsquedas (cambia al terminar una reindexación)
+    index_version: int = 0
+    # Una página de documentos; el resto se pide con documents_after=documents_next_cursor
     documents: List[Document] = []
+    documents_next_cursor: Optional[str] = None
     created_at: datetime
 
     class Config:
@@ -34,10 +39,11 @@ class Agent(AgentBase):
         }
 
 class AgentList(BaseModel):
+    # Los campos son opcionales porque el listado permite elegir cuáles devolver
     id: PyObjectId = Field(alias="_id")
-    name: str
-    prompt: str
-    document_count: int
+    name: Optional[str] = None
+    prompt: Optional[str] = None
+    document_count: Optional[int] = None
 
     class Config:
         populate_by_name = True
@@ -48,7 +54,28 @@ class AgentUpdate(BaseModel):
 
 class ChatQuery(BaseModel):
     query: str = Field(..., min_length=1, description="Pregunta del usuario")
+    session_id: Optional[str] = Field(
+        None, min_length=1, max_length=128,
+        description="Sesión de chat del cliente: el servidor guarda sus turnos y los usa como historial",
+    )
 
 class ChatResponse(BaseModel):
     answer: str
-    retrieved_sources: List[str] # Para saber qué documentos se usaron
\ No newline at end of file
+    retrieved_sources: List[str] # Para saber qué documentos se usaron
+
+# Máximo de preguntas por petición a /chat/batch
+CHAT_BATCH_MAX_QUERIES = 500
+
+class ChatBatchRequest(BaseModel):
+    queries: List[ChatQuery] = Field(..., min_length=1, max_length=CHAT_BATCH_MAX_QUERIES)
+
+class ChatBatchItem(BaseModel):
+    # Posición de la pregunta en la petición; cada elemento trae `response` o `error`
+    index: int
+    query: str
+    response: Optional[ChatResponse] = None
+    cached: bool = False
+    error: Optional[str] = None
+
+class ChatBatchResponse(BaseModel):
+    results: List[ChatBatchItem]
\ No newline at end of file
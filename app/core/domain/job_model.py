@@ -0,0 +1,50 @@
+from enum import Enum
+from pydantic import BaseModel, Field
+from typing import Dict, List, Optional
+from datetime import datetime
+
+from app.core.domain.agent_model import PyObjectId
+
+class JobStatus(str, Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+class JobKind(str, Enum):
+    INGEST = "ingest"              # Ingesta de un archivo del agente
+    DELETE_AGENT = "delete_agent"  # Borrado de los blobs y vectores de un agente ya eliminado
+
+class IngestionJob(BaseModel):
+    id: PyObjectId = Field(alias="_id")
+    kind: JobKind = JobKind.INGEST  # Los trabajos anteriores a los de borrado no lo llevan
+    agent_id: str
+    file_name: str
+    status: JobStatus
+    attempts: int = 0
+    max_attempts: int
+    progress: dict = {}  # Etapa actual y contadores de chunks
+    error: Optional[str] = None
+    batch_id: Optional[str] = None  # Subida masiva o reindexación de la que forma parte
+    index_version: Optional[int] = None  # Solo en las reindexaciones: versión del índice que construye
+    created_at: datetime
+    updated_at: datetime
+
+    class Config:
+        populate_by_name = True
+
+class RejectedFile(BaseModel):
+    file_name: str
+    error: str
+
+class BulkUploadResponse(BaseModel):
+    # Los archivos aceptados se consultan con el batch_id; los rechazados no llegan al storage
+    batch_id: str
+    accepted: List[str]
+    rejected: List[RejectedFile] = []
+
+class UploadBatchStatus(BaseModel):
+    batch_id: str
+    agent_id: str
+    counts: Dict[str, int]  # Archivos por estado de su trabajo de ingesta
+    files: List[IngestionJob]
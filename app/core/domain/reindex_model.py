@@ -0,0 +1,26 @@
+from enum import Enum
+from pydantic import BaseModel
+from typing import Dict, Optional
+from datetime import datetime
+
+class ReindexPhase(str, Enum):
+    LISTING = "listing"    # Encolando un trabajo por blob del agente
+    INDEXING = "indexing"  # Todos los blobs encolados; falta que terminen los trabajos
+    FAILED = "failed"      # Algún archivo agotó sus intentos; se reanuda lanzándola de nuevo
+    DONE = "done"          # Las búsquedas ya usan la versión nueva
+
+class ReindexStatus(BaseModel):
+    agent_id: str
+    index_version: int  # Versión del índice que usan las búsquedas
+    building_index_version: Optional[int] = None  # Versión en construcción (índice sombra)
+    previous_index_version: Optional[int] = None  # La que sustituye; se borra tras el cambio
+    phase: Optional[ReindexPhase] = None  # None si el agente nunca se ha reindexado
+    batch_id: Optional[str] = None
+    files_total: Optional[int] = None  # Se conoce al terminar de listar los blobs
+    counts: Dict[str, int] = {}  # Archivos por estado de su trabajo de ingesta
+    chunks: int = 0  # Chunks de los archivos ya terminados
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    elapsed_seconds: Optional[float] = None
+    files_per_second: Optional[float] = None
+    chunks_per_second: Optional[float] = None
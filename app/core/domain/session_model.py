@@ -0,0 +1,18 @@
+from pydantic import BaseModel
+from typing import List
+from datetime import datetime
+
+class ChatTurn(BaseModel):
+    id: str
+    query: str
+    answer: str
+    created_at: datetime
+
+class ChatSession(BaseModel):
+    agent_id: str
+    session_id: str
+    summary: str = ""  # Resumen de los turnos antiguos, actualizado en segundo plano
+    summarized_turns: int = 0  # Turnos ya incluidos en el resumen
+    turns: List[ChatTurn] = []  # Turnos aún sin resumir, del más antiguo al más reciente
+    created_at: datetime
+    updated_at: datetime
@@ -0,0 +1,10 @@
+from pydantic import BaseModel
+from typing import List
+
+class BlobDeletionFailure(BaseModel):
+    blob_name: str
+    error: str
+
+class FolderDeletionResult(BaseModel):
+    deleted: int = 0
+    failed: List[BlobDeletionFailure] = []
@@ -0,0 +1,14 @@
+from pydantic import BaseModel
+from typing import List, Optional
+
+class VectorRecord(BaseModel):
+    text: str
+    embedding: List[float]
+    # agent_id, source, document_id, version, chunk_hash, chunk_index
+    metadata: dict
+
+class VectorSearchResult(BaseModel):
+    text: str
+    metadata: dict
+    score: float
+    embedding: Optional[List[float]] = None
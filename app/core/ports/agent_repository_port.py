@@ -1,7 +1,7 @@
 # app/core/ports/agent_repository_port.py
 
 from abc import ABC, abstractmethod
-from typing import List, Optional
+from typing import AsyncIterator, List, Optional
 from app.core.domain.agent_model import AgentCreate, AgentUpdate, Document
 
 class IAgentRepository(ABC):
@@ -19,7 +19,18 @@ class IAgentRepository(ABC):
         pass
 
     @abstractmethod
-    async def get_all_agents(self) -> List[dict]:
+    async def find_chat_settings(self, agent_id: str) -> Optional[dict]:
+        """
+        Only what the chat needs: {"prompt", "index_version"}.
+        """
+        pass
+
+    @abstractmethod
+    async def get_all_agents(self, limit: Optional[int] = None, after: Optional[str] = None, fields: Optional[List[str]] = None) -> List[dict]:
+        pass
+
+    @abstractmethod
+    def iter_agents(self, limit: Optional[int] = None, after: Optional[str] = None, fields: Optional[List[str]] = None) -> AsyncIterator[dict]:
         pass
 
     @abstractmethod
@@ -30,10 +41,80 @@ class IAgentRepository(ABC):
     async def add_document_to_agent(self, agent_id: str, document: Document) -> bool:
         pass
 
+    @abstractmethod
+    async def add_documents_to_agent(self, agent_id: str, documents: List[Document]) -> int:
+        """
+        Upserts several documents in one bulk write. Returns how many were new.
+        """
+        pass
+
+    @abstractmethod
+    async def list_documents(self, agent_id: str, limit: int, after: Optional[str] = None) -> List[dict]:
+        """
+        Page of the agent's documents ordered by upload date. Each row carries a `cursor`
+        to pass as `after` to get the following page.
+        """
+        pass
+
     @abstractmethod
     async def remove_document_from_agent(self, agent_id: str, file_name: str) -> bool:
         pass
 
+    @abstractmethod
+    async def start_document_version(self, agent_id: str, file_name: str, index_version: int, version: int) -> bool:
+        """
+        Marks `version` of the document's chunks in `index_version` as pending: searches
+        hide it until activate_document_version. Returns False if the document is not registered.
+        """
+        pass
+
+    @abstractmethod
+    async def activate_document_version(self, agent_id: str, file_name: str, index_version: int, version: int) -> List[int]:
+        """
+        In one write, makes `version` the one searches see for the document in `index_version`
+        and hides the previous active version and older pending ones. Returns those retired
+        versions: the caller deletes their chunks and then releases them.
+        """
+        pass
+
+    @abstractmethod
+    async def release_document_versions(self, agent_id: str, file_name: str, versions: List[int]) -> None:
+        """
+        Forgets pending or retired versions whose chunks were deleted.
+        """
+        pass
+
+    @abstractmethod
+    async def find_hidden_versions(self, agent_id: str) -> List[int]:
+        """
+        Chunk versions of the agent's documents that searches must exclude: the ones still
+        being ingested (or abandoned by a failed ingestion) and the retired ones not yet deleted.
+        """
+        pass
+
+    @abstractmethod
+    async def start_reindex(self, agent_id: str, reindex: dict) -> bool:
+        """
+        Stores `reindex` as the agent's reindex state unless another one is still unfinished.
+        Returns False if the agent does not exist or already has a reindex in progress.
+        """
+        pass
+
+    @abstractmethod
+    async def update_reindex(self, agent_id: str, index_version: int, fields: dict) -> bool:
+        """
+        Updates fields of the reindex state, only if it still builds `index_version`.
+        """
+        pass
+
+    @abstractmethod
+    async def switch_index_version(self, agent_id: str, index_version: int) -> bool:
+        """
+        Atomically makes `index_version` the active one and marks the reindex as done,
+        only if that version finished indexing. Returns False if nothing changed.
+        """
+        pass
+
     @abstractmethod
     async def delete_agent(self, agent_id: str) -> bool:
         pass
\ No newline at end of file
@@ -0,0 +1,40 @@
+# app/core/ports/answer_cache_port.py
+
+from abc import ABC, abstractmethod
+from typing import List, Optional
+from app.core.domain.agent_model import ChatResponse
+
+class IAnswerCache(ABC):
+    """
+    Defines the contract (puerto) for the per-agent answer cache.
+    Entries are scoped to an agent and looked up either by the normalized query
+    or by cosine similarity of the query embedding.
+
+    Every invalidation bumps the agent's generation. Callers read it before retrieval
+    and pass it to put(), which does nothing if the agent was invalidated meanwhile,
+    so an answer built from the old documents or prompt is never stored.
+    """
+
+    @abstractmethod
+    async def generation(self, agent_id: str) -> int:
+        pass
+
+    @abstractmethod
+    async def get_exact(self, agent_id: str, normalized_query: str) -> Optional[ChatResponse]:
+        pass
+
+    @abstractmethod
+    async def get_similar(self, agent_id: str, query_embedding: List[float]) -> Optional[ChatResponse]:
+        pass
+
+    @abstractmethod
+    async def put(self, agent_id: str, normalized_query: str, query_embedding: List[float], response: ChatResponse, generation: int) -> None:
+        pass
+
+    @abstractmethod
+    async def invalidate_agent(self, agent_id: str) -> None:
+        pass
+
+    @abstractmethod
+    def stats(self) -> dict:
+        pass
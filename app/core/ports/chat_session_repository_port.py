@@ -0,0 +1,38 @@
+# app/core/ports/chat_session_repository_port.py
+
+from abc import ABC, abstractmethod
+from typing import List, Optional
+
+class IChatSessionRepository(ABC):
+    """
+    Defines the contract (puerto) for chat session persistence.
+    A session is keyed by (agent_id, session_id) and holds a summary of its older turns
+    plus the turns not yet folded into that summary.
+    """
+
+    @abstractmethod
+    async def find_session(self, agent_id: str, session_id: str) -> Optional[dict]:
+        pass
+
+    @abstractmethod
+    async def append_turn(self, agent_id: str, session_id: str, turn: dict) -> dict:
+        """
+        Appends a turn, creating the session if needed. Returns the updated session.
+        """
+        pass
+
+    @abstractmethod
+    async def apply_summary(self, agent_id: str, session_id: str, summarized_turns: int, summary: str, turn_ids: List[str]) -> bool:
+        """
+        Replaces the summary and drops the turns it now covers, only if the session still has
+        `summarized_turns` (no other summary was applied meanwhile).
+        """
+        pass
+
+    @abstractmethod
+    async def delete_session(self, agent_id: str, session_id: str) -> bool:
+        pass
+
+    @abstractmethod
+    async def delete_agent_sessions(self, agent_id: str) -> int:
+        pass
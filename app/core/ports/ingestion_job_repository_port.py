@@ -0,0 +1,85 @@
+# app/core/ports/ingestion_job_repository_port.py
+
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+class IIngestionJobRepository(ABC):
+    """
+    Defines the contract (puerto) for the durable ingestion job queue.
+    Jobs are leased by workers; an expired lease makes the job claimable again.
+    """
+
+    @abstractmethod
+    async def enqueue(self, agent_id: str, file_name: str, idempotency_key: str, max_attempts: int) -> dict:
+        """
+        Returns the job for `idempotency_key`, creating it if needed. An existing job is
+        requeued if it failed, or if it is done but a later job for the same file was
+        enqueued since (the blob was overwritten with other content in between).
+        """
+        pass
+
+    @abstractmethod
+    async def enqueue_many(
+        self,
+        agent_id: str,
+        files: List[Tuple[str, str]],
+        max_attempts: int,
+        batch_id: str,
+        index_version: Optional[int] = None,
+    ) -> int:
+        """
+        Enqueues one job per (file_name, idempotency_key) in a single bulk write, all tagged
+        with `batch_id`. Existing jobs with the same key are reused and moved to the batch,
+        and requeued under the same rules as enqueue().
+        With `index_version` the jobs only build that version of the agent's index (reindex).
+        """
+        pass
+
+    @abstractmethod
+    async def enqueue_agent_cleanup(self, agent_id: str, max_attempts: int) -> dict:
+        """
+        Enqueues (or requeues) the job that deletes the blobs and vectors of a deleted agent.
+        It is retried with backoff until the agent's folder reports no failures.
+        """
+        pass
+
+    @abstractmethod
+    async def claim_next(self, worker_id: str, lease_seconds: int, batch_id: Optional[str] = None) -> Optional[dict]:
+        pass
+
+    @abstractmethod
+    async def extend_lease(self, job_id: str, worker_id: str, lease_seconds: int) -> bool:
+        pass
+
+    @abstractmethod
+    async def update_progress(self, job_id: str, progress: dict) -> None:
+        pass
+
+    @abstractmethod
+    async def mark_done(self, job_id: str) -> None:
+        pass
+
+    @abstractmethod
+    async def mark_failed(self, job_id: str, error: str, retry_at: Optional[datetime] = None) -> None:
+        pass
+
+    @abstractmethod
+    async def find_latest(self, agent_id: str, file_name: str) -> Optional[dict]:
+        pass
+
+    @abstractmethod
+    async def find_batch(self, agent_id: str, batch_id: str) -> List[dict]:
+        pass
+
+    @abstractmethod
+    async def summarize_batch(self, agent_id: str, batch_id: str) -> Dict[str, dict]:
+        """
+        {status: {"files": n, "chunks": m}} for the batch, without loading every job.
+        `chunks` adds up the chunk counter reported in each job's progress.
+        """
+        pass
+
+    @abstractmethod
+    async def delete_jobs(self, agent_id: str, file_name: Optional[str] = None) -> int:
+        pass
@@ -1,4 +1,13 @@
 from abc import ABC, abstractmethod
+from typing import AsyncIterator, BinaryIO, Protocol
+from app.core.domain.storage_model import FolderDeletionResult
+
+class AsyncReadable(Protocol):
+    """
+    Cualquier objeto con un `read(size)` asíncrono, como `fastapi.UploadFile`.
+    """
+    async def read(self, size: int = -1) -> bytes:
+        ...
 
 class IStorageRepository(ABC):
     """
@@ -10,11 +19,25 @@ class IStorageRepository(ABC):
     async def upload_file(self, agent_id: str, file_name: str, file_content: bytes) -> str:
         pass
 
+    @abstractmethod
+    async def upload_stream(self, agent_id: str, file_name: str, stream: AsyncReadable) -> str:
+        pass
+
+    @abstractmethod
+    async def download_to_file(self, agent_id: str, file_name: str, target: BinaryIO) -> int:
+        pass
+
+    @abstractmethod
+    def list_files(self, agent_id: str) -> AsyncIterator[str]:
+        """
+        Nombres de los archivos del agente a medida que se listan.
+        """
+        pass
+
     @abstractmethod
     async def delete_file(self, agent_id: str, file_name: str) -> bool:
         pass
         
     @abstractmethod
-    async def delete_agent_folder(self, agent_id: str) -> bool:
+    async def delete_agent_folder(self, agent_id: str) -> FolderDeletionResult:
         pass
-
@@ -0,0 +1,58 @@
+# app/core/ports/vector_store_port.py
+
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Set
+from app.core.domain.vector_model import VectorRecord, VectorSearchResult
+
+class IVectorStore(ABC):
+    """
+    Defines the contract (puerto) for the chunk vector store.
+    Filters use a small subset of MongoDB query syntax: equality, $ne, $in, $nin,
+    $exists and a top-level $or. As in MongoDB, a missing field compares as null.
+    Every filter is expected to include `agent_id`.
+    """
+
+    @abstractmethod
+    async def initialize(self) -> None:
+        pass
+
+    @abstractmethod
+    async def close(self) -> None:
+        pass
+
+    @abstractmethod
+    async def add(self, records: List[VectorRecord]) -> int:
+        pass
+
+    @abstractmethod
+    async def search(
+        self,
+        agent_id: str,
+        query_embedding: List[float],
+        k: int,
+        filter: Optional[dict] = None,
+        include_embeddings: bool = False,
+    ) -> List[VectorSearchResult]:
+        pass
+
+    @abstractmethod
+    async def delete(self, filter: dict) -> int:
+        pass
+
+    @abstractmethod
+    async def get_chunk_hashes(self, agent_id: str, document_id: str) -> Set[str]:
+        pass
+
+    @abstractmethod
+    async def update_chunks(self, agent_id: str, document_id: str, updates: Dict[str, dict]) -> int:
+        """
+        Applies `updates` ({chunk_hash: fields}) to the metadata of the document's chunks.
+        """
+        pass
+
+    @abstractmethod
+    async def list_sources(self) -> Dict[str, Set[str]]:
+        """
+        Returns {agent_id: {source, ...}} for everything stored.
+        """
+        pass
@@ -0,0 +1,292 @@
+# app/core/services/admission_control.py
+import asyncio
+import logging
+import math
+import time
+from contextlib import aclosing, asynccontextmanager
+from dataclasses import dataclass, field
+from fastapi import HTTPException, status
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple, TypeVar
+
+from app.infrastructure.observability import (
+    CHAT_COALESCED,
+    CHAT_IN_FLIGHT,
+    CHAT_QUEUE_DEPTH,
+    CHAT_REJECTIONS,
+    metrics_agent_label,
+    record,
+)
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Peso de la última duración en la media móvil con la que se estima el Retry-After
+HOLD_TIME_SMOOTHING = 0.2
+
+
+@dataclass
+class _AgentSlots:
+    semaphore: asyncio.Semaphore
+    active: int = 0
+    waiting: int = 0
+
+
+class AdmissionController:
+    """
+    Limita las peticiones de chat que llaman a OpenAI a la vez en este proceso: un máximo
+    global y otro por agente, para que un agente con un pico de tráfico no ocupe todos los
+    huecos. Las que no caben esperan en una cola acotada (global y por agente) como mucho
+    `queue_timeout` segundos; con la cola llena se rechazan al momento con 429 y Retry-After,
+    en lugar de acumular peticiones que acabarían fallando todas por los límites del proveedor.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        max_concurrency_per_agent: int,
+        max_queue: int,
+        max_queue_per_agent: int,
+        queue_timeout: float,
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_concurrency_per_agent = max_concurrency_per_agent
+        self.max_queue = max_queue
+        self.max_queue_per_agent = max_queue_per_agent
+        self.queue_timeout = queue_timeout
+        self._global = asyncio.Semaphore(max_concurrency)
+        self._agents: Dict[str, _AgentSlots] = {}
+        self._active = 0
+        self._waiting = 0
+        # Tiempo medio que una petición ocupa su hueco
+        self._hold_seconds = 1.0
+        self.admitted = 0
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+
+    def _retry_after(self, waiting: int, concurrency: int) -> int:
+        # Lo que tardaría en vaciarse la cola que hay delante, redondeado a segundos
+        return max(1, math.ceil(self._hold_seconds * (waiting + 1) / concurrency))
+
+    def _reject(self, agent_id: str, reason: str, retry_after: int) -> HTTPException:
+        CHAT_REJECTIONS.labels(reason=reason, agent_id=metrics_agent_label(agent_id)).inc()
+        logger.warning("Petición de chat rechazada por sobrecarga", extra={
+            "agent_id": agent_id, "reason": reason, "retry_after": retry_after,
+            "active": self._active, "waiting": self._waiting,
+        })
+        return HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many concurrent chat requests, retry later",
+            headers={"Retry-After": str(retry_after)},
+        )
+
+    def _slots(self, agent_id: str) -> _AgentSlots:
+        slots = self._agents.get(agent_id)
+        if slots is None:
+            slots = self._agents[agent_id] = _AgentSlots(asyncio.Semaphore(self.max_concurrency_per_agent))
+        return slots
+
+    def _release_slots(self, agent_id: str, slots: _AgentSlots):
+        # Los agentes sin peticiones se olvidan para que el diccionario no crezca sin límite
+        if slots.active == 0 and slots.waiting == 0:
+            self._agents.pop(agent_id, None)
+
+    async def _acquire(self, slots: _AgentSlots):
+        # Primero el hueco del agente: uno que ya está en su límite no retiene huecos globales
+        await slots.semaphore.acquire()
+        try:
+            await self._global.acquire()
+        except BaseException:
+            slots.semaphore.release()
+            raise
+
+    @asynccontextmanager
+    async def admit(self, agent_id: str) -> AsyncIterator[None]:
+        """
+        Reserva un hueco para una petición al agente durante el bloque. Lanza HTTPException
+        429 si la cola está llena o si el hueco no llega antes de `queue_timeout`.
+        """
+        slots = self._slots(agent_id)
+        if slots.waiting >= self.max_queue_per_agent:
+            self.rejected_queue_full += 1
+            raise self._reject(agent_id, "queue_full", self._retry_after(slots.waiting, self.max_concurrency_per_agent))
+        if self._waiting >= self.max_queue:
+            self.rejected_queue_full += 1
+            self._release_slots(agent_id, slots)
+            raise self._reject(agent_id, "queue_full", self._retry_after(self._waiting, self.max_concurrency))
+
+        started = time.perf_counter()
+        slots.waiting += 1
+        self._waiting += 1
+        CHAT_QUEUE_DEPTH.inc()
+        try:
+            await asyncio.wait_for(self._acquire(slots), timeout=self.queue_timeout)
+            slots.active += 1
+        except asyncio.TimeoutError:
+            self.rejected_timeout += 1
+            raise self._reject(agent_id, "timeout", self._retry_after(self._waiting, self.max_concurrency)) from None
+        finally:
+            slots.waiting -= 1
+            self._waiting -= 1
+            CHAT_QUEUE_DEPTH.dec()
+            self._release_slots(agent_id, slots)
+        record("admission_wait", time.perf_counter() - started, agent_id)
+
+        self.admitted += 1
+        self._active += 1
+        CHAT_IN_FLIGHT.inc()
+        admitted_at = time.monotonic()
+        try:
+            yield
+        finally:
+            held = time.monotonic() - admitted_at
+            self._hold_seconds += HOLD_TIME_SMOOTHING * (held - self._hold_seconds)
+            slots.active -= 1
+            self._active -= 1
+            CHAT_IN_FLIGHT.dec()
+            self._global.release()
+            slots.semaphore.release()
+            self._release_slots(agent_id, slots)
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_concurrency_per_agent": self.max_concurrency_per_agent,
+            "active": self._active,
+            "waiting": self._waiting,
+            "agents": {agent_id: {"active": slots.active, "waiting": slots.waiting} for agent_id, slots in self._agents.items()},
+            "admitted": self.admitted,
+            "rejected_queue_full": self.rejected_queue_full,
+            "rejected_timeout": self.rejected_timeout,
+            "average_hold_seconds": round(self._hold_seconds, 3),
+        }
+
+
+@dataclass
+class _Broadcast:
+    """
+    Un stream compartido: los eventos ya emitidos se guardan para que quien se une tarde los
+    reciba desde el principio. `opened` se resuelve (o falla, p. ej. con un 429) al abrirlo.
+    """
+    opened: asyncio.Future
+    events: List[Any] = field(default_factory=list)
+    changed: asyncio.Event = field(default_factory=asyncio.Event)
+    finished: bool = False
+    error: Optional[BaseException] = None
+    subscribers: int = 0
+    task: Optional[asyncio.Task] = None
+
+    def notify(self):
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+    def leave(self):
+        # Sin nadie escuchando no se siguen pidiendo tokens al LLM
+        self.subscribers -= 1
+        if self.subscribers == 0 and not self.finished and self.task is not None:
+            self.task.cancel()
+
+    async def subscribe(self) -> AsyncIterator[Any]:
+        position = 0
+        try:
+            while True:
+                changed = self.changed
+                while position < len(self.events):
+                    yield self.events[position]
+                    position += 1
+                if self.finished:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                await changed.wait()
+        finally:
+            self.leave()
+
+
+class RequestCoalescer:
+    """
+    Une las peticiones idénticas que llegan mientras otra igual está en curso: todas esperan
+    a la misma tarea, así que comparten una recuperación y una llamada al LLM. La tarea no se
+    cancela si se desconecta el cliente que la lanzó: puede haber otros esperándola. Los streams
+    se unen igual: un solo stream del LLM cuyos eventos se reparten a todos los clientes, y que
+    se corta cuando se desconecta el último.
+    """
+
+    def __init__(self):
+        self._in_flight: Dict[Hashable, asyncio.Task] = {}
+        self._streams: Dict[Hashable, _Broadcast] = {}
+        self.coalesced = 0
+
+    def _forget(self, key: Hashable, task: asyncio.Task):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        # Si nadie quedaba esperando, la excepción se da por recogida
+        if not task.cancelled():
+            task.exception()
+
+    async def run(self, key: Hashable, agent_id: str, factory: Callable[[], Awaitable[T]]) -> Tuple[T, bool]:
+        """
+        Devuelve el resultado de `factory()` para `key` y si se compartió con otra petición.
+        """
+        task = self._in_flight.get(key)
+        shared = task is not None
+        if shared:
+            self.coalesced += 1
+            CHAT_COALESCED.labels(agent_id=metrics_agent_label(agent_id)).inc()
+        else:
+            task = asyncio.create_task(factory())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        # shield: cancelar una de las peticiones no cancela la tarea de las demás
+        return await asyncio.shield(task), shared
+
+    async def _pump(self, key: Hashable, broadcast: _Broadcast, factory: Callable[[], Awaitable[AsyncIterator[T]]]):
+        try:
+            try:
+                events = await factory()
+            except asyncio.CancelledError:
+                broadcast.opened.cancel()
+                raise
+            except BaseException as e:
+                broadcast.opened.set_exception(e)
+                # Si nadie quedaba esperando, la excepción se da por recogida
+                broadcast.opened.exception()
+                raise
+            broadcast.opened.set_result(None)
+            async with aclosing(events):
+                async for event in events:
+                    broadcast.events.append(event)
+                    broadcast.notify()
+        except Exception as e:
+            broadcast.error = e
+        finally:
+            broadcast.finished = True
+            broadcast.notify()
+            if self._streams.get(key) is broadcast:
+                del self._streams[key]
+
+    async def stream(
+        self, key: Hashable, agent_id: str, factory: Callable[[], Awaitable[AsyncIterator[T]]],
+    ) -> Tuple[AsyncIterator[T], bool]:
+        """
+        Devuelve los eventos del stream que abre `factory()` para `key` y si se compartió con
+        otra petición. Los errores al abrirlo (p. ej. un 429) se lanzan aquí, antes del primer evento.
+        """
+        broadcast = self._streams.get(key)
+        shared = broadcast is not None
+        if shared:
+            self.coalesced += 1
+            CHAT_COALESCED.labels(agent_id=metrics_agent_label(agent_id)).inc()
+        else:
+            broadcast = self._streams[key] = _Broadcast(asyncio.get_running_loop().create_future())
+            broadcast.task = asyncio.create_task(self._pump(key, broadcast, factory))
+        broadcast.subscribers += 1
+        try:
+            await asyncio.shield(broadcast.opened)
+        except BaseException:
+            broadcast.leave()
+            raise
+        return broadcast.subscribe(), shared
+
+    def stats(self) -> dict:
+        return {"in_flight": len(self._in_flight), "streams_in_flight": len(self._streams), "coalesced": self.coalesced}
@@ -1,25 +1,139 @@
-from fastapi import UploadFile, HTTPException, status
-from typing import List
-
-from app.core.domain.agent_model import AgentCreate, Agent, Document, AgentUpdate, AgentList
-from app.adapters.repositories.agent_repository import AgentRepository
-from app.adapters.repositories.storage_repository import StorageRepository
-from fastapi import BackgroundTasks 
-from .rag_processor import process_and_embed_document
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.runnables import RunnablePassthrough, RunnableLambda
-from langchain_core.output_parsers import StrOutputParser
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
-from app.infrastructure.vector_store import get_vector_store
-from app.core.domain.agent_model import ChatQuery, ChatResponse
-from app.infrastructure.database import get_db
-from app.core.ports.agent_repository_port import IAgentRepository     
-from app.core.ports.storage_repository_port import IStorageRepository  
+import asyncio
+import hashlib
+import logging
+import os
+import posixpath
+import re
+import zipfile
+from bson import ObjectId
+from contextlib import AsyncExitStack, ExitStack, aclosing, nullcontext
+import time
+from fastapi import BackgroundTasks, UploadFile, HTTPException, status
+from typing import AsyncIterator, List, Optional, Tuple
+
+from app.core.domain.agent_model import AgentCreate, Agent, Document, AgentUpdate, AgentList, ChatBatchItem, ChatQuery, ChatResponse
+from .admission_control import AdmissionController, RequestCoalescer
+from .chat_session_service import ChatSessionService
+from .ingestion_worker import INGESTION_MAX_ATTEMPTS
+from .reindex_service import index_version_filter
+from .context_packer import RETRIEVAL_FETCH_K, pack_context
+from app.infrastructure.clients import get_clients
+from app.core.domain.job_model import BulkUploadResponse, IngestionJob, RejectedFile, UploadBatchStatus
+from app.core.domain.storage_model import FolderDeletionResult
+from app.core.domain.vector_model import VectorSearchResult
+from app.infrastructure.observability import record, span
+from app.core.ports.agent_repository_port import IAgentRepository
+from app.core.ports.storage_repository_port import IStorageRepository
+from app.core.ports.answer_cache_port import IAnswerCache
+from app.core.ports.ingestion_job_repository_port import IIngestionJobRepository
+from app.core.ports.vector_store_port import IVectorStore
+
+logger = logging.getLogger(__name__)
+
+AGENT_LIST_FIELDS = {"name", "prompt", "document_count"}
+DEFAULT_DOCUMENTS_PAGE_SIZE = 50
+DOCUMENT_CURSOR_PATTERN = re.compile(r"^\d+-[0-9a-f]{24}$")
+
+ALLOWED_EXTENSIONS = {"pdf", "docx", "xlsx", "pptx"}
+ZIP_EXTENSION = "zip"
+# Archivos por subida masiva (contando las entradas de los ZIP) y blobs subiéndose a la vez
+BULK_UPLOAD_MAX_FILES = int(os.getenv("BULK_UPLOAD_MAX_FILES", "1000"))
+BULK_UPLOAD_MAX_CONCURRENCY = int(os.getenv("BULK_UPLOAD_MAX_CONCURRENCY", "8"))
+
+# Preguntas de un mismo lote que se responden a la vez (recuperación + LLM)
+CHAT_BATCH_MAX_CONCURRENCY = int(os.getenv("CHAT_BATCH_MAX_CONCURRENCY", "8"))
+
+NO_CONTEXT_ANSWER = "Lo siento, no pude encontrar información relevante en los documentos para responder a tu pregunta."
+
+def file_extension(filename: str) -> str:
+    return filename.rsplit(".", 1)[1].lower() if "." in filename else ""
+
+def is_allowed_file(filename: str) -> bool:
+    return file_extension(filename) in ALLOWED_EXTENSIONS
+
+def format_docs(docs: List[VectorSearchResult]) -> str:
+    # Esta función concatena el contenido de los documentos recuperados
+    return "\n\n".join(doc.text for doc in docs)
+
+def collect_sources(docs: List[VectorSearchResult]) -> List[str]:
+    return list(set([doc.metadata.get("source", "unknown") for doc in docs]))
+
+class HashingReader:
+    """
+    Envuelve un stream asíncrono y calcula el SHA-256 de lo que se va leyendo,
+    para obtener el hash del contenido sin tener el archivo entero en memoria.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._digest = hashlib.sha256()
+
+    async def read(self, size: int = -1) -> bytes:
+        data = await self.stream.read(size)
+        self._digest.update(data)
+        return data
+
+    def hexdigest(self) -> str:
+        return self._digest.hexdigest()
+
+class ZipEntryReader:
+    """
+    Lee una entrada de un ZIP por bloques. Descomprimir es síncrono, así que cada bloque se
+    lee en un hilo para no bloquear el event loop.
+    """
+
+    def __init__(self, archive: zipfile.ZipFile, entry: zipfile.ZipInfo):
+        self.archive = archive
+        self.entry = entry
+        self._stream = None
+
+    async def read(self, size: int = -1) -> bytes:
+        if self._stream is None:
+            self._stream = await asyncio.to_thread(self.archive.open, self.entry)
+        return await asyncio.to_thread(self._stream.read, size)
+
+    def close(self):
+        if self._stream is not None:
+            self._stream.close()
+
+def _error_message(error: Exception) -> str:
+    if isinstance(error, HTTPException):
+        return str(error.detail)
+    return str(error) or type(error).__name__
+
+def normalize_query(query: str) -> str:
+    # Minúsculas, espacios colapsados y sin signos de puntuación en los extremos
+    return " ".join(query.lower().split()).strip("¿?¡!.,;: ")
 
 class AgentService:
-    def __init__(self, agent_repo: IAgentRepository, storage_repo: IStorageRepository):
+    def __init__(
+        self,
+        agent_repo: IAgentRepository,
+        storage_repo: IStorageRepository,
+        job_repo: IIngestionJobRepository,
+        vector_store: IVectorStore,
+        answer_cache: Optional[IAnswerCache] = None,
+        admission: Optional[AdmissionController] = None,
+        coalescer: Optional[RequestCoalescer] = None,
+        sessions: Optional[ChatSessionService] = None,
+    ):
         self.agent_repo = agent_repo
         self.storage_repo = storage_repo
+        self.job_repo = job_repo
+        self.vector_store = vector_store
+        self.answer_cache = answer_cache
+        self.admission = admission
+        self.coalescer = coalescer
+        self.sessions = sessions
+
+    async def _invalidate_answers(self, agent_id: str):
+        # Cualquier cambio en los documentos o en el prompt deja obsoletas las respuestas cacheadas
+        if self.answer_cache:
+            await self.answer_cache.invalidate_agent(agent_id)
+
+    def _admit(self, agent_id: str):
+        # Sin control de admisión (p. ej. en los benchmarks) todas las peticiones pasan
+        return self.admission.admit(agent_id) if self.admission else nullcontext()
 
     async def create_agent(self, agent_data: AgentCreate) -> Agent:
         created_agent = await self.agent_repo.create_agent(agent_data)
@@ -33,34 +147,201 @@ class AgentService:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Agent not found")
         return Agent.model_validate(agent)
 
-    async def get_all_agents(self) -> List[AgentList]:
-        agents = await self.agent_repo.get_all_agents()
-        return [AgentList.model_validate(agent) for agent in agents]
+    async def get_agent_details(self, agent_id: str, documents_limit: int = DEFAULT_DOCUMENTS_PAGE_SIZE, documents_after: Optional[str] = None) -> Agent:
+        """
+        Devuelve el agente con una página de sus documentos ordenados por fecha de subida.
+        """
+        if documents_after and not DOCUMENT_CURSOR_PATTERN.match(documents_after):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid 'documents_after' cursor")
+        agent = await self.get_agent_by_id(agent_id)
+        documents = await self.agent_repo.list_documents(agent_id, documents_limit, documents_after)
+        agent.documents = [Document.model_validate(document) for document in documents]
+        agent.documents_next_cursor = documents[-1]["cursor"] if len(documents) == documents_limit else None
+        return agent
+
+    async def _get_chat_settings(self, agent_id: str) -> dict:
+        # Solo el prompt y la versión del índice: el chat no necesita la lista de documentos del agente
+        with span("agent_lookup", agent_id):
+            settings = await self.agent_repo.find_chat_settings(agent_id)
+        if settings is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Agent not found")
+        return settings
+
+    def _validate_list_params(self, after: Optional[str], fields: Optional[List[str]]):
+        if after and not ObjectId.is_valid(after):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid 'after' cursor")
+        unknown = set(fields or []) - AGENT_LIST_FIELDS
+        if unknown:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Unknown fields: {', '.join(sorted(unknown))}. Allowed fields are: {', '.join(sorted(AGENT_LIST_FIELDS))}"
+            )
+
+    async def get_all_agents(self, limit: int, after: Optional[str] = None, fields: Optional[List[str]] = None) -> Tuple[List[AgentList], Optional[str]]:
+        """
+        Devuelve una página de agentes ordenada por _id y el cursor de la siguiente página
+        (None si no hay más).
+        """
+        self._validate_list_params(after, fields)
+        agents = await self.agent_repo.get_all_agents(limit, after, fields)
+        next_cursor = str(agents[-1]["_id"]) if len(agents) == limit else None
+        return [AgentList.model_validate(agent) for agent in agents], next_cursor
+
+    def stream_agents(self, limit: Optional[int] = None, after: Optional[str] = None, fields: Optional[List[str]] = None) -> AsyncIterator[AgentList]:
+        self._validate_list_params(after, fields)
+
+        async def generate():
+            async for agent in self.agent_repo.iter_agents(limit, after, fields):
+                yield AgentList.model_validate(agent)
+        return generate()
 
     async def update_agent(self, agent_id: str, update_data: AgentUpdate) -> Agent:
         # Primero, verifica que el agente exista
-        await self.get_agent_by_id(agent_id) 
+        agent = await self.get_agent_by_id(agent_id) 
         updated_agent = await self.agent_repo.update_agent(agent_id, update_data)
-        return Agent.model_validate(updated_agent)
+        if not updated_agent:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Agent not found")
+        if update_data.prompt is not None and update_data.prompt != agent.prompt:
+            await self._invalidate_answers(agent_id)
+        return await self.get_agent_details(agent_id)
 
-    async def upload_document(self, agent_id: str, file: UploadFile, background_tasks: BackgroundTasks) -> Agent:
+    async def upload_document(self, agent_id: str, file: UploadFile) -> Agent:
         agent = await self.get_agent_by_id(agent_id)
         
-        file_content = await file.read() # Ya tenemos el contenido aquí
-        file_url = await self.storage_repo.upload_file(agent_id, file.filename, file_content)
+        # El archivo se sube por bloques desde el spool de UploadFile, sin leerlo entero en memoria
+        reader = HashingReader(file)
+        with span("blob_upload", agent_id):
+            file_url = await self.storage_repo.upload_stream(agent_id, file.filename, reader)
 
         new_document = Document(file_name=file.filename, url=file_url)
         await self.agent_repo.add_document_to_agent(agent_id, new_document)
         
-        # Pasamos el contenido del archivo en lugar de la URL
-        background_tasks.add_task(
-            process_and_embed_document, 
-            file_content=file_content, # Pasamos los bytes
-            agent_id=agent_id, 
-            file_name=file.filename
+        await self._invalidate_answers(agent_id)
+
+        # La ingesta se encola de forma durable; un worker la procesa (y reintenta si falla).
+        # La clave de idempotencia evita reprocesar el mismo contenido subido dos veces.
+        content_hash = reader.hexdigest()
+        await self.job_repo.enqueue(
+            agent_id,
+            file.filename,
+            idempotency_key=f"{agent_id}/{file.filename}/{content_hash}",
+            max_attempts=INGESTION_MAX_ATTEMPTS,
         )
         
-        return await self.get_agent_by_id(agent_id)
+        return await self.get_agent_details(agent_id)
+
+    async def _upload_entries(self, files: List[UploadFile], archives: ExitStack) -> AsyncIterator[Tuple[str, Optional[object], Optional[str]]]:
+        """
+        Recorre los archivos subidos y, dentro de cada ZIP, sus entradas. Genera
+        (nombre, lector, error); las que traen error se rechazan sin llegar al storage.
+        Los ZIP abiertos quedan en `archives` hasta que terminan todas las subidas.
+        """
+        for file in files:
+            name = file.filename or ""
+            if file_extension(name) != ZIP_EXTENSION:
+                if is_allowed_file(name):
+                    yield name, file, None
+                else:
+                    yield name, None, "File extension not allowed"
+                continue
+            try:
+                archive = archives.enter_context(await asyncio.to_thread(zipfile.ZipFile, file.file))
+            except zipfile.BadZipFile:
+                yield name, None, "Invalid ZIP archive"
+                continue
+            for entry in archive.infolist():
+                entry_name = posixpath.basename(entry.filename)
+                # Carpetas, archivos ocultos y metadatos de macOS no son documentos
+                if entry.is_dir() or not entry_name or entry_name.startswith(".") or entry.filename.startswith("__MACOSX/"):
+                    continue
+                if is_allowed_file(entry_name):
+                    yield entry_name, ZipEntryReader(archive, entry), None
+                else:
+                    yield entry_name, None, "File extension not allowed"
+
+    async def upload_documents(self, agent_id: str, files: List[UploadFile]) -> BulkUploadResponse:
+        """
+        Subida masiva de documentos y de ZIPs con documentos. Valida la extensión de cada archivo
+        según recorre la petición, sube hasta BULK_UPLOAD_MAX_CONCURRENCY blobs a la vez, registra
+        todos los documentos con una sola escritura y encola un trabajo por archivo bajo un mismo
+        batch_id; los workers procesan juntos los archivos del lote.
+        """
+        await self.get_agent_by_id(agent_id)
+        batch_id = str(ObjectId())
+        rejected: List[RejectedFile] = []
+        accepted_names = set()
+        slots = asyncio.Semaphore(BULK_UPLOAD_MAX_CONCURRENCY)
+        uploads: List[Tuple[str, asyncio.Task]] = []
+
+        async def upload(file_name: str, stream) -> Tuple[Document, str]:
+            try:
+                reader = HashingReader(stream)
+                with span("blob_upload", agent_id):
+                    file_url = await self.storage_repo.upload_stream(agent_id, file_name, reader)
+                return Document(file_name=file_name, url=file_url), reader.hexdigest()
+            finally:
+                if isinstance(stream, ZipEntryReader):
+                    stream.close()
+                slots.release()
+
+        with ExitStack() as archives:
+            try:
+                async for file_name, stream, error in self._upload_entries(files, archives):
+                    if error is None and file_name in accepted_names:
+                        error = "Duplicate file name in upload"
+                    if error is None and len(accepted_names) >= BULK_UPLOAD_MAX_FILES:
+                        error = f"Too many files in upload (max {BULK_UPLOAD_MAX_FILES})"
+                    if error:
+                        rejected.append(RejectedFile(file_name=file_name, error=error))
+                        continue
+                    accepted_names.add(file_name)
+                    # Se reserva el hueco antes de empezar: como mucho N archivos abiertos a la vez
+                    await slots.acquire()
+                    uploads.append((file_name, asyncio.create_task(upload(file_name, stream))))
+                results = await asyncio.gather(*(task for _, task in uploads), return_exceptions=True)
+            except BaseException:
+                for _, task in uploads:
+                    task.cancel()
+                raise
+
+        uploaded: List[Tuple[str, Document, str]] = []
+        for (file_name, _), result in zip(uploads, results):
+            if isinstance(result, BaseException):
+                rejected.append(RejectedFile(file_name=file_name, error=f"Upload failed: {_error_message(result)}"))
+            else:
+                uploaded.append((file_name, *result))
+        if not uploaded:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="No file in the upload was accepted: " + "; ".join(f"{item.file_name}: {item.error}" for item in rejected),
+            )
+
+        # Una escritura para todos los documentos y otra para todos los trabajos de ingesta
+        await self.agent_repo.add_documents_to_agent(agent_id, [document for _, document, _ in uploaded])
+        await self.job_repo.enqueue_many(
+            agent_id,
+            [(file_name, f"{agent_id}/{file_name}/{content_hash}") for file_name, _, content_hash in uploaded],
+            INGESTION_MAX_ATTEMPTS,
+            batch_id,
+        )
+        await self._invalidate_answers(agent_id)
+        return BulkUploadResponse(batch_id=batch_id, accepted=[file_name for file_name, _, _ in uploaded], rejected=rejected)
+
+    async def get_upload_batch(self, agent_id: str, batch_id: str) -> UploadBatchStatus:
+        jobs = await self.job_repo.find_batch(agent_id, batch_id) if ObjectId.is_valid(batch_id) else []
+        if not jobs:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Upload batch not found")
+        files = [IngestionJob.model_validate(job) for job in jobs]
+        counts = {}
+        for job in files:
+            counts[job.status.value] = counts.get(job.status.value, 0) + 1
+        return UploadBatchStatus(batch_id=batch_id, agent_id=agent_id, counts=counts, files=files)
+
+    async def get_ingestion_status(self, agent_id: str, file_name: str) -> IngestionJob:
+        job = await self.job_repo.find_latest(agent_id, file_name)
+        if not job:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No ingestion job found for this document")
+        return IngestionJob.model_validate(job)
 
     async def delete_document(self, agent_id: str, file_name: str):
         agent = await self.get_agent_by_id(agent_id)
@@ -72,43 +353,124 @@ class AgentService:
 
         # Elimina de la base de datos
         await self.agent_repo.remove_document_from_agent(agent_id, file_name)
+        await self.job_repo.delete_jobs(agent_id, file_name)
+        # Los chunks del documento dejan de ser recuperables
+        await self.vector_store.delete({"agent_id": agent_id, "source": file_name})
+        await self._invalidate_answers(agent_id)
         return {"message": "Document deleted successfully"}
         
-    async def delete_agent(self, agent_id: str):
+    async def delete_agent(self, agent_id: str, async_mode: bool = False):
+        """
+        Elimina el agente y todo lo asociado. Con `async_mode` el registro del agente se borra
+        de inmediato y la limpieza de blobs y vectores queda en la cola de trabajos, con lease y
+        reintentos, así que sobrevive a un reinicio del proceso. Sin él la limpieza se hace en la
+        petición y, si algún blob no se pudo borrar, el resto se reintenta con el mismo trabajo.
+        """
         agent = await self.get_agent_by_id(agent_id)
 
-        # Elimina la carpeta y sus contenidos del storage
-        await self.storage_repo.delete_agent_folder(agent_id)
-        
+        if async_mode:
+            await self._delete_agent_record(agent_id)
+            job = await self.job_repo.enqueue_agent_cleanup(agent_id, INGESTION_MAX_ATTEMPTS)
+            return {"message": "Agent deleted; associated files are being removed in the background", "cleanup_job_id": str(job["_id"])}
+
+        cleanup = await self._cleanup_agent_data(agent_id)
+        await self._delete_agent_record(agent_id)
+        response = {
+            "message": "Agent and associated files deleted successfully",
+            "deleted_files": cleanup.deleted,
+            "failed_files": [failure.model_dump() for failure in cleanup.failed],
+        }
+        if cleanup.failed:
+            # El trabajo hace de marca del borrado pendiente: sin él nada volvería a esos blobs
+            job = await self.job_repo.enqueue_agent_cleanup(agent_id, INGESTION_MAX_ATTEMPTS)
+            response["message"] = "Agent deleted; files that could not be deleted will be retried in the background"
+            response["cleanup_job_id"] = str(job["_id"])
+        return response
+
+    async def _delete_agent_record(self, agent_id: str):
         # Elimina el agente de la base de datos
         deleted = await self.agent_repo.delete_agent(agent_id)
         if not deleted:
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to delete agent from database")
-            
-        return {"message": "Agent and associated files deleted successfully"}
+
+        # Antes de encolar la limpieza: delete_jobs borra todos los trabajos del agente
+        await self.job_repo.delete_jobs(agent_id)
+        if self.sessions:
+            await self.sessions.delete_agent_sessions(agent_id)
+        await self._invalidate_answers(agent_id)
+
+    async def _cleanup_agent_data(self, agent_id: str) -> FolderDeletionResult:
+        # Elimina la carpeta y sus contenidos del storage, y los chunks del agente
+        result = await self.storage_repo.delete_agent_folder(agent_id)
+        if result.failed:
+            logger.warning("Archivos del agente que no se pudieron borrar", extra={"agent_id": agent_id, "failed_files": len(result.failed)})
+        await self.vector_store.delete({"agent_id": agent_id})
+        return result
     
 
-    async def chat_with_agent(self, agent_id: str, chat_query: ChatQuery) -> ChatResponse:
-        # 1. Verificar que el agente existe
-        agent = await self.get_agent_by_id(agent_id)
-        
-        # 2. Obtener la instancia del Vector Store asíncrono
-        vector_store = get_vector_store()
-
-        # 3. Le decimos que solo busque en los documentos donde agent_id sea igual al que queremos.
-        retriever = vector_store.as_retriever(
-            search_type="similarity",
-            search_kwargs={
-                "k": 5,  # El número de documentos más relevantes a recuperar
-                "pre_filter": {"agent_id": agent_id}
-            }
-        )
+    async def _retrieve_documents(self, agent_id: str, index_version: int, query_embedding: List[float]) -> Tuple[List[VectorSearchResult], int]:
+        """
+        Recupera más candidatos de los que se usan y se queda con los que entran en el
+        presupuesto de tokens (MMR + unión de chunks solapados). Devuelve también los tokens.
+        """
+        # Solo busca en los chunks del agente y de su versión activa del índice: los de una
+        # reindexación en curso no se mezclan en los resultados. Tampoco en las versiones de
+        # documentos a medio ingerir o ya sustituidas que aún no se han borrado
+        search_filter = index_version_filter(index_version)
+        hidden = await self.agent_repo.find_hidden_versions(agent_id)
+        if hidden:
+            search_filter["version"] = {"$nin": hidden}
+        with span("vector_search", agent_id):
+            candidates = await self.vector_store.search(
+                agent_id, query_embedding, k=RETRIEVAL_FETCH_K, filter=search_filter, include_embeddings=True,
+            )
+        with span("context_packing", agent_id):
+            return pack_context(query_embedding, candidates)
+
+    async def _exact_cached_answer(self, agent_id: str, query: str) -> Optional[ChatResponse]:
+        # Por la consulta normalizada: no llama a OpenAI, así que se consulta antes de pedir hueco
+        if not self.answer_cache:
+            return None
+        return await self.answer_cache.get_exact(agent_id, normalize_query(query))
+
+    async def _lookup_cached_answer(self, agent_id: str, query: str) -> Tuple[Optional[ChatResponse], List[float]]:
+        """
+        Busca por similitud del embedding (la caché exacta ya se consultó antes de admitir la
+        petición). Devuelve también el embedding para reutilizarlo en la recuperación.
+        """
+        query_embedding = await self._embed_query(agent_id, query)
+        if self.answer_cache:
+            cached = await self.answer_cache.get_similar(agent_id, query_embedding)
+            if cached:
+                return cached, query_embedding
+        return None, query_embedding
+
+    async def _embed_query(self, agent_id: str, query: str) -> List[float]:
+        with span("query_embedding", agent_id):
+            return await get_clients().embeddings.aembed_query(query)
 
-        # 4. Definir el prompt template
+    async def _answer_cache_generation(self, agent_id: str) -> Optional[int]:
+        # Se lee antes que el prompt y los documentos: si el agente cambia mientras se responde,
+        # la respuesta (hecha con lo anterior) no se guarda en la caché
+        return await self.answer_cache.generation(agent_id) if self.answer_cache else None
+
+    async def _store_answer(self, agent_id: str, query: str, query_embedding: List[float], response: ChatResponse, cache_generation: Optional[int]):
+        if self.answer_cache and cache_generation is not None:
+            await self.answer_cache.put(agent_id, normalize_query(query), query_embedding, response, cache_generation)
+
+    def _build_answer_chain(self, agent_prompt: str, with_history: bool = False):
+        # langchain_core se importa en el primer chat, no al arrancar la API
+        from langchain_core.output_parsers import StrOutputParser
+        from langchain_core.prompts import ChatPromptTemplate
+
+        # En una sesión, la conversación previa (resumen + últimos turnos) va antes del contexto
+        history_section = """Conversación hasta ahora (sirve para entender la pregunta, no como fuente de información):
+        {history}
+        """ if with_history else ""
         template = f"""
-        System Prompt: {agent.prompt}
+        System Prompt: {agent_prompt}
         Usa la siguiente información de contexto para responder la pregunta. Si no sabes la respuesta basándote en el contexto, di que no tienes suficiente información. No inventes una respuesta.
-        
+        {history_section}
         Contexto:
         {{context}}
         
@@ -118,34 +480,273 @@ class AgentService:
         Respuesta útil:
         """
         prompt = ChatPromptTemplate.from_template(template)
-        llm = ChatOpenAI(model_name="gpt-3.5-turbo", temperature=0)
-        
-        def format_docs(docs):
-            # Esta función concatena el contenido de los documentos recuperados
-            return "\n\n".join(doc.page_content for doc in docs)
-
-        # 5. Construir la cadena RAG usando LangChain Expression Language (LCEL)
-        rag_chain = (
-            # El retriever se invoca primero para obtener los documentos
-            {"context": retriever | format_docs, "question": RunnablePassthrough()}
-            | prompt
-            | llm
-            | StrOutputParser()
-        )
+        # El contexto ya viene recuperado, así que la cadena solo formatea, llama al LLM y parsea
+        return prompt | get_clients().llm | StrOutputParser()
 
-        # 6. Invocar la cadena de forma asíncrona
-        print(f"Buscando en documentos para el agente: {agent_id} con la pregunta: '{chat_query.query}'")
-        answer = await rag_chain.ainvoke(chat_query.query)
-        
-        # 7. Recuperar las fuentes para la respuesta
-        retrieved_docs = await retriever.ainvoke(chat_query.query)
+    async def _answer_query(
+        self, agent_id: str, index_version: int, rag_chain, query: str, query_embedding: List[float],
+        history: str = "", cache_generation: Optional[int] = None,
+    ) -> ChatResponse:
+        # Recuperar los documentos una sola vez: alimentan el contexto y las fuentes
+        logger.debug("Búsqueda en los documentos del agente", extra={"agent_id": agent_id, "query": query})
+        retrieved_docs, context_tokens = await self._retrieve_documents(agent_id, index_version, query_embedding)
         if not retrieved_docs:
-            print("ADVERTENCIA: El retriever no devolvió ningún documento.")
-            return ChatResponse(
-                answer="Lo siento, no pude encontrar información relevante en los documentos para responder a tu pregunta.",
-                retrieved_sources=[]
+            logger.warning("El retriever no devolvió ningún documento", extra={"agent_id": agent_id})
+            response = ChatResponse(answer=NO_CONTEXT_ANSWER, retrieved_sources=[])
+        else:
+            # Invocar el LLM con el contexto ya formateado
+            logger.debug("Contexto recuperado", extra={"agent_id": agent_id, "blocks": len(retrieved_docs), "context_tokens": context_tokens})
+            inputs = {"context": format_docs(retrieved_docs), "question": query}
+            if history:
+                inputs["history"] = history
+            with span("llm", agent_id):
+                answer = await rag_chain.ainvoke(inputs)
+            response = ChatResponse(answer=answer, retrieved_sources=collect_sources(retrieved_docs))
+
+        # Una respuesta que depende del historial de una sesión no sirve para otras preguntas iguales
+        if not history:
+            await self._store_answer(agent_id, query, query_embedding, response, cache_generation)
+        return response
+
+    async def chat_with_agent(self, agent_id: str, chat_query: ChatQuery, background_tasks: Optional[BackgroundTasks] = None) -> ChatResponse:
+        """
+        Responde una pregunta con la base de conocimiento del agente. Con `session_id` la
+        pregunta se responde con el historial de la sesión y el turno se guarda en ella; el
+        resumen de los turnos antiguos se actualiza con `background_tasks`, tras responder.
+        """
+        with span("chat_total", agent_id):
+            # 1. Verificar que el agente existe y obtener su prompt
+            cache_generation = await self._answer_cache_generation(agent_id)
+            settings = await self._get_chat_settings(agent_id)
+            session_id = chat_query.session_id if self.sessions else None
+            history = await self.sessions.load_history(agent_id, session_id) if session_id else ""
+            cached = None if history else await self._exact_cached_answer(agent_id, chat_query.query)
+
+            if history:
+                # 2a. La respuesta depende de la conversación: sin caché ni peticiones unidas
+                response = await self._chat_with_history(agent_id, settings, chat_query.query, history)
+            elif cached:
+                # 2b. Una respuesta ya guardada no ocupa hueco de admisión
+                response = cached
+            elif not self.coalescer:
+                response = await self._chat(agent_id, settings, chat_query.query, cache_generation)
+            else:
+                # 2c. Las preguntas iguales (una vez normalizadas) al mismo agente y versión del índice
+                # que llegan mientras otra está en curso esperan a su respuesta
+                key = (agent_id, settings["index_version"], normalize_query(chat_query.query))
+                response, _ = await self.coalescer.run(key, agent_id, lambda: self._chat(agent_id, settings, chat_query.query, cache_generation))
+
+            if session_id:
+                await self._record_turn(agent_id, session_id, chat_query.query, response.answer, background_tasks)
+            return response
+
+    async def _chat_with_history(self, agent_id: str, settings: dict, query: str, history: str) -> ChatResponse:
+        async with self._admit(agent_id):
+            query_embedding = await self._embed_query(agent_id, query)
+            return await self._answer_query(
+                agent_id, settings["index_version"], self._build_answer_chain(settings["prompt"], with_history=True),
+                query, query_embedding, history,
             )
-            
-        sources = list(set([doc.metadata.get("source", "unknown") for doc in retrieved_docs]))
 
-        return ChatResponse(answer=answer, retrieved_sources=sources)
\ No newline at end of file
+    async def _record_turn(self, agent_id: str, session_id: str, query: str, answer: str, background_tasks: Optional[BackgroundTasks]):
+        # El turno se guarda antes de responder para que el siguiente ya lo vea; el resumen, después
+        with span("session_save", agent_id):
+            needs_summary = await self.sessions.record_turn(agent_id, session_id, query, answer)
+        if needs_summary and background_tasks is not None:
+            background_tasks.add_task(self.sessions.refresh_summary, agent_id, session_id)
+
+    async def _chat(self, agent_id: str, settings: dict, query: str, cache_generation: Optional[int]) -> ChatResponse:
+        # Las llamadas a OpenAI (embedding y LLM) solo se hacen con un hueco admitido
+        async with self._admit(agent_id):
+            # Consultar la caché de respuestas del agente
+            cached, query_embedding = await self._lookup_cached_answer(agent_id, query)
+            if cached:
+                return cached
+
+            # Recuperar el contexto e invocar el LLM
+            return await self._answer_query(
+                agent_id, settings["index_version"], self._build_answer_chain(settings["prompt"]), query, query_embedding,
+                cache_generation=cache_generation,
+            )
+
+    async def chat_batch(self, agent_id: str, chat_queries: List[ChatQuery]) -> AsyncIterator[ChatBatchItem]:
+        """
+        Responde varias preguntas al mismo agente. Valida el agente antes de devolver el
+        generador (para poder responder 404) y luego emite un resultado por pregunta, en el
+        mismo orden que la entrada; un fallo en una pregunta no interrumpe las demás.
+        """
+        if any(chat_query.session_id for chat_query in chat_queries):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Chat sessions are not supported in batch requests")
+        cache_generation = await self._answer_cache_generation(agent_id)
+        settings = await self._get_chat_settings(agent_id)
+        return self._answer_batch(agent_id, settings, [chat_query.query for chat_query in chat_queries], cache_generation)
+
+    async def _answer_batch(self, agent_id: str, settings: dict, queries: List[str], cache_generation: Optional[int]) -> AsyncIterator[ChatBatchItem]:
+        started = time.perf_counter()
+        # El prompt y la cadena se preparan una vez para todo el lote
+        rag_chain = self._build_answer_chain(settings["prompt"])
+
+        cached: List[Optional[ChatResponse]] = [None] * len(queries)
+        if self.answer_cache:
+            cached = list(await asyncio.gather(*(self.answer_cache.get_exact(agent_id, normalize_query(query)) for query in queries)))
+
+        # Una sola llamada de embeddings para todas las preguntas que no están en la caché exacta
+        pending = [index for index, response in enumerate(cached) if response is None]
+        embeddings: dict = {}
+        embedding_error: Optional[str] = None
+        if pending:
+            try:
+                async with self._admit(agent_id):
+                    with span("query_embedding", agent_id):
+                        vectors = await get_clients().embeddings.aembed_documents([queries[index] for index in pending])
+                embeddings = dict(zip(pending, vectors))
+            except Exception as e:
+                embedding_error = _error_message(e)
+
+        semaphore = asyncio.Semaphore(CHAT_BATCH_MAX_CONCURRENCY)
+
+        async def answer(index: int) -> ChatBatchItem:
+            query = queries[index]
+            if cached[index]:
+                return ChatBatchItem(index=index, query=query, response=cached[index], cached=True)
+            if embedding_error:
+                return ChatBatchItem(index=index, query=query, error=embedding_error)
+            async with semaphore:
+                try:
+                    if self.answer_cache:
+                        similar = await self.answer_cache.get_similar(agent_id, embeddings[index])
+                        if similar:
+                            return ChatBatchItem(index=index, query=query, response=similar, cached=True)
+                    # Cada pregunta compite por un hueco como una petición de chat; si no lo
+                    # consigue, el 429 queda como error de esa pregunta
+                    async with self._admit(agent_id):
+                        response = await self._answer_query(
+                            agent_id, settings["index_version"], rag_chain, query, embeddings[index], cache_generation=cache_generation,
+                        )
+                    return ChatBatchItem(index=index, query=query, response=response)
+                except Exception as e:
+                    return ChatBatchItem(index=index, query=query, error=_error_message(e))
+
+        tasks = [asyncio.create_task(answer(index)) for index in range(len(queries))]
+        try:
+            for task in tasks:
+                yield await task
+        finally:
+            # Si el cliente corta el stream no se siguen gastando llamadas al LLM
+            for task in tasks:
+                task.cancel()
+        elapsed = time.perf_counter() - started
+        record("chat_batch_total", elapsed, agent_id)
+        logger.info("Lote de preguntas respondido", extra={"agent_id": agent_id, "queries": len(queries), "elapsed_seconds": round(elapsed, 2)})
+
+    async def stream_chat_with_agent(self, agent_id: str, chat_query: ChatQuery, background_tasks: Optional[BackgroundTasks] = None) -> AsyncIterator[dict]:
+        """
+        Variante en streaming de chat_with_agent. Valida el agente antes de devolver el
+        generador (para poder responder 404 o 429 antes de abrir el stream) y luego emite eventos:
+        `sources` al terminar la recuperación, `token` por cada fragmento del LLM y `done`
+        con los tiempos de cada etapa. Con `session_id` el turno se guarda al terminar el stream.
+        """
+        cache_generation = await self._answer_cache_generation(agent_id)
+        settings = await self._get_chat_settings(agent_id)
+        session_id = chat_query.session_id if self.sessions else None
+        history = await self.sessions.load_history(agent_id, session_id) if session_id else ""
+        cached = None if history else await self._exact_cached_answer(agent_id, chat_query.query)
+        if cached:
+            events = self._cached_events(agent_id, cached, time.perf_counter())
+        elif history or not self.coalescer:
+            events = await self._open_stream(agent_id, settings, chat_query.query, history, cache_generation)
+        else:
+            # Como en chat_with_agent, las preguntas iguales en curso comparten un solo stream del LLM:
+            # quien se une tarde recibe primero los eventos ya emitidos
+            key = (agent_id, settings["index_version"], normalize_query(chat_query.query))
+            events, _ = await self.coalescer.stream(
+                key, agent_id, lambda: self._open_stream(agent_id, settings, chat_query.query, "", cache_generation),
+            )
+        if session_id:
+            events = self._record_streamed_turn(events, agent_id, session_id, chat_query.query, background_tasks)
+        return events
+
+    async def _open_stream(self, agent_id: str, settings: dict, query: str, history: str, cache_generation: Optional[int]) -> AsyncIterator[dict]:
+        # El hueco se reserva antes de abrir el stream, para poder responder 429, y se libera al cerrarlo
+        admission = AsyncExitStack()
+        await admission.enter_async_context(self._admit(agent_id))
+        return self._release_after(admission, self._stream_answer(agent_id, settings, query, history, cache_generation))
+
+    async def _record_streamed_turn(
+        self, events: AsyncIterator[dict], agent_id: str, session_id: str, query: str, background_tasks: Optional[BackgroundTasks],
+    ) -> AsyncIterator[dict]:
+        # Se guarda antes del evento `done`, con la respuesta completa; si el cliente corta antes, no se guarda
+        answer_parts = []
+        async with aclosing(events):
+            async for event in events:
+                if event["event"] == "token":
+                    answer_parts.append(event["data"]["token"])
+                elif event["event"] == "done":
+                    await self._record_turn(agent_id, session_id, query, "".join(answer_parts), background_tasks)
+                yield event
+
+    async def _release_after(self, admission: AsyncExitStack, events: AsyncIterator[dict]) -> AsyncIterator[dict]:
+        async with admission, aclosing(events):
+            async for event in events:
+                yield event
+
+    async def _cached_events(self, agent_id: str, cached: ChatResponse, started: float) -> AsyncIterator[dict]:
+        yield {"event": "sources", "data": {"retrieved_sources": cached.retrieved_sources}}
+        yield {"event": "token", "data": {"token": cached.answer}}
+        record("chat_total", time.perf_counter() - started, agent_id)
+        elapsed_ms = round((time.perf_counter() - started) * 1000, 2)
+        yield {"event": "done", "data": {"cached": True, "retrieval_ms": elapsed_ms, "first_token_ms": elapsed_ms, "total_ms": elapsed_ms}}
+
+    async def _stream_answer(
+        self, agent_id: str, settings: dict, query: str, history: str = "", cache_generation: Optional[int] = None,
+    ) -> AsyncIterator[dict]:
+        started = time.perf_counter()
+        if history:
+            # Con historial la respuesta depende de la conversación: no se busca en la caché
+            cached, query_embedding = None, await self._embed_query(agent_id, query)
+        else:
+            cached, query_embedding = await self._lookup_cached_answer(agent_id, query)
+        if cached:
+            async for event in self._cached_events(agent_id, cached, started):
+                yield event
+            return
+
+        retrieved_docs, context_tokens = await self._retrieve_documents(agent_id, settings["index_version"], query_embedding)
+        retrieval_ms = (time.perf_counter() - started) * 1000
+        sources = collect_sources(retrieved_docs)
+        yield {"event": "sources", "data": {"retrieved_sources": sources}}
+
+        first_token_ms = None
+        answer_parts = []
+        if not retrieved_docs:
+            answer_parts.append(NO_CONTEXT_ANSWER)
+            yield {"event": "token", "data": {"token": NO_CONTEXT_ANSWER}}
+        else:
+            rag_chain = self._build_answer_chain(settings["prompt"], with_history=bool(history))
+            inputs = {"context": format_docs(retrieved_docs), "question": query}
+            if history:
+                inputs["history"] = history
+            llm_started = time.perf_counter()
+            async for token in rag_chain.astream(inputs):
+                if not token:
+                    continue
+                if first_token_ms is None:
+                    first_token_ms = (time.perf_counter() - started) * 1000
+                    # Tiempo hasta el primer token desde la llamada al LLM, sin la recuperación
+                    record("llm_first_token", time.perf_counter() - llm_started, agent_id)
+                answer_parts.append(token)
+                yield {"event": "token", "data": {"token": token}}
+            record("llm", time.perf_counter() - llm_started, agent_id)
+
+        if not history:
+            await self._store_answer(
+                agent_id, query, query_embedding, ChatResponse(answer="".join(answer_parts), retrieved_sources=sources), cache_generation,
+            )
+        record("chat_total", time.perf_counter() - started, agent_id)
+        yield {"event": "done", "data": {
+            "cached": False,
+            "context_tokens": context_tokens,
+            "retrieval_ms": round(retrieval_ms, 2),
+            "first_token_ms": round(first_token_ms, 2) if first_token_ms is not None else None,
+            "total_ms": round((time.perf_counter() - started) * 1000, 2),
+        }}
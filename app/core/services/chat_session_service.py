@@ -0,0 +1,143 @@
+# app/core/services/chat_session_service.py
+import logging
+import os
+from bson import ObjectId
+from datetime import datetime
+from fastapi import HTTPException, status
+from typing import List
+
+from app.core.domain.session_model import ChatSession
+from app.core.ports.chat_session_repository_port import IChatSessionRepository
+from app.core.services.token_counter import get_encoding
+from app.infrastructure.clients import LLM_MODEL, get_clients
+from app.infrastructure.observability import span
+
+logger = logging.getLogger(__name__)
+
+# Turnos recientes que se envían tal cual; los anteriores se resumen en segundo plano
+CHAT_HISTORY_MAX_TURNS = int(os.getenv("CHAT_HISTORY_MAX_TURNS", "6"))
+# Tokens máximos del historial (resumen + turnos) en el prompt, sin contar el contexto recuperado
+CHAT_HISTORY_TOKEN_BUDGET = int(os.getenv("CHAT_HISTORY_TOKEN_BUDGET", "1000"))
+# Parte del presupuesto que puede ocupar el resumen
+CHAT_SUMMARY_MAX_TOKENS = int(os.getenv("CHAT_SUMMARY_MAX_TOKENS", "300"))
+
+SUMMARY_TEMPLATE = """
+Resume la conversación entre un usuario y un asistente para que el asistente pueda continuarla.
+Conserva los datos, nombres, cifras y preferencias que el usuario ha dado y las conclusiones
+alcanzadas; omite saludos y repeticiones. Escribe como mucho {max_words} palabras.
+
+Resumen hasta ahora:
+{summary}
+
+Turnos nuevos:
+{turns}
+
+Resumen actualizado:
+"""
+
+def format_turn(turn: dict) -> str:
+    return f"Usuario: {turn['query']}\nAsistente: {turn['answer']}"
+
+def _truncate(text: str, max_tokens: int) -> str:
+    encoding = get_encoding(LLM_MODEL)
+    tokens = encoding.encode(text)
+    return text if len(tokens) <= max_tokens else encoding.decode(tokens[-max_tokens:])
+
+def format_history(session: dict, token_budget: int = CHAT_HISTORY_TOKEN_BUDGET) -> str:
+    """
+    Historial para el prompt: el resumen de los turnos antiguos y, del más reciente hacia
+    atrás, los turnos que quepan en `token_budget`. Los turnos que esperan a entrar en el
+    resumen se incluyen mientras quepan, así que no se pierden mientras se actualiza.
+    """
+    encoding = get_encoding(LLM_MODEL)
+    summary = _truncate(session.get("summary", ""), min(CHAT_SUMMARY_MAX_TOKENS, token_budget))
+    remaining = token_budget - len(encoding.encode(summary))
+
+    recent: List[str] = []
+    for turn in reversed(session.get("turns", [])):
+        text = format_turn(turn)
+        tokens = len(encoding.encode(text))
+        if tokens > remaining:
+            break
+        recent.append(text)
+        remaining -= tokens
+
+    parts = []
+    if summary:
+        parts.append(f"Resumen de la conversación anterior: {summary}")
+    parts.extend(reversed(recent))
+    return "\n\n".join(parts)
+
+
+class ChatSessionService:
+    """
+    Sesiones de chat guardadas en el servidor. Cada una conserva los últimos
+    CHAT_HISTORY_MAX_TURNS turnos tal cual y un resumen de los anteriores que se actualiza
+    en segundo plano, así que el historial del prompt (y el coste de cada turno) no crece
+    con la longitud de la conversación.
+    """
+
+    def __init__(self, session_repo: IChatSessionRepository):
+        self.session_repo = session_repo
+
+    async def get_session(self, agent_id: str, session_id: str) -> ChatSession:
+        session = await self.session_repo.find_session(agent_id, session_id)
+        if not session:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Session not found")
+        return ChatSession.model_validate(session)
+
+    async def delete_session(self, agent_id: str, session_id: str):
+        if not await self.session_repo.delete_session(agent_id, session_id):
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Session not found")
+        return {"message": "Session deleted successfully"}
+
+    async def delete_agent_sessions(self, agent_id: str) -> int:
+        return await self.session_repo.delete_agent_sessions(agent_id)
+
+    async def load_history(self, agent_id: str, session_id: str) -> str:
+        # Una sesión nueva no tiene historial: la pregunta se responde como sin sesión
+        with span("session_load", agent_id):
+            session = await self.session_repo.find_session(agent_id, session_id)
+        return format_history(session) if session else ""
+
+    async def record_turn(self, agent_id: str, session_id: str, query: str, answer: str) -> bool:
+        """
+        Guarda el turno y devuelve si quedan turnos fuera de la ventana que hay que resumir.
+        """
+        turn = {"id": str(ObjectId()), "query": query, "answer": answer, "created_at": datetime.utcnow()}
+        session = await self.session_repo.append_turn(agent_id, session_id, turn)
+        return len(session["turns"]) > CHAT_HISTORY_MAX_TURNS
+
+    async def refresh_summary(self, agent_id: str, session_id: str):
+        """
+        Incorpora al resumen los turnos que han salido de la ventana. Se ejecuta después de
+        responder; si otro proceso actualizó el resumen a la vez, este resultado se descarta
+        y los turnos se resumen en el siguiente turno.
+        """
+        try:
+            session = await self.session_repo.find_session(agent_id, session_id)
+            if not session or len(session["turns"]) <= CHAT_HISTORY_MAX_TURNS:
+                return
+            turns = session["turns"][:-CHAT_HISTORY_MAX_TURNS]
+
+            # langchain_core se importa en el primer uso, no al arrancar la API
+            from langchain_core.output_parsers import StrOutputParser
+            from langchain_core.prompts import ChatPromptTemplate
+
+            chain = ChatPromptTemplate.from_template(SUMMARY_TEMPLATE) | get_clients().llm | StrOutputParser()
+            with span("session_summary", agent_id):
+                summary = await chain.ainvoke({
+                    # Unas 0,75 palabras por token
+                    "max_words": int(CHAT_SUMMARY_MAX_TOKENS * 0.75),
+                    "summary": session["summary"] or "(vacío)",
+                    "turns": "\n\n".join(format_turn(turn) for turn in turns),
+                })
+            applied = await self.session_repo.apply_summary(
+                agent_id, session_id, session["summarized_turns"], summary.strip(), [turn["id"] for turn in turns],
+            )
+            logger.debug("Resumen de la sesión actualizado" if applied else "Resumen de la sesión descartado", extra={
+                "agent_id": agent_id, "session_id": session_id, "summarized_turns": len(turns),
+            })
+        except Exception:
+            # Los turnos siguen guardados: se resumirán en el siguiente intento
+            logger.exception("No se pudo actualizar el resumen de la sesión", extra={"agent_id": agent_id, "session_id": session_id})
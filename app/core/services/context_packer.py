@@ -0,0 +1,128 @@
+# app/core/services/context_packer.py
+import os
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from app.core.domain.vector_model import VectorSearchResult
+from app.core.services.document_parser import CHUNK_OVERLAP
+from app.core.services.token_counter import count_tokens, get_encoding
+from app.infrastructure.clients import LLM_MODEL
+
+# Candidatos que se piden al almacén de vectores antes de seleccionar con MMR
+RETRIEVAL_FETCH_K = int(os.getenv("RETRIEVAL_FETCH_K", "20"))
+# Tokens máximos de contexto que se envían al LLM
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+# 1.0 = solo relevancia, 0.0 = solo diversidad
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))
+# Coseno a partir del cual dos chunks se consideran el mismo contenido
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv("NEAR_DUPLICATE_THRESHOLD", "0.97"))
+
+# Solapes más cortos que esto se consideran casualidad (p. ej. una palabra repetida)
+MIN_OVERLAP_CHARS = 20
+
+def mmr_order(query_embedding: List[float], embeddings: np.ndarray, lambda_mult: float = MMR_LAMBDA) -> List[int]:
+    """
+    Ordena los candidatos por Maximal Marginal Relevance: en cada paso elige el que maximiza
+    λ·sim(consulta) − (1−λ)·max sim(ya elegidos). Descarta los casi duplicados de uno ya elegido.
+    """
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    candidates = embeddings / norms
+    query = np.asarray(query_embedding, dtype=np.float32)
+    query = query / (np.linalg.norm(query) or 1.0)
+
+    relevance = candidates @ query
+    pairwise = candidates @ candidates.T
+    # Similitud máxima de cada candidato con los ya elegidos
+    redundancy = np.full(len(candidates), -np.inf)
+    available = np.ones(len(candidates), dtype=bool)
+    order = []
+    while available.any():
+        penalty = np.where(np.isfinite(redundancy), redundancy, 0.0)
+        scores = np.where(available, lambda_mult * relevance - (1 - lambda_mult) * penalty, -np.inf)
+        chosen = int(np.argmax(scores))
+        order.append(chosen)
+        available[chosen] = False
+        redundancy = np.maximum(redundancy, pairwise[chosen])
+        available &= redundancy < NEAR_DUPLICATE_THRESHOLD
+    return order
+
+def _overlap_length(previous: str, following: str) -> int:
+    # El splitter repite al inicio de cada chunk (hasta CHUNK_OVERLAP caracteres) el final del anterior
+    for size in range(min(len(previous), len(following), CHUNK_OVERLAP), MIN_OVERLAP_CHARS - 1, -1):
+        if previous.endswith(following[:size]):
+            return size
+    return 0
+
+def merge_adjacent(results: List[VectorSearchResult]) -> List[VectorSearchResult]:
+    """
+    Une los chunks consecutivos (chunk_index n y n+1) del mismo documento en un solo bloque sin
+    repetir el texto solapado. Conserva el orden del primer chunk de cada bloque y su mejor score.
+    """
+    groups: Dict[Tuple[str, str], List[Tuple[int, int, VectorSearchResult]]] = {}
+    for position, result in enumerate(results):
+        index = result.metadata.get("chunk_index")
+        key = (result.metadata.get("agent_id"), result.metadata.get("document_id") or result.metadata.get("source"))
+        # Chunks sin posición (guardados antes de chunk_index) no se pueden unir
+        if index is None:
+            key = (key[0], f"#{position}")
+        groups.setdefault(key, []).append((index if index is not None else 0, position, result))
+
+    merged: List[Tuple[int, VectorSearchResult]] = []
+    for chunks in groups.values():
+        chunks.sort(key=lambda chunk: chunk[0])
+        block_index, block_position, block = chunks[0]
+        text, score = block.text, block.score
+        for index, position, result in chunks[1:]:
+            if index == block_index + 1:
+                overlap = _overlap_length(text, result.text)
+                text += result.text[overlap:] if overlap else "\n" + result.text
+                score = max(score, result.score)
+                block_position = min(block_position, position)
+            else:
+                merged.append((block_position, block.model_copy(update={"text": text, "score": score, "embedding": None})))
+                block, text, score, block_position = result, result.text, result.score, position
+            block_index = index
+        merged.append((block_position, block.model_copy(update={"text": text, "score": score, "embedding": None})))
+
+    merged.sort(key=lambda item: item[0])
+    return [result for _, result in merged]
+
+def pack_context(
+    query_embedding: List[float],
+    results: List[VectorSearchResult],
+    token_budget: int = CONTEXT_TOKEN_BUDGET,
+) -> Tuple[List[VectorSearchResult], int]:
+    """
+    Selecciona, de los candidatos recuperados, los chunks que entran en el presupuesto de tokens:
+    primero ordena por MMR (relevantes y diversos, sin casi duplicados), va añadiendo mientras
+    quepan y al final une los chunks consecutivos. Devuelve los bloques y sus tokens totales.
+    """
+    if not results:
+        return [], 0
+
+    if all(result.embedding is not None for result in results):
+        order = mmr_order(query_embedding, np.asarray([result.embedding for result in results], dtype=np.float32))
+    else:
+        # Sin embeddings (p. ej. búsquedas sin include_embeddings) se respeta el orden de relevancia
+        order = list(range(len(results)))
+
+    selected: List[VectorSearchResult] = []
+    used = 0
+    for position in order:
+        # Tokens tal como los cuenta el modelo que recibe el contexto
+        tokens = count_tokens(results[position].text, LLM_MODEL)
+        if used + tokens > token_budget:
+            continue
+        selected.append(results[position])
+        used += tokens
+
+    if not selected:
+        # Ni el mejor chunk cabe entero: se recorta para no quedarse sin contexto
+        best = results[order[0]]
+        encoding = get_encoding(LLM_MODEL)
+        selected = [best.model_copy(update={"text": encoding.decode(encoding.encode(best.text)[:token_budget])})]
+
+    packed = merge_adjacent(selected)
+    return packed, sum(count_tokens(block.text, LLM_MODEL) for block in packed)
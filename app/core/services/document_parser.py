@@ -0,0 +1,89 @@
+# app/core/services/document_parser.py
+import importlib
+import queue
+import time
+from typing import Dict, Iterator, List, Optional
+
+# Este módulo se ejecuta dentro del pool de procesos de ingesta: debe ser síncrono,
+# sin dependencias del event loop y con funciones a nivel de módulo (serializables con pickle).
+
+# Los loaders (sobre todo los de Unstructured) tardan en importarse: se cargan la primera vez
+# que se usan, así importar este módulo (p. ej. para CHUNK_OVERLAP) no cuesta nada.
+LOADER_MAPPING = {
+    ".pdf": "PyPDFLoader",
+    ".docx": "UnstructuredWordDocumentLoader",
+    ".xlsx": "UnstructuredExcelLoader",
+    ".pptx": "UnstructuredPowerPointLoader",
+}
+
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 150
+# Chunks por mensaje enviado al proceso principal
+CHUNK_MESSAGE_SIZE = 64
+# Cada cuánto se comprueba si el proceso principal canceló la lectura
+PUT_TIMEOUT_SECONDS = 1.0
+
+def get_loader_class(file_extension: str):
+    return getattr(importlib.import_module("langchain_community.document_loaders"), LOADER_MAPPING[file_extension])
+
+def build_text_splitter():
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+    return RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+
+def iter_chunks(file_path: str, file_extension: str, timings: Optional[Dict[str, float]] = None) -> Iterator[str]:
+    """
+    Genera el texto de cada chunk a medida que el loader produce las páginas (`lazy_load`).
+    Cada página se divide por separado, igual que hacía `split_documents`, así que los chunks
+    son los mismos pero nunca hay más de una página cargada a la vez.
+    Si se pasa `timings`, acumula en "parse" y "split" los segundos de cada fase.
+    """
+    timings = timings if timings is not None else {}
+    started = time.perf_counter()
+    loader = get_loader_class(file_extension)(file_path)
+    text_splitter = build_text_splitter()
+    pages = loader.lazy_load()
+    while True:
+        # Solo se mide el trabajo propio, no el tiempo que el consumidor tarda en pedir más chunks
+        page = next(pages, None)
+        parsed = time.perf_counter()
+        timings["parse"] = timings.get("parse", 0.0) + parsed - started
+        if page is None:
+            return
+        chunks = text_splitter.split_text(page.page_content)
+        timings["split"] = timings.get("split", 0.0) + time.perf_counter() - parsed
+        yield from chunks
+        started = time.perf_counter()
+
+def _put(chunk_queue, message, cancelled) -> bool:
+    # La cola es acotada: si el proceso principal va más lento, el parser espera (backpressure)
+    while not cancelled.is_set():
+        try:
+            chunk_queue.put(message, timeout=PUT_TIMEOUT_SECONDS)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def stream_chunks(file_path: str, file_extension: str, chunk_queue, cancelled) -> None:
+    """
+    Punto de entrada en el pool de procesos. Recibe la ruta del archivo (no los bytes) para no
+    copiar el contenido entre procesos y envía los chunks por `chunk_queue` en mensajes
+    ("chunks", [...]) según se generan; termina con ("done", {"parse": s, "split": s}) o
+    ("error", mensaje).
+    Deja de leer si el proceso principal activa `cancelled`.
+    """
+    try:
+        timings = {"parse": 0.0, "split": 0.0}
+        batch: List[str] = []
+        for chunk in iter_chunks(file_path, file_extension, timings):
+            batch.append(chunk)
+            if len(batch) >= CHUNK_MESSAGE_SIZE:
+                if not _put(chunk_queue, ("chunks", batch), cancelled):
+                    return
+                batch = []
+        if batch and not _put(chunk_queue, ("chunks", batch), cancelled):
+            return
+        _put(chunk_queue, ("done", timings), cancelled)
+    except Exception as e:
+        _put(chunk_queue, ("error", f"{type(e).__name__}: {e}"), cancelled)
@@ -0,0 +1,247 @@
+# app/core/services/ingestion_worker.py
+import asyncio
+import functools
+import logging
+import os
+import random
+import socket
+import tempfile
+import uuid
+from contextlib import ExitStack
+from datetime import datetime, timedelta
+from typing import TYPE_CHECKING, Dict, List, Optional, Set, Tuple
+
+from app.core.domain.job_model import JobKind
+from app.core.ports.agent_repository_port import IAgentRepository
+from app.core.ports.answer_cache_port import IAnswerCache
+from app.core.ports.ingestion_job_repository_port import IIngestionJobRepository
+from app.core.ports.storage_repository_port import IStorageRepository
+from app.core.ports.vector_store_port import IVectorStore
+from app.infrastructure.observability import INGESTIONS_IN_FLIGHT, span
+
+if TYPE_CHECKING:
+    from .reindex_service import ReindexService
+
+logger = logging.getLogger(__name__)
+
+INGESTION_MAX_ATTEMPTS = int(os.getenv("INGESTION_MAX_ATTEMPTS", "5"))
+INGESTION_LEASE_SECONDS = int(os.getenv("INGESTION_LEASE_SECONDS", "120"))
+INGESTION_POLL_SECONDS = float(os.getenv("INGESTION_POLL_SECONDS", "2"))
+INGESTION_BACKOFF_BASE_SECONDS = float(os.getenv("INGESTION_BACKOFF_BASE_SECONDS", "5"))
+INGESTION_BACKOFF_MAX_SECONDS = float(os.getenv("INGESTION_BACKOFF_MAX_SECONDS", "600"))
+# Archivos de una misma subida masiva que un worker reclama y procesa juntos
+INGESTION_BATCH_MAX_FILES = int(os.getenv("INGESTION_BATCH_MAX_FILES", "8"))
+
+def retry_delay(attempts: int) -> float:
+    # Backoff exponencial con jitter para que los reintentos no se sincronicen entre réplicas
+    delay = min(INGESTION_BACKOFF_BASE_SECONDS * 2 ** max(attempts - 1, 0), INGESTION_BACKOFF_MAX_SECONDS)
+    return delay * random.uniform(0.5, 1.0)
+
+
+class IngestionWorker:
+    """
+    Consume la cola de trabajos de ingesta: reclama un trabajo con lease (y, si viene de una
+    subida masiva o de una reindexación, otros del mismo lote), descarga los archivos del
+    storage y ejecuta el pipeline de rag_processor en las versiones del índice que indica
+    `reindex`. También borra los blobs y vectores de los agentes eliminados. Pueden correr
+    N réplicas a la vez.
+    """
+
+    def __init__(
+        self,
+        job_repo: IIngestionJobRepository,
+        storage_repo: IStorageRepository,
+        answer_cache: Optional[IAnswerCache] = None,
+        reindex: Optional["ReindexService"] = None,
+        vector_store: Optional[IVectorStore] = None,
+        agent_repo: Optional[IAgentRepository] = None,
+    ):
+        self.job_repo = job_repo
+        self.storage_repo = storage_repo
+        self.answer_cache = answer_cache
+        self.reindex = reindex
+        self.vector_store = vector_store
+        # Sin caché: registra qué versión de cada documento ven las búsquedas
+        self.agent_repo = agent_repo
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self._stopping = asyncio.Event()
+        # Borrados diferidos de versiones del índice que ya no están activas
+        self._retiring: Set[asyncio.Task] = set()
+
+    def stop(self):
+        self._stopping.set()
+
+    async def run(self):
+        logger.info("Worker de ingesta iniciado", extra={"worker_id": self.worker_id})
+        while not self._stopping.is_set():
+            try:
+                processed = await self.run_once()
+            except Exception:
+                # Errores de infraestructura (p. ej. Mongo caído): se espera y se vuelve a intentar
+                logger.exception("Error en el worker de ingesta", extra={"worker_id": self.worker_id})
+                processed = False
+            if not processed:
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), timeout=INGESTION_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+        # Un borrado pendiente que se pierde lo recoge `python -m app.maintenance compact-vectors`
+        for task in list(self._retiring):
+            task.cancel()
+        logger.info("Worker de ingesta detenido", extra={"worker_id": self.worker_id})
+
+    async def run_once(self) -> bool:
+        job = await self.job_repo.claim_next(self.worker_id, INGESTION_LEASE_SECONDS)
+        if not job:
+            return False
+        if job.get("kind") == JobKind.DELETE_AGENT.value:
+            if job["attempts"] > job["max_attempts"]:
+                await self.job_repo.mark_failed(str(job["_id"]), job.get("error") or "Lease expired too many times")
+            else:
+                await self._cleanup_agent(job)
+            return True
+        jobs = [job]
+        if job.get("batch_id"):
+            # Los demás archivos de la misma subida masiva se procesan juntos: sus chunks
+            # comparten los lotes de embeddings
+            while len(jobs) < INGESTION_BATCH_MAX_FILES:
+                sibling = await self.job_repo.claim_next(self.worker_id, INGESTION_LEASE_SECONDS, batch_id=job["batch_id"])
+                if not sibling:
+                    break
+                jobs.append(sibling)
+
+        runnable = []
+        for job in jobs:
+            # Un lease caducado repetidamente (el worker muere a mitad) también consume intentos
+            if job["attempts"] > job["max_attempts"]:
+                await self.job_repo.mark_failed(str(job["_id"]), job.get("error") or "Lease expired too many times")
+            else:
+                runnable.append(job)
+        if runnable:
+            await self._process(runnable)
+        return True
+
+    async def _process(self, jobs: List[dict]):
+        # El pipeline (loaders, openai) se importa con el primer trabajo: la API que solo
+        # importa este módulo por INGESTION_MAX_ATTEMPTS no lo carga al arrancar
+        from .rag_processor import DocumentIngestion, process_and_embed_documents
+
+        versions: Dict[Tuple[str, Optional[int]], List[int]] = {}
+        for job in jobs:
+            key = (job["agent_id"], job.get("index_version"))
+            if key not in versions:
+                versions[key] = await self._target_index_versions(*key)
+
+        job_ids = [str(job["_id"]) for job in jobs]
+        agent_id = jobs[0]["agent_id"]
+        errors: Dict[str, Optional[str]] = {}
+        heartbeat = asyncio.create_task(self._keep_leases(job_ids))
+        INGESTIONS_IN_FLIGHT.inc(len(jobs))
+        try:
+            with span("ingest_total", agent_id), ExitStack() as temp_files:
+                # Cada blob se descarga por chunks a un archivo temporal que lee directamente el parser
+                targets = [
+                    (job, temp_files.enter_context(tempfile.NamedTemporaryFile(suffix=os.path.splitext(job["file_name"])[1])))
+                    for job in jobs
+                ]
+
+                async def download(job: dict, temp_file):
+                    with span("blob_download", job["agent_id"]):
+                        await self.storage_repo.download_to_file(job["agent_id"], job["file_name"], temp_file)
+
+                downloads = await asyncio.gather(*(download(job, temp_file) for job, temp_file in targets), return_exceptions=True)
+                documents = []
+                for (job, temp_file), result in zip(targets, downloads):
+                    if isinstance(result, Exception):
+                        errors[str(job["_id"])] = str(result)
+                        continue
+                    errors[str(job["_id"])] = None
+                    # Una copia por versión del índice; el progreso del trabajo lo informa la primera
+                    for position, index_version in enumerate(versions[(job["agent_id"], job.get("index_version"))]):
+                        documents.append((job, DocumentIngestion(
+                            temp_file.name,
+                            job["agent_id"],
+                            job["file_name"],
+                            on_progress=functools.partial(self.job_repo.update_progress, str(job["_id"])) if position == 0 else None,
+                            index_version=index_version,
+                        )))
+                await process_and_embed_documents([document for _, document in documents], self.agent_repo)
+                for job, document in documents:
+                    if document.error is not None and errors[str(job["_id"])] is None:
+                        errors[str(job["_id"])] = str(document.error)
+        except Exception as e:
+            # Errores fuera del pipeline (p. ej. al crear los archivos temporales) afectan a todos
+            for job_id in job_ids:
+                errors[job_id] = errors.get(job_id) or str(e)
+        finally:
+            heartbeat.cancel()
+            INGESTIONS_IN_FLIGHT.dec(len(jobs))
+
+        invalidated = set()
+        for job in jobs:
+            job_id = str(job["_id"])
+            if errors.get(job_id) is None:
+                await self.job_repo.mark_done(job_id)
+                # Los trabajos de una reindexación no cambian lo que se busca hasta el final
+                if self.answer_cache and job.get("index_version") is None and job["agent_id"] not in invalidated:
+                    await self.answer_cache.invalidate_agent(job["agent_id"])
+                    invalidated.add(job["agent_id"])
+            else:
+                retry_at = None
+                if job["attempts"] < job["max_attempts"]:
+                    retry_at = datetime.utcnow() + timedelta(seconds=retry_delay(job["attempts"]))
+                await self.job_repo.mark_failed(job_id, errors[job_id], retry_at)
+
+        if self.reindex:
+            for agent_id, index_version in versions:
+                if index_version is None:
+                    continue
+                retired = await self.reindex.complete_if_finished(agent_id, index_version)
+                if retired is not None:
+                    task = asyncio.create_task(self.reindex.retire_index_version(agent_id, retired))
+                    self._retiring.add(task)
+                    task.add_done_callback(self._retiring.discard)
+
+    async def _cleanup_agent(self, job: dict):
+        """
+        Borra la carpeta del agente en el storage y sus chunks. Si queda algún blob sin borrar
+        (o falla el listado) el trabajo vuelve a la cola con backoff; al agotar los intentos
+        queda en FAILED con los blobs pendientes en `error`, a la vista para reintentarlo.
+        """
+        job_id, agent_id = str(job["_id"]), job["agent_id"]
+        heartbeat = asyncio.create_task(self._keep_leases([job_id]))
+        error = None
+        try:
+            with span("agent_cleanup", agent_id):
+                result = await self.storage_repo.delete_agent_folder(agent_id)
+                if self.vector_store:
+                    await self.vector_store.delete({"agent_id": agent_id})
+            if result.failed:
+                pending = ", ".join(failure.blob_name for failure in result.failed[:5])
+                error = f"{len(result.failed)} blobs could not be deleted ({pending}): {result.failed[0].error}"
+            logger.info("Datos del agente eliminado borrados" if error is None else "Borrado de los datos del agente incompleto", extra={
+                "agent_id": agent_id, "deleted_files": result.deleted, "failed_files": len(result.failed),
+            })
+        except Exception as e:
+            error = str(e) or type(e).__name__
+        finally:
+            heartbeat.cancel()
+
+        if error is None:
+            await self.job_repo.mark_done(job_id)
+            return
+        retry_at = None
+        if job["attempts"] < job["max_attempts"]:
+            retry_at = datetime.utcnow() + timedelta(seconds=retry_delay(job["attempts"]))
+        await self.job_repo.mark_failed(job_id, error, retry_at)
+
+    async def _target_index_versions(self, agent_id: str, index_version: Optional[int]) -> List[int]:
+        if self.reindex is None:
+            return [index_version or 0]
+        return await self.reindex.target_index_versions(agent_id, index_version)
+
+    async def _keep_leases(self, job_ids: List[str]):
+        while True:
+            await asyncio.sleep(INGESTION_LEASE_SECONDS / 3)
+            for job_id in job_ids:
+                await self.job_repo.extend_lease(job_id, self.worker_id, INGESTION_LEASE_SECONDS)
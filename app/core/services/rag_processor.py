@@ -1,67 +1,421 @@
 # app/core/services/rag_processor.py
-import tempfile
+import asyncio
+import functools
+import logging
 import os
-from langchain_community.document_loaders import PyPDFLoader, UnstructuredWordDocumentLoader, UnstructuredExcelLoader, UnstructuredPowerPointLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_core.documents import Document
+import queue
+import random
+import time
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from openai import RateLimitError
+from app.core.domain.vector_model import VectorRecord
+from app.core.ports.agent_repository_port import IAgentRepository
+from app.core.ports.vector_store_port import IVectorStore
+from app.core.services.document_parser import CHUNK_MESSAGE_SIZE, LOADER_MAPPING, PUT_TIMEOUT_SECONDS, stream_chunks
+from app.core.services.token_counter import count_tokens
+from app.infrastructure.clients import EMBEDDING_MODEL
 from app.infrastructure.vector_store import get_vector_store
+from app.infrastructure.embedding_cache import EmbeddingCache, get_embedding_cache, hash_text
+from app.infrastructure.observability import record, span
+from app.infrastructure.process_pool import INGESTION_PROCESS_POOL_SIZE, get_process_manager, get_process_pool
 
-LOADER_MAPPING = {
-    ".pdf": PyPDFLoader,
-    ".docx": UnstructuredWordDocumentLoader,
-    ".xlsx": UnstructuredExcelLoader,
-    ".pptx": UnstructuredPowerPointLoader,
-}
+# Límites por petición de la API de embeddings (300k tokens y 2048 textos); se usan lotes
+# más pequeños para poder tener varios en vuelo a la vez.
+EMBEDDING_BATCH_MAX_TOKENS = int(os.getenv("EMBEDDING_BATCH_MAX_TOKENS", "20000"))
+EMBEDDING_BATCH_MAX_INPUTS = int(os.getenv("EMBEDDING_BATCH_MAX_INPUTS", "512"))
+EMBEDDING_MAX_CONCURRENCY = int(os.getenv("EMBEDDING_MAX_CONCURRENCY", "4"))
+EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", "6"))
+EMBEDDING_BACKOFF_BASE_SECONDS = float(os.getenv("EMBEDDING_BACKOFF_BASE_SECONDS", "1"))
+EMBEDDING_BACKOFF_MAX_SECONDS = float(os.getenv("EMBEDDING_BACKOFF_MAX_SECONDS", "60"))
+# Mensajes de chunks que el parser puede adelantar al embebido antes de esperar
+PARSE_QUEUE_MAX_MESSAGES = int(os.getenv("PARSE_QUEUE_MAX_MESSAGES", "4"))
 
-async def process_and_embed_document(file_content: bytes, agent_id: str, file_name: str):
-    print("\n--- INICIANDO PROCESO DE RAG ---")
-    temp_file_path = None
+logger = logging.getLogger(__name__)
+
+ProgressCallback = Callable[[dict], Awaitable[None]]
+Chunk = Tuple[str, dict]
+
+def document_id_for(agent_id: str, file_name: str, index_version: int = 0) -> str:
+    # Identificador estable de un documento: el mismo nombre que su blob en el storage. Cada
+    # versión del índice del agente tiene su propia copia, con la versión como sufijo
+    document_id = f"{agent_id}/{file_name}"
+    return f"{document_id}@{index_version}" if index_version else document_id
+
+async def _report(on_progress: Optional[ProgressCallback], **progress):
+    if on_progress:
+        await on_progress(progress)
+
+async def abatch_by_tokens(chunks: AsyncIterator[Chunk], max_tokens: int, max_inputs: int) -> AsyncIterator[Tuple[List[Chunk], int]]:
+    """
+    Agrupa los chunks, en orden y según van llegando, en lotes que no superan `max_tokens`
+    ni `max_inputs`. Genera cada lote con sus tokens.
+    """
+    current: List[Chunk] = []
+    current_tokens = 0
+    async for chunk in chunks:
+        tokens = count_tokens(chunk[0], EMBEDDING_MODEL)
+        if current and (current_tokens + tokens > max_tokens or len(current) >= max_inputs):
+            yield current, current_tokens
+            current, current_tokens = [], 0
+        current.append(chunk)
+        current_tokens += tokens
+    if current:
+        yield current, current_tokens
+
+def _rate_limit_delay(error: RateLimitError, attempt: int) -> float:
+    # Si OpenAI indica cuánto esperar se respeta; si no, backoff exponencial con jitter
+    retry_after = error.response.headers.get("retry-after") if error.response is not None else None
     try:
-        file_extension = f".{file_name.rsplit('.', 1)[1].lower()}"
-        if file_extension not in LOADER_MAPPING:
-            print(f"  [ERROR] Tipo de archivo no soportado: {file_extension}")
-            return
-
-        with tempfile.NamedTemporaryFile(delete=False, suffix=file_extension) as temp_file:
-            temp_file.write(file_content)
-            temp_file_path = temp_file.name
-        print(f"  [PASO 1/4] Archivo temporal creado en: {temp_file_path}")
-
-        loader = LOADER_MAPPING[file_extension](temp_file_path)
-        documents = loader.load()
-        print(f"  [PASO 2/4] Documento cargado. Número de páginas/secciones: {len(documents)}")
-
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=150)
-        chunks = text_splitter.split_documents(documents)
-        print(f"  [PASO 3/4] Documento dividido en {len(chunks)} chunks.")
-
-        # Creamos una nueva lista para nuestros documentos limpios.
-        cleaned_chunks = []
-        for chunk in chunks:
-            # Para cada chunk, creamos un nuevo objeto Document
-            # que solo contiene el contenido y la metadata que nosotros controlamos.
-            new_chunk = Document(
-                page_content=chunk.page_content,
-                metadata={
-                    'source': file_name,  # Usamos el nombre original del archivo
-                    'agent_id': agent_id
-                }
+        if retry_after is not None:
+            return float(retry_after) + random.uniform(0, 1)
+    except ValueError:
+        pass
+    delay = min(EMBEDDING_BACKOFF_BASE_SECONDS * 2 ** attempt, EMBEDDING_BACKOFF_MAX_SECONDS)
+    return delay * random.uniform(0.5, 1.0)
+
+async def _embed_with_retry(embedding_cache: EmbeddingCache, texts: List[str]) -> Tuple[List[List[float]], int]:
+    attempt = 0
+    while True:
+        try:
+            return await embedding_cache.embed_documents(texts)
+        except RateLimitError as e:
+            if attempt >= EMBEDDING_MAX_RETRIES:
+                raise
+            delay = _rate_limit_delay(e, attempt)
+            attempt += 1
+            logger.warning(
+                "Límite de peticiones de OpenAI (429), se reintenta el lote",
+                extra={"attempt": attempt, "max_retries": EMBEDDING_MAX_RETRIES, "delay_seconds": round(delay, 1)},
             )
-            cleaned_chunks.append(new_chunk)
-        
-        print("  [PASO 4/4] Chunks limpiados y preparados con la metadata correcta.")
-
-        vector_store = get_vector_store()
-        print("  Intentando guardar chunks limpios en la base de datos vectorial...")
-        
-        # Usamos la versión asíncrona para no bloquear
-        await vector_store.aadd_documents(cleaned_chunks)
-        
-        print("  ✅ ¡ÉXITO! Los chunks fueron procesados y guardados en la base de datos.")
-        print("--- FIN DEL PROCESO DE RAG ---\n")
-
-    except Exception as e:
-        print(f"  🚨🚨🚨 ERROR CRÍTICO durante el proceso de RAG: {e}")
+            await asyncio.sleep(delay)
+
+async def embed_and_store(
+    chunks: AsyncIterator[Chunk],
+    vector_store: IVectorStore,
+    on_batch: Optional[Callable[[List[Chunk]], Awaitable[None]]] = None,
+    agent_id: Optional[str] = None,
+) -> Tuple[int, int, int]:
+    """
+    Embebe los chunks en lotes por tokens según llegan, con como mucho EMBEDDING_MAX_CONCURRENCY
+    lotes en vuelo, y guarda cada lote en cuanto tiene sus embeddings: la escritura de un lote
+    se solapa con el embebido de los siguientes y con el parseo del resto del documento.
+    `on_batch` recibe cada lote ya guardado. Devuelve (chunks, tokens, aciertos de la caché).
+    Las etapas "embed" e "insert" se miden por lote.
+    """
+    embedding_cache = get_embedding_cache()
+    embedding_slots = asyncio.Semaphore(EMBEDDING_MAX_CONCURRENCY)
+    # Acota también los lotes ya embebidos pendientes de escribir, para no acumular en memoria
+    # todo el documento si el almacén de vectores va más lento que OpenAI
+    pending_slots = asyncio.Semaphore(2 * EMBEDDING_MAX_CONCURRENCY)
+    totals = {"chunks": 0, "tokens": 0, "hits": 0, "batches": 0}
+    started = time.perf_counter()
+
+    async def process(batch: List[Chunk], tokens: int):
+        try:
+            async with embedding_slots:
+                with span("embed", agent_id):
+                    embeddings, hits = await _embed_with_retry(embedding_cache, [text for text, _ in batch])
+            # El semáforo se libera antes de escribir: otro lote empieza a embeberse mientras tanto
+            with span("insert", agent_id):
+                await vector_store.add([
+                    VectorRecord(text=text, embedding=embedding, metadata=metadata)
+                    for (text, metadata), embedding in zip(batch, embeddings)
+                ])
+        finally:
+            pending_slots.release()
+        totals["chunks"] += len(batch)
+        totals["tokens"] += tokens
+        totals["hits"] += hits
+        if on_batch:
+            await on_batch(batch)
+
+    tasks: List[asyncio.Task] = []
+    try:
+        async for batch, tokens in abatch_by_tokens(chunks, EMBEDDING_BATCH_MAX_TOKENS, EMBEDDING_BATCH_MAX_INPUTS):
+            await pending_slots.acquire()
+            # Un lote fallido detiene la lectura del resto del documento cuanto antes
+            for task in tasks:
+                if task.done() and task.exception():
+                    raise task.exception()
+            tasks.append(asyncio.create_task(process(batch, tokens)))
+            totals["batches"] += 1
+        await asyncio.gather(*tasks)
+    except BaseException:
+        # Si falla un lote se cancelan los demás; el reintento reaprovecha los embeddings ya calculados (caché)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+    elapsed = max(time.perf_counter() - started, 1e-9)
+    logger.info("Chunks embebidos y guardados", extra={
+        "agent_id": agent_id,
+        "chunks": totals["chunks"],
+        "tokens": totals["tokens"],
+        "batches": totals["batches"],
+        "elapsed_seconds": round(elapsed, 2),
+        "chunks_per_second": round(totals["chunks"] / elapsed, 1),
+        "tokens_per_second": round(totals["tokens"] / elapsed),
+    })
+    return totals["chunks"], totals["tokens"], totals["hits"]
+
+async def stream_document_chunks(file_path: str, file_extension: str, timings: Optional[Dict[str, float]] = None) -> AsyncIterator[str]:
+    """
+    Genera los chunks del documento a medida que el pool de procesos los produce. Parsear y
+    dividir es CPU intensivo y síncrono: se hace en el pool para que el event loop siga
+    atendiendo los chats, y la cola acotada frena al parser si el embebido va por detrás.
+    Al terminar copia en `timings` los segundos de parseo y división medidos en el pool.
+    """
+    loop = asyncio.get_running_loop()
+    manager = get_process_manager()
+    chunk_queue = manager.Queue(maxsize=PARSE_QUEUE_MAX_MESSAGES)
+    cancelled = manager.Event()
+    parsing = loop.run_in_executor(get_process_pool(), stream_chunks, file_path, file_extension, chunk_queue, cancelled)
+    try:
+        while True:
+            try:
+                # La espera bloqueante sobre el proxy del Manager se hace en un hilo
+                kind, payload = await loop.run_in_executor(None, functools.partial(chunk_queue.get, timeout=PUT_TIMEOUT_SECONDS))
+            except queue.Empty:
+                if parsing.done():
+                    # El proceso terminó sin enviar "done": p. ej. murió o no se pudo arrancar
+                    parsing.result()
+                    raise RuntimeError("El proceso de parseo terminó sin enviar el final del documento")
+                continue
+            if kind == "chunks":
+                for chunk in payload:
+                    yield chunk
+            elif kind == "error":
+                raise ValueError(f"Error al parsear el documento: {payload}")
+            else:
+                if timings is not None:
+                    timings.update(payload)
+                break
+        await parsing
     finally:
-        if temp_file_path and os.path.exists(temp_file_path):
-            os.remove(temp_file_path)
\ No newline at end of file
+        # Si el consumidor se detiene antes (p. ej. falla un lote), el parser deja de leer
+        cancelled.set()
+
+class DocumentIngestion:
+    """
+    Estado de la ingesta de un documento en una versión del índice del agente: su versión nueva,
+    los hashes de la versión anterior, los contadores y el error si falló. Varios documentos
+    comparten una pasada de embed_and_store.
+    """
+
+    def __init__(
+        self,
+        file_path: str,
+        agent_id: str,
+        file_name: str,
+        on_progress: Optional[ProgressCallback] = None,
+        index_version: int = 0,
+    ):
+        self.file_path = file_path
+        self.agent_id = agent_id
+        self.file_name = file_name
+        self.on_progress = on_progress
+        self.index_version = index_version
+        self.file_extension = f".{file_name.rsplit('.', 1)[1].lower()}" if "." in file_name else ""
+        self.document_id = document_id_for(agent_id, file_name, index_version)
+        self.version = time.time_ns()
+        self.existing: Set[str] = set()
+        self.kept: Dict[str, dict] = {}
+        self.counts = {"parsed": 0, "new": 0, "stored": 0}
+        self.parse_timings: Dict[str, float] = {}
+        self.error: Optional[Exception] = None
+
+    def log_extra(self, **fields) -> dict:
+        return {"agent_id": self.agent_id, "file_name": self.file_name, "index_version": self.index_version, **fields}
+
+    async def new_chunks(self) -> AsyncIterator[Chunk]:
+        # Diff contra la versión anterior: solo se generan los chunks nuevos; los que siguen
+        # igual se apuntan en `kept` para re-etiquetarlos. Cada chunk se identifica por el hash
+        # de su texto y los repetidos dentro del documento se guardan una sola vez.
+        seen = set()
+        document_chunks = stream_document_chunks(self.file_path, self.file_extension, self.parse_timings)
+        try:
+            async for text in document_chunks:
+                index = self.counts["parsed"]
+                self.counts["parsed"] += 1
+                chunk_hash = hash_text(text)
+                if chunk_hash in seen:
+                    continue
+                seen.add(chunk_hash)
+                if chunk_hash in self.existing:
+                    self.kept[chunk_hash] = {"version": self.version, "chunk_index": index}
+                    continue
+                self.counts["new"] += 1
+                # Creamos los chunks con la metadata que nosotros controlamos.
+                yield text, {
+                    'source': self.file_name,  # Usamos el nombre original del archivo
+                    'agent_id': self.agent_id,
+                    'document_id': self.document_id,
+                    'index_version': self.index_version,
+                    'version': self.version,
+                    'chunk_hash': chunk_hash,
+                    'chunk_index': index,
+                }
+        finally:
+            await document_chunks.aclose()
+
+async def _merge_chunks(documents: List[DocumentIngestion]) -> AsyncIterator[Chunk]:
+    """
+    Mezcla los chunks nuevos de varios documentos a medida que se parsean, con como mucho
+    INGESTION_PROCESS_POOL_SIZE documentos parseándose a la vez (uno por proceso del pool).
+    Un documento que falla guarda su error y deja de aportar chunks; el resto sigue.
+    """
+    merged: asyncio.Queue = asyncio.Queue(maxsize=CHUNK_MESSAGE_SIZE)
+    parsing_slots = asyncio.Semaphore(INGESTION_PROCESS_POOL_SIZE)
+
+    async def produce(document: DocumentIngestion):
+        async with parsing_slots:
+            chunks = document.new_chunks()
+            try:
+                async for chunk in chunks:
+                    await merged.put(chunk)
+            except Exception as e:
+                document.error = e
+            finally:
+                await chunks.aclose()
+        # None marca el final de un documento
+        await merged.put(None)
+
+    tasks = [asyncio.create_task(produce(document)) for document in documents]
+    try:
+        remaining = len(tasks)
+        while remaining:
+            chunk = await merged.get()
+            if chunk is None:
+                remaining -= 1
+                continue
+            yield chunk
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+async def _finish_document(
+    vector_store: IVectorStore, document: DocumentIngestion, cache_hits: Optional[int], agent_repo: Optional[IAgentRepository],
+):
+    # Activa la versión nueva, re-etiqueta los chunks sin cambios y borra los de versiones anteriores
+    for stage in ("parse", "split"):
+        if stage in document.parse_timings:
+            record(stage, document.parse_timings[stage], document.agent_id)
+    counts = document.counts
+    # Con varios documentos los lotes de embeddings se comparten y los aciertos de la caché
+    # no se pueden atribuir a cada uno: solo se informan en el log del conjunto
+    hits = {"embedding_cache_hits": cache_hits} if cache_hits is not None else {}
+    logger.info("[PASO 1/3] Documento cargado y dividido", extra=document.log_extra(chunks=counts["parsed"]))
+    logger.info("[PASO 2/3] Chunks comparados con la versión anterior", extra=document.log_extra(
+        new_chunks=counts["new"], unchanged_chunks=len(document.kept), **hits,
+    ))
+
+    await _report(document.on_progress, stage="storing", chunks=counts["parsed"], new_chunks=counts["new"], **hits)
+    retired: List[int] = []
+    if agent_repo:
+        # Una sola escritura hace visible la versión nueva y oculta las anteriores: las búsquedas
+        # no mezclan nunca dos versiones del documento. Los chunks sin cambios quedan ocultos
+        # solo hasta que el re-etiquetado siguiente los pasa a la versión nueva
+        retired = await agent_repo.activate_document_version(document.agent_id, document.file_name, document.index_version, document.version)
+    await vector_store.update_chunks(document.agent_id, document.document_id, document.kept)
+    # Chunks de versiones anteriores del documento y los guardados antes de que llevaran document_id
+    # (estos solo pueden estar en el índice original)
+    removed = await vector_store.delete({"agent_id": document.agent_id, "document_id": document.document_id, "version": {"$ne": document.version}})
+    if document.index_version == 0:
+        removed += await vector_store.delete({"agent_id": document.agent_id, "source": document.file_name, "document_id": {"$exists": False}})
+    if agent_repo:
+        await agent_repo.release_document_versions(document.agent_id, document.file_name, retired)
+    logger.info("[PASO 3/3] Chunks guardados", extra=document.log_extra(inserted=counts["stored"], kept=len(document.kept), removed=removed))
+    await _report(document.on_progress, stage="done", chunks=counts["parsed"], new_chunks=counts["new"], removed_chunks=removed, **hits)
+
+async def _abandon_document(vector_store: IVectorStore, document: DocumentIngestion, agent_repo: Optional[IAgentRepository]):
+    # Los chunks que llegó a guardar la versión fallida nunca se han visto: se borran y se deja
+    # de ocultarla. Si el borrado falla sigue oculta hasta la siguiente ingesta o compact-vectors
+    try:
+        await vector_store.delete({"agent_id": document.agent_id, "document_id": document.document_id, "version": document.version})
+        if agent_repo:
+            await agent_repo.release_document_versions(document.agent_id, document.file_name, [document.version])
+    except Exception:
+        logger.warning("No se pudieron borrar los chunks de una ingesta fallida", exc_info=True, extra=document.log_extra(version=document.version))
+
+async def process_and_embed_documents(documents: List[DocumentIngestion], agent_repo: Optional[IAgentRepository] = None) -> List[DocumentIngestion]:
+    """
+    Parsea, divide, embebe y guarda varios documentos con una sola pasada de embebido: los
+    chunks de todos se mezclan según se parsean, así que los lotes de embeddings se llenan con
+    chunks de distintos archivos. Un error de parseo solo afecta a su documento; un error al
+    embeber o guardar, a todos los que no habían fallado. No lanza: cada documento queda con
+    `error` a None si se ingirió bien.
+
+    Con `agent_repo`, la versión nueva de cada documento queda oculta a las búsquedas mientras
+    se ingiere y se activa de golpe al terminar; la de un documento que falla se borra.
+    """
+    vector_store = get_vector_store()
+    active: List[DocumentIngestion] = []
+    for document in documents:
+        try:
+            if document.file_extension not in LOADER_MAPPING:
+                raise ValueError(f"Tipo de archivo no soportado: {document.file_extension}")
+            await _report(document.on_progress, stage="parsing")
+            document.existing = await vector_store.get_chunk_hashes(document.agent_id, document.document_id)
+            if agent_repo:
+                await agent_repo.start_document_version(document.agent_id, document.file_name, document.index_version, document.version)
+            active.append(document)
+        except Exception as e:
+            document.error = e
+
+    by_document_id = {document.document_id: document for document in active}
+    agent_ids = {document.agent_id for document in active}
+
+    async def on_batch(batch: List[Chunk]):
+        touched = {}
+        for _, metadata in batch:
+            document = by_document_id[metadata["document_id"]]
+            document.counts["stored"] += 1
+            touched[document.document_id] = document
+        for document in touched.values():
+            await _report(document.on_progress, stage="embedding", parsed_chunks=document.counts["parsed"], stored_chunks=document.counts["stored"])
+
+    if active:
+        logger.info("Inicio del proceso de RAG", extra={"agent_ids": sorted(agent_ids), "documents": [document.file_name for document in active]})
+        # Los chunks se embeben y guardan mientras los documentos se siguen parseando.
+        # Solo se envían a OpenAI los que no están en la caché de embeddings.
+        chunks = _merge_chunks(active)
+        try:
+            _, _, cache_hits = await embed_and_store(
+                chunks,
+                vector_store,
+                on_batch=on_batch,
+                agent_id=next(iter(agent_ids)) if len(agent_ids) == 1 else None,
+            )
+        except Exception as e:
+            for document in active:
+                document.error = document.error or e
+        finally:
+            await chunks.aclose()
+
+        for document in active:
+            if document.error is None:
+                try:
+                    await _finish_document(vector_store, document, cache_hits if len(active) == 1 else None, agent_repo)
+                except Exception as e:
+                    document.error = e
+            if document.error is not None:
+                await _abandon_document(vector_store, document, agent_repo)
+
+    for document in documents:
+        if document.error is None:
+            logger.info("Fin del proceso de RAG", extra=document.log_extra())
+        else:
+            logger.error("Error en el proceso de RAG", exc_info=document.error, extra=document.log_extra())
+    return documents
+
+async def process_and_embed_document(file_path: str, agent_id: str, file_name: str, on_progress: Optional[ProgressCallback] = None):
+    """
+    Parsea, divide, embebe y guarda un documento. Los errores se propagan para que
+    el worker de ingesta pueda reintentar el trabajo.
+    """
+    document = DocumentIngestion(file_path, agent_id, file_name, on_progress)
+    await process_and_embed_documents([document])
+    if document.error is not None:
+        raise document.error
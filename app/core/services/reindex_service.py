@@ -0,0 +1,202 @@
+# app/core/services/reindex_service.py
+import asyncio
+import logging
+import os
+from bson import ObjectId
+from datetime import datetime
+from fastapi import HTTPException, status
+from typing import List, Optional, Tuple
+
+from app.core.domain.job_model import JobStatus
+from app.core.domain.reindex_model import ReindexPhase, ReindexStatus
+from app.core.ports.agent_repository_port import IAgentRepository
+from app.core.ports.answer_cache_port import IAnswerCache
+from app.core.ports.ingestion_job_repository_port import IIngestionJobRepository
+from app.core.ports.storage_repository_port import IStorageRepository
+from app.core.ports.vector_store_port import IVectorStore
+from app.core.services.document_parser import LOADER_MAPPING
+from .ingestion_worker import INGESTION_MAX_ATTEMPTS
+
+logger = logging.getLogger(__name__)
+
+# Tiempo que se conserva la versión anterior tras el cambio: los procesos con el agente en
+# caché (AGENT_CACHE_TTL_SECONDS) siguen buscando en ella hasta que su entrada caduca
+REINDEX_RETIRE_DELAY_SECONDS = float(os.getenv("REINDEX_RETIRE_DELAY_SECONDS", "120"))
+# Trabajos por escritura masiva mientras se listan los blobs
+REINDEX_ENQUEUE_BATCH_SIZE = 500
+
+def index_version_filter(index_version: int) -> dict:
+    # Los chunks guardados antes de que existieran las versiones no llevan index_version:
+    # pertenecen a la versión 0
+    if index_version == 0:
+        return {"index_version": {"$in": [0, None]}}
+    return {"index_version": index_version}
+
+def _reindexable(file_name: str) -> bool:
+    return "." in file_name and f".{file_name.rsplit('.', 1)[1].lower()}" in LOADER_MAPPING
+
+
+class ReindexService:
+    """
+    Reindexa los documentos de un agente en una versión nueva de su índice (índice sombra)
+    sin tocar la que usan las búsquedas. Encola un trabajo de ingesta por blob del agente con
+    la versión nueva; los workers los procesan como cualquier otro lote y, cuando termina el
+    último, la versión activa cambia con una sola escritura. La versión anterior se borra
+    REINDEX_RETIRE_DELAY_SECONDS después. El estado vive en el agente y en la cola de trabajos,
+    así que una reindexación interrumpida se reanuda lanzándola de nuevo.
+    """
+
+    def __init__(
+        self,
+        agent_repo: IAgentRepository,
+        storage_repo: IStorageRepository,
+        job_repo: IIngestionJobRepository,
+        vector_store: IVectorStore,
+        answer_cache: Optional[IAnswerCache] = None,
+    ):
+        self.agent_repo = agent_repo
+        self.storage_repo = storage_repo
+        self.job_repo = job_repo
+        self.vector_store = vector_store
+        self.answer_cache = answer_cache
+
+    async def _get_agent(self, agent_id: str) -> dict:
+        agent = await self.agent_repo.find_agent_by_id(agent_id) if ObjectId.is_valid(agent_id) else None
+        if not agent:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Agent not found")
+        return agent
+
+    async def start(self, agent_id: str) -> ReindexStatus:
+        """
+        Empieza la reindexación del agente o, si hay una sin terminar (interrumpida o con
+        archivos fallidos), la reanuda con la misma versión: los trabajos ya terminados se
+        conservan y los fallidos se vuelven a encolar.
+        """
+        agent = await self._get_agent(agent_id)
+        active = agent.get("index_version", 0)
+        reindex = {
+            "index_version": active + 1,
+            "previous_index_version": active,
+            "batch_id": str(ObjectId()),
+            "phase": ReindexPhase.LISTING.value,
+            "files_total": None,
+            "started_at": datetime.utcnow(),
+            "finished_at": None,
+        }
+        if not await self.agent_repo.start_reindex(agent_id, reindex):
+            reindex = (await self._get_agent(agent_id))["reindex"]
+            await self.agent_repo.update_reindex(agent_id, reindex["index_version"], {"phase": ReindexPhase.LISTING.value})
+            logger.info("Reindexación reanudada", extra={"agent_id": agent_id, "index_version": reindex["index_version"]})
+        else:
+            logger.info("Reindexación iniciada", extra={"agent_id": agent_id, "index_version": reindex["index_version"]})
+
+        # Se encola según se lista: los workers empiezan mientras sigue el listado
+        index_version, batch_id = reindex["index_version"], reindex["batch_id"]
+        files_total = 0
+        pending: List[Tuple[str, str]] = []
+        async for file_name in self.storage_repo.list_files(agent_id):
+            if not _reindexable(file_name):
+                continue
+            pending.append((file_name, f"reindex/{agent_id}/{index_version}/{file_name}"))
+            if len(pending) == REINDEX_ENQUEUE_BATCH_SIZE:
+                files_total += await self.job_repo.enqueue_many(agent_id, pending, INGESTION_MAX_ATTEMPTS, batch_id, index_version)
+                pending = []
+        files_total += await self.job_repo.enqueue_many(agent_id, pending, INGESTION_MAX_ATTEMPTS, batch_id, index_version)
+
+        # Hasta aquí la versión no puede activarse: faltaban archivos por encolar
+        await self.agent_repo.update_reindex(agent_id, index_version, {"phase": ReindexPhase.INDEXING.value, "files_total": files_total})
+        await self.complete_if_finished(agent_id, index_version)
+        return await self.get_status(agent_id)
+
+    async def start_all(self) -> List[ReindexStatus]:
+        # Se recogen los ids antes de empezar: listar los blobs de cada agente puede tardar más
+        # de lo que aguanta abierto un cursor de Mongo
+        agent_ids = [str(agent["_id"]) async for agent in self.agent_repo.iter_agents(fields=["name"])]
+        statuses = []
+        for agent_id in agent_ids:
+            try:
+                statuses.append(await self.start(agent_id))
+            except Exception:
+                logger.exception("No se pudo iniciar la reindexación", extra={"agent_id": agent_id})
+        return statuses
+
+    async def get_status(self, agent_id: str) -> ReindexStatus:
+        agent = await self._get_agent(agent_id)
+        reindex = agent.get("reindex")
+        result = ReindexStatus(agent_id=agent_id, index_version=agent.get("index_version", 0))
+        if not reindex:
+            return result
+
+        summary = await self.job_repo.summarize_batch(agent_id, reindex["batch_id"])
+        result.phase = ReindexPhase(reindex["phase"])
+        result.building_index_version = reindex["index_version"] if result.phase != ReindexPhase.DONE else None
+        result.previous_index_version = reindex["previous_index_version"]
+        result.batch_id = reindex["batch_id"]
+        result.files_total = reindex.get("files_total")
+        result.counts = {job_status: group["files"] for job_status, group in summary.items()}
+        result.chunks = summary.get(JobStatus.DONE.value, {}).get("chunks", 0)
+        result.started_at = reindex["started_at"]
+        result.finished_at = reindex.get("finished_at")
+
+        elapsed = ((result.finished_at or datetime.utcnow()) - result.started_at).total_seconds()
+        if elapsed > 0:
+            result.elapsed_seconds = round(elapsed, 1)
+            result.files_per_second = round(result.counts.get(JobStatus.DONE.value, 0) / elapsed, 2)
+            result.chunks_per_second = round(result.chunks / elapsed, 1)
+        return result
+
+    async def target_index_versions(self, agent_id: str, index_version: Optional[int]) -> List[int]:
+        """
+        Versiones del índice en las que debe guardarse un trabajo de ingesta. Los de una
+        reindexación solo construyen su versión; una subida normal va a la versión activa y,
+        si hay una reindexación sin terminar, también a la versión en construcción, para que
+        no falte al activarla. Se lee el agente sin caché: una reindexación recién empezada
+        tiene que verse ya.
+        """
+        agent = await self.agent_repo.find_agent_by_id(agent_id)
+        if not agent:
+            return []
+        if index_version is not None:
+            return [index_version]
+        versions = [agent.get("index_version", 0)]
+        reindex = agent.get("reindex")
+        if reindex and reindex["phase"] != ReindexPhase.DONE.value:
+            versions.append(reindex["index_version"])
+        return versions
+
+    async def complete_if_finished(self, agent_id: str, index_version: int) -> Optional[int]:
+        """
+        Activa `index_version` si todos sus trabajos terminaron bien; si alguno agotó sus
+        intentos la reindexación queda en FAILED. Devuelve la versión que deja de usarse,
+        para borrarla con retire_index_version, o None si no hubo cambio.
+        """
+        agent = await self.agent_repo.find_agent_by_id(agent_id)
+        reindex = (agent or {}).get("reindex")
+        if not reindex or reindex["index_version"] != index_version or reindex["phase"] != ReindexPhase.INDEXING.value:
+            return None
+        summary = await self.job_repo.summarize_batch(agent_id, reindex["batch_id"])
+        if any(summary.get(job_status.value) for job_status in (JobStatus.QUEUED, JobStatus.RUNNING)):
+            return None
+        if summary.get(JobStatus.FAILED.value):
+            await self.agent_repo.update_reindex(agent_id, index_version, {"phase": ReindexPhase.FAILED.value})
+            logger.warning("Reindexación con archivos fallidos: la versión anterior sigue activa", extra={
+                "agent_id": agent_id, "index_version": index_version, "failed_files": summary[JobStatus.FAILED.value]["files"],
+            })
+            return None
+
+        # Varios workers pueden terminar a la vez: solo uno consigue el cambio
+        if not await self.agent_repo.switch_index_version(agent_id, index_version):
+            return None
+        if self.answer_cache:
+            await self.answer_cache.invalidate_agent(agent_id)
+        logger.info("Versión del índice activada", extra={
+            "agent_id": agent_id, "index_version": index_version, "files": summary.get(JobStatus.DONE.value, {}).get("files", 0),
+        })
+        return reindex["previous_index_version"]
+
+    async def retire_index_version(self, agent_id: str, index_version: int, delay: float = REINDEX_RETIRE_DELAY_SECONDS) -> int:
+        # Borra los chunks de una versión que ya no está activa cuando dejan de buscarse
+        await asyncio.sleep(delay)
+        removed = await self.vector_store.delete({"agent_id": agent_id, **index_version_filter(index_version)})
+        logger.info("Versión anterior del índice borrada", extra={"agent_id": agent_id, "index_version": index_version, "removed_chunks": removed})
+        return removed
@@ -0,0 +1,14 @@
+# app/core/services/token_counter.py
+from functools import lru_cache
+
+import tiktoken
+
+@lru_cache(maxsize=None)
+def get_encoding(model: str) -> tiktoken.Encoding:
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+def count_tokens(text: str, model: str) -> int:
+    return len(get_encoding(model).encode(text))
@@ -0,0 +1,36 @@
+# app/infrastructure/admission.py
+import os
+from typing import Optional
+
+from app.core.services.admission_control import AdmissionController, RequestCoalescer
+
+# Límites por proceso: con varias réplicas o workers de uvicorn, el total es la suma
+CHAT_MAX_CONCURRENCY = int(os.getenv("CHAT_MAX_CONCURRENCY", "32"))
+CHAT_MAX_CONCURRENCY_PER_AGENT = int(os.getenv("CHAT_MAX_CONCURRENCY_PER_AGENT", "8"))
+# Peticiones que pueden esperar hueco y cuánto como máximo antes de responder 429
+CHAT_MAX_QUEUE = int(os.getenv("CHAT_MAX_QUEUE", "128"))
+CHAT_MAX_QUEUE_PER_AGENT = int(os.getenv("CHAT_MAX_QUEUE_PER_AGENT", "32"))
+CHAT_QUEUE_TIMEOUT_SECONDS = float(os.getenv("CHAT_QUEUE_TIMEOUT_SECONDS", "10"))
+# Con "false" cada petición hace su propia llamada aunque haya otra idéntica en curso
+CHAT_COALESCE_REQUESTS = os.getenv("CHAT_COALESCE_REQUESTS", "true").lower() == "true"
+
+_admission: Optional[AdmissionController] = None
+_coalescer: Optional[RequestCoalescer] = None
+
+def get_admission_controller() -> AdmissionController:
+    global _admission
+    if _admission is None:
+        _admission = AdmissionController(
+            max_concurrency=CHAT_MAX_CONCURRENCY,
+            max_concurrency_per_agent=CHAT_MAX_CONCURRENCY_PER_AGENT,
+            max_queue=CHAT_MAX_QUEUE,
+            max_queue_per_agent=CHAT_MAX_QUEUE_PER_AGENT,
+            queue_timeout=CHAT_QUEUE_TIMEOUT_SECONDS,
+        )
+    return _admission
+
+def get_request_coalescer() -> Optional[RequestCoalescer]:
+    global _coalescer
+    if _coalescer is None and CHAT_COALESCE_REQUESTS:
+        _coalescer = RequestCoalescer()
+    return _coalescer
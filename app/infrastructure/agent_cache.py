@@ -0,0 +1,17 @@
+# app/infrastructure/agent_cache.py
+import os
+from typing import Optional
+
+from app.adapters.repositories.cached_agent_repository import AgentCache
+
+AGENT_CACHE_MAX_ENTRIES = int(os.getenv("AGENT_CACHE_MAX_ENTRIES", "1024"))
+# Tiempo máximo que una réplica puede servir un agente modificado desde otra
+AGENT_CACHE_TTL_SECONDS = float(os.getenv("AGENT_CACHE_TTL_SECONDS", "30"))
+
+_cache: Optional[AgentCache] = None
+
+def get_agent_cache() -> AgentCache:
+    global _cache
+    if _cache is None:
+        _cache = AgentCache(max_entries=AGENT_CACHE_MAX_ENTRIES, ttl_seconds=AGENT_CACHE_TTL_SECONDS)
+    return _cache
@@ -0,0 +1,63 @@
+# app/infrastructure/answer_cache.py
+import logging
+import os
+from typing import Optional
+
+from app.adapters.repositories.answer_cache_repository import InMemoryAnswerCache, MongoAnswerCache
+from app.core.ports.answer_cache_port import IAnswerCache
+from app.infrastructure.clients import get_clients
+
+# "memory" (por proceso), "mongo" (compartida entre réplicas) o "none" para desactivarla
+ANSWER_CACHE_BACKEND = os.getenv("ANSWER_CACHE_BACKEND", "memory").lower()
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+ANSWER_CACHE_SIMILARITY_THRESHOLD = float(os.getenv("ANSWER_CACHE_SIMILARITY_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL_SECONDS = int(os.getenv("ANSWER_CACHE_TTL_SECONDS", "3600"))
+# Backend mongo: índice de Atlas Vector Search de la colección answer_cache y candidatos por búsqueda
+# (sin Atlas, entradas recientes del agente que se comparan en el proceso)
+ANSWER_CACHE_VECTOR_INDEX = os.getenv("ANSWER_CACHE_VECTOR_INDEX", "answer_cache_vector_index")
+ANSWER_CACHE_MAX_CANDIDATES = int(os.getenv("ANSWER_CACHE_MAX_CANDIDATES", "50"))
+
+logger = logging.getLogger(__name__)
+
+_cache: Optional[IAnswerCache] = None
+_shared_required = False
+
+def require_shared_answer_cache():
+    """
+    Lo llaman la API con RUN_EMBEDDED_WORKER=false y el worker independiente. La ingesta termina
+    en otro proceso que la API, así que una caché en memoria no se invalidaría al terminar y
+    serviría respuestas antiguas hasta su TTL: en ese caso se usa la de MongoDB.
+    """
+    global _cache, _shared_required
+    _shared_required = True
+    if isinstance(_cache, InMemoryAnswerCache):
+        _cache = None
+
+def _backend() -> str:
+    if ANSWER_CACHE_BACKEND == "memory" and _shared_required:
+        logger.warning(
+            "ANSWER_CACHE_BACKEND=memory no se invalida desde un worker independiente: se usa la caché de MongoDB",
+            extra={"backend": "mongo"},
+        )
+        return "mongo"
+    return ANSWER_CACHE_BACKEND
+
+def get_answer_cache() -> Optional[IAnswerCache]:
+    global _cache
+    if _cache is None and ANSWER_CACHE_BACKEND != "none":
+        if _backend() == "mongo":
+            _cache = MongoAnswerCache(
+                get_clients().db,
+                max_entries_per_agent=ANSWER_CACHE_MAX_ENTRIES,
+                similarity_threshold=ANSWER_CACHE_SIMILARITY_THRESHOLD,
+                ttl_seconds=ANSWER_CACHE_TTL_SECONDS,
+                vector_index_name=ANSWER_CACHE_VECTOR_INDEX,
+                max_candidates=ANSWER_CACHE_MAX_CANDIDATES,
+            )
+        else:
+            _cache = InMemoryAnswerCache(
+                max_entries=ANSWER_CACHE_MAX_ENTRIES,
+                similarity_threshold=ANSWER_CACHE_SIMILARITY_THRESHOLD,
+                ttl_seconds=ANSWER_CACHE_TTL_SECONDS,
+            )
+    return _cache
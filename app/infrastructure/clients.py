@@ -0,0 +1,198 @@
+# app/infrastructure/clients.py
+import os
+from typing import TYPE_CHECKING, Dict, Optional
+
+import httpx
+from azure.storage.blob.aio import BlobServiceClient
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+from pymongo import monitoring
+
+if TYPE_CHECKING:
+    # langchain_openai (y con él openai) se importa al crear el primer cliente, no al arrancar
+    from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+
+load_dotenv()
+
+MONGO_URI = os.getenv("MONGO_URI")
+MONGO_DB_NAME = os.getenv("MONGO_DB_NAME")
+AZURE_STORAGE_CONNECTION_STRING = os.getenv("AZURE_STORAGE_CONNECTION_STRING")
+
+# Tamaños de pool configurables por variables de entorno
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "50"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "20"))
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "10"))
+
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-3.5-turbo")
+
+
+class ConnectionStats(monitoring.ConnectionPoolListener):
+    """
+    Listener del pool de pymongo que cuenta las conexiones abiertas frente a las reutilizadas.
+    Cada checkout que no corresponde a una conexión nueva es una reutilización.
+    """
+
+    def __init__(self):
+        self.opened = 0
+        self.closed = 0
+        self.checked_out = 0
+
+    @property
+    def reused(self) -> int:
+        return max(self.checked_out - self.opened, 0)
+
+    def as_dict(self) -> Dict[str, int]:
+        return {
+            "opened": self.opened,
+            "closed": self.closed,
+            "checked_out": self.checked_out,
+            "reused": self.reused,
+        }
+
+    def connection_created(self, event):
+        self.opened += 1
+
+    def connection_closed(self, event):
+        self.closed += 1
+
+    def connection_checked_out(self, event):
+        self.checked_out += 1
+
+    # El resto de eventos del pool no nos interesan, pero la interfaz los exige.
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        pass
+
+    def connection_checked_in(self, event):
+        pass
+
+
+class ClientRegistry:
+    """
+    Registro de clientes compartidos por todo el proceso.
+    Los clientes se crean la primera vez que se piden y se reutilizan en las siguientes
+    peticiones; `aclose()` los cierra al apagar la aplicación.
+    """
+
+    def __init__(self):
+        self.connection_stats = ConnectionStats()
+        self._mongo: Optional[AsyncIOMotorClient] = None
+        self._blob: Optional[BlobServiceClient] = None
+        self._http: Optional[httpx.AsyncClient] = None
+        self._embeddings: Optional["OpenAIEmbeddings"] = None
+        self._llm: Optional["ChatOpenAI"] = None
+        self._builds: Dict[str, int] = {}
+        self._reuses: Dict[str, int] = {}
+
+    def _track(self, name: str, created: bool):
+        counter = self._builds if created else self._reuses
+        counter[name] = counter.get(name, 0) + 1
+
+    @property
+    def mongo(self) -> AsyncIOMotorClient:
+        created = self._mongo is None
+        if created:
+            self._mongo = AsyncIOMotorClient(
+                MONGO_URI,
+                maxPoolSize=MONGO_MAX_POOL_SIZE,
+                minPoolSize=MONGO_MIN_POOL_SIZE,
+                event_listeners=[self.connection_stats],
+            )
+        self._track("mongo", created)
+        return self._mongo
+
+    @property
+    def db(self) -> AsyncIOMotorDatabase:
+        return self.mongo[MONGO_DB_NAME]
+
+    @property
+    def blob_service(self) -> BlobServiceClient:
+        created = self._blob is None
+        if created:
+            self._blob = BlobServiceClient.from_connection_string(AZURE_STORAGE_CONNECTION_STRING)
+        self._track("blob", created)
+        return self._blob
+
+    @property
+    def http(self) -> httpx.AsyncClient:
+        # Cliente HTTP con keep-alive compartido por los clientes de OpenAI
+        if self._http is None:
+            self._http = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=OPENAI_MAX_CONNECTIONS,
+                    max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+                ),
+                timeout=httpx.Timeout(60.0, connect=10.0),
+            )
+        return self._http
+
+    @property
+    def embeddings(self) -> "OpenAIEmbeddings":
+        created = self._embeddings is None
+        if created:
+            from langchain_openai import OpenAIEmbeddings
+
+            self._embeddings = OpenAIEmbeddings(model=EMBEDDING_MODEL, http_async_client=self.http)
+        self._track("embeddings", created)
+        return self._embeddings
+
+    @property
+    def llm(self) -> "ChatOpenAI":
+        created = self._llm is None
+        if created:
+            from langchain_openai import ChatOpenAI
+
+            self._llm = ChatOpenAI(model_name=LLM_MODEL, temperature=0, http_async_client=self.http)
+        self._track("llm", created)
+        return self._llm
+
+    def stats(self) -> dict:
+        return {
+            "mongo_connections": self.connection_stats.as_dict(),
+            "clients_created": dict(self._builds),
+            "clients_reused": dict(self._reuses),
+        }
+
+    async def aclose(self):
+        if self._blob is not None:
+            await self._blob.close()
+        if self._http is not None:
+            await self._http.aclose()
+        if self._mongo is not None:
+            self._mongo.close()
+        self._mongo = self._blob = self._http = None
+        self._embeddings = self._llm = None
+
+
+_registry: Optional[ClientRegistry] = None
+
+def get_clients() -> ClientRegistry:
+    global _registry
+    if _registry is None:
+        _registry = ClientRegistry()
+    return _registry
+
+async def close_clients():
+    global _registry
+    if _registry is not None:
+        await _registry.aclose()
+        _registry = None
@@ -1,17 +1,11 @@
-import os
-from motor.motor_asyncio import AsyncIOMotorClient
-from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorDatabase
 
-load_dotenv()
+from app.infrastructure.clients import get_clients
 
-MONGO_URI = os.getenv("MONGO_URI")
-MONGO_DB_NAME = os.getenv("MONGO_DB_NAME")
+# El cliente de Motor vive en el registro de clientes compartidos (un único pool por proceso)
 
-client = AsyncIOMotorClient(MONGO_URI)
-db = client[MONGO_DB_NAME]
-
-def get_db():
-    return db
+def get_db() -> AsyncIOMotorDatabase:
+    return get_clients().db
 
 def get_agent_collection():
-    return db.agents
\ No newline at end of file
+    return get_db().agents
@@ -0,0 +1,93 @@
+# app/infrastructure/embedding_cache.py
+import hashlib
+from typing import Dict, List, Optional, Tuple
+
+from langchain_core.embeddings import Embeddings
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo import ASCENDING
+from pymongo.errors import BulkWriteError
+
+from app.infrastructure.clients import get_clients, EMBEDDING_MODEL
+
+EMBEDDING_CACHE_COLLECTION = "embedding_cache"
+# Tamaño de los lotes de $in al consultar la caché
+LOOKUP_BATCH_SIZE = 1000
+
+def hash_text(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Caché persistente de embeddings indexada por (hash del texto, modelo).
+    Un mismo chunk solo se envía a OpenAI una vez por modelo, aunque se suba de nuevo
+    o lo compartan varios agentes.
+    """
+
+    def __init__(self, collection: AsyncIOMotorCollection, embeddings: Embeddings, model_name: str):
+        self.collection = collection
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self._indexes_ready = False
+
+    async def _ensure_indexes(self):
+        if not self._indexes_ready:
+            await self.collection.create_index([("text_hash", ASCENDING), ("model", ASCENDING)], unique=True)
+            self._indexes_ready = True
+
+    async def _lookup(self, hashes: List[str]) -> Dict[str, List[float]]:
+        found: Dict[str, List[float]] = {}
+        for start in range(0, len(hashes), LOOKUP_BATCH_SIZE):
+            batch = hashes[start:start + LOOKUP_BATCH_SIZE]
+            cursor = self.collection.find(
+                {"model": self.model_name, "text_hash": {"$in": batch}},
+                {"_id": 0, "text_hash": 1, "embedding": 1},
+            )
+            async for entry in cursor:
+                found[entry["text_hash"]] = entry["embedding"]
+        return found
+
+    async def _store(self, entries: List[dict]):
+        if not entries:
+            return
+        try:
+            await self.collection.insert_many(entries, ordered=False)
+        except BulkWriteError as e:
+            # Otra ingesta concurrente pudo guardar el mismo chunk: los duplicados no son un error
+            if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                raise
+
+    async def embed_documents(self, texts: List[str]) -> Tuple[List[List[float]], int]:
+        """
+        Devuelve los embeddings en el mismo orden que `texts` y cuántos salieron de la caché.
+        """
+        await self._ensure_indexes()
+        hashes = [hash_text(text) for text in texts]
+        unique_hashes = list(dict.fromkeys(hashes))
+        vectors = await self._lookup(unique_hashes)
+        hits = sum(1 for text_hash in hashes if text_hash in vectors)
+
+        # Solo se embeben los textos nunca vistos (y cada uno una sola vez)
+        pending: Dict[str, str] = {}
+        for text_hash, text in zip(hashes, texts):
+            if text_hash not in vectors:
+                pending.setdefault(text_hash, text)
+        if pending:
+            new_vectors = await self.embeddings.aembed_documents(list(pending.values()))
+            new_entries = []
+            for text_hash, vector in zip(pending.keys(), new_vectors):
+                vectors[text_hash] = vector
+                new_entries.append({"text_hash": text_hash, "model": self.model_name, "embedding": vector})
+            await self._store(new_entries)
+
+        return [vectors[text_hash] for text_hash in hashes], hits
+
+
+_cache: Optional[EmbeddingCache] = None
+
+def get_embedding_cache() -> EmbeddingCache:
+    global _cache
+    if _cache is None:
+        clients = get_clients()
+        _cache = EmbeddingCache(clients.db[EMBEDDING_CACHE_COLLECTION], clients.embeddings, EMBEDDING_MODEL)
+    return _cache
@@ -0,0 +1,143 @@
+# app/infrastructure/observability.py
+import asyncio
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest, start_http_server
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# json (una línea por evento, para agregadores de logs) | text
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+# Con "false" las etapas se agregan sin la etiqueta agent_id (menos series si hay muchos agentes)
+METRICS_PER_AGENT = os.getenv("METRICS_PER_AGENT", "true").lower() == "true"
+# Cada cuánto se mide el retraso del event loop
+EVENT_LOOP_LAG_INTERVAL_SECONDS = float(os.getenv("EVENT_LOOP_LAG_INTERVAL_SECONDS", "0.5"))
+
+METRICS_CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+# Desde milisegundos (búsqueda, caché) hasta minutos (ingesta de documentos grandes)
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+STAGE_SECONDS = Histogram(
+    "rag_stage_duration_seconds",
+    "Duración de cada etapa del chat y de la ingesta",
+    ["stage", "agent_id"],
+    buckets=STAGE_BUCKETS,
+)
+INGESTIONS_IN_FLIGHT = Gauge("rag_ingestions_in_flight", "Trabajos de ingesta procesándose en este proceso")
+EVENT_LOOP_LAG_SECONDS = Gauge("rag_event_loop_lag_seconds", "Retraso del event loop en la última medición")
+CHAT_IN_FLIGHT = Gauge("rag_chat_in_flight", "Peticiones de chat admitidas y en curso en este proceso")
+CHAT_QUEUE_DEPTH = Gauge("rag_chat_queue_depth", "Peticiones de chat esperando un hueco en este proceso")
+CHAT_REJECTIONS = Counter(
+    "rag_chat_rejections_total",
+    "Peticiones de chat rechazadas con 429 por cola llena (queue_full) o por esperar demasiado (timeout)",
+    ["reason", "agent_id"],
+)
+CHAT_COALESCED = Counter(
+    "rag_chat_coalesced_total",
+    "Peticiones de chat respondidas con la misma llamada que otra idéntica en curso",
+    ["agent_id"],
+)
+
+# Etapas medidas durante la petición HTTP en curso, para la cabecera Server-Timing
+_request_spans: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar("request_spans", default=None)
+
+logger = logging.getLogger(__name__)
+
+def metrics_agent_label(agent_id: Optional[str]) -> str:
+    return agent_id if METRICS_PER_AGENT and agent_id else ""
+
+def record(stage: str, seconds: float, agent_id: Optional[str] = None):
+    """
+    Registra la duración de una etapa: en el histograma de Prometheus, en las etapas de la
+    petición en curso (si la hay) y en el log a nivel DEBUG.
+    """
+    STAGE_SECONDS.labels(stage=stage, agent_id=metrics_agent_label(agent_id)).observe(seconds)
+    spans = _request_spans.get()
+    if spans is not None:
+        spans.append((stage, seconds))
+    logger.debug("span", extra={"stage": stage, "agent_id": agent_id, "duration_ms": round(seconds * 1000, 2)})
+
+@contextmanager
+def span(stage: str, agent_id: Optional[str] = None) -> Iterator[None]:
+    # Mide el bloque aunque lance una excepción: una etapa lenta que falla también interesa
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - started, agent_id)
+
+def start_request_timing() -> List[Tuple[str, float]]:
+    """
+    Empieza a recoger las etapas de la petición actual. Las tareas creadas después heredan
+    el contexto, así que sus etapas también se añaden a la misma lista.
+    """
+    spans: List[Tuple[str, float]] = []
+    _request_spans.set(spans)
+    return spans
+
+def server_timing_header(spans: List[Tuple[str, float]], total_seconds: float) -> str:
+    # Las etapas repetidas (p. ej. una por pregunta de un lote) se suman
+    durations: Dict[str, float] = {}
+    for stage, seconds in spans:
+        durations[stage] = durations.get(stage, 0.0) + seconds
+    durations["total"] = total_seconds
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in durations.items())
+
+def render_metrics() -> bytes:
+    return generate_latest()
+
+def serve_metrics(port: int):
+    # Para procesos sin API (el worker de ingesta): expone /metrics en un hilo propio
+    start_http_server(port)
+
+async def monitor_event_loop_lag(interval: float = EVENT_LOOP_LAG_INTERVAL_SECONDS):
+    """
+    Duerme `interval` segundos y mide cuánto más tarda en despertar: ese exceso es el tiempo
+    que el event loop estuvo bloqueado por código síncrono. Corre hasta que se cancela.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG_SECONDS.set(max(loop.time() - started - interval, 0.0))
+
+# Atributos propios de LogRecord; el resto son los campos pasados con `extra`
+_LOG_RECORD_FIELDS = set(vars(logging.LogRecord("", logging.INFO, "", 0, "", None, None))) | {"message", "asctime"}
+
+class StructuredFormatter(logging.Formatter):
+    """
+    Formatea cada registro con sus campos `extra`: como un objeto JSON por línea o como
+    texto seguido de pares clave=valor.
+    """
+
+    def __init__(self, as_json: bool = True):
+        super().__init__()
+        self.as_json = as_json
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields = {key: value for key, value in vars(record).items() if key not in _LOG_RECORD_FIELDS}
+        if self.as_json:
+            entry = {"time": self.formatTime(record), "level": record.levelname, "logger": record.name, "message": record.getMessage()}
+            entry.update(fields)
+            if record.exc_info:
+                entry["exception"] = self.formatException(record.exc_info)
+            return json.dumps(entry, ensure_ascii=False, default=str)
+        line = f"{self.formatTime(record)} {record.levelname} {record.name}: {record.getMessage()}"
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+def configure_logging():
+    handler = logging.StreamHandler()
+    handler.setFormatter(StructuredFormatter(as_json=LOG_FORMAT == "json"))
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(LOG_LEVEL)
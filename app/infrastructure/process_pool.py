@@ -0,0 +1,41 @@
+# app/infrastructure/process_pool.py
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.managers import SyncManager
+from typing import Optional
+
+# Número de procesos dedicados a parsear y dividir documentos (trabajo de CPU)
+INGESTION_PROCESS_POOL_SIZE = int(os.getenv("INGESTION_PROCESS_POOL_SIZE", "2"))
+
+_pool: Optional[ProcessPoolExecutor] = None
+_manager: Optional[SyncManager] = None
+
+def get_process_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # "spawn" evita heredar por fork los hilos de Motor y del event loop del proceso padre
+        _pool = ProcessPoolExecutor(
+            max_workers=INGESTION_PROCESS_POOL_SIZE,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _pool
+
+def get_process_manager() -> SyncManager:
+    """
+    Manager para crear colas y eventos que se pueden pasar a las tareas del pool
+    (las colas normales de multiprocessing no se pueden enviar a un ProcessPoolExecutor).
+    """
+    global _manager
+    if _manager is None:
+        _manager = multiprocessing.get_context("spawn").Manager()
+    return _manager
+
+def shutdown_process_pool():
+    global _pool, _manager
+    if _pool is not None:
+        _pool.shutdown(wait=True, cancel_futures=True)
+        _pool = None
+    if _manager is not None:
+        _manager.shutdown()
+        _manager = None
@@ -1,10 +1,7 @@
-import os
 from azure.storage.blob.aio import BlobServiceClient
-from dotenv import load_dotenv
 
-load_dotenv()
+from app.infrastructure.clients import get_clients
 
-AZURE_STORAGE_CONNECTION_STRING = os.getenv("AZURE_STORAGE_CONNECTION_STRING")
-
-def get_blob_service_client():
-    return BlobServiceClient.from_connection_string(AZURE_STORAGE_CONNECTION_STRING)
\ No newline at end of file
+def get_blob_service_client() -> BlobServiceClient:
+    # Se reutiliza el mismo cliente (y su sesión HTTP) en todas las peticiones
+    return get_clients().blob_service
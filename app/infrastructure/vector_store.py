@@ -1,28 +1,47 @@
 # app/infrastructure/vector_store.py
 import os
-from pymongo import MongoClient
-from langchain_mongodb import MongoDBAtlasVectorSearch
-from langchain_openai import OpenAIEmbeddings
+from typing import Optional
+
+from app.adapters.repositories.atlas_vector_store import AtlasVectorStore
+from app.adapters.repositories.numpy_vector_store import NumpyVectorStore
+from app.core.ports.vector_store_port import IVectorStore
+from app.infrastructure.clients import get_clients, MONGO_DB_NAME
 
 # Solo define las constantes aquí
-DB_NAME = os.getenv("MONGO_DB_NAME")
+DB_NAME = MONGO_DB_NAME
 COLLECTION_NAME = "knowledge_vectors"
 INDEX_NAME = "vector_index"
-MONGO_URI = os.getenv("MONGO_URI")
+# Campos que usa MongoDBAtlasVectorSearch por defecto
+TEXT_KEY = "text"
+EMBEDDING_KEY = "embedding"
+
+# "atlas" (MongoDB Atlas Vector Search) o "numpy" (índice en el propio proceso, para
+# desarrollo local, benchmarks o despliegues de un solo proceso con el worker embebido)
+VECTOR_STORE_BACKEND = os.getenv("VECTOR_STORE_BACKEND", "atlas").lower()
+VECTOR_INDEX_DIR = os.getenv("VECTOR_INDEX_DIR", "./vector_index")
 
-def get_vector_store() -> MongoDBAtlasVectorSearch:
+_vector_store: Optional[IVectorStore] = None
+
+def get_vector_store() -> IVectorStore:
     """
-    Inicializa y devuelve una instancia de MongoDBAtlasVectorSearch.
-    La conexión se crea cuando se llama a la función.
+    Devuelve el almacén de vectores configurado. Con Atlas, la colección usa el cliente
+    de Motor compartido, así que comparte su pool de conexiones.
     """
-    # La conexión y los clientes se crean aquí, no al importar el archivo
-    client = MongoClient(MONGO_URI)
-    collection = client[DB_NAME][COLLECTION_NAME]
-    
-    embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
-    
-    return MongoDBAtlasVectorSearch(
-        collection=collection,
-        embedding=embeddings,
-        index_name=INDEX_NAME
-    )
\ No newline at end of file
+    global _vector_store
+    if _vector_store is None:
+        if VECTOR_STORE_BACKEND == "numpy":
+            _vector_store = NumpyVectorStore(VECTOR_INDEX_DIR)
+        else:
+            _vector_store = AtlasVectorStore(
+                get_clients().db[COLLECTION_NAME],
+                index_name=INDEX_NAME,
+                text_key=TEXT_KEY,
+                embedding_key=EMBEDDING_KEY,
+            )
+    return _vector_store
+
+async def close_vector_store():
+    global _vector_store
+    if _vector_store is not None:
+        await _vector_store.close()
+        _vector_store = None
@@ -1,14 +1,102 @@
 from dotenv import load_dotenv
 load_dotenv()
 
-from fastapi import FastAPI
-from app.adapters.controllers import agent_controller
+import asyncio
+import importlib
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from app.adapters.controllers import admin_controller, agent_controller
+from app.core.services.document_parser import LOADER_MAPPING, get_loader_class
+from app.core.services.token_counter import get_encoding
+from app.infrastructure.clients import EMBEDDING_MODEL, LLM_MODEL, get_clients, close_clients
+from app.infrastructure.answer_cache import get_answer_cache, require_shared_answer_cache
+from app.infrastructure.agent_cache import get_agent_cache
+from app.infrastructure.admission import get_admission_controller, get_request_coalescer
+from app.infrastructure.process_pool import shutdown_process_pool
+from app.adapters.repositories.ingestion_job_repository import IngestionJobRepository
+from app.adapters.repositories.agent_repository import AgentRepository
+from app.adapters.repositories.chat_session_repository import ChatSessionRepository
+from app.infrastructure.vector_store import get_vector_store, close_vector_store
+from app.infrastructure.observability import (
+    METRICS_CONTENT_TYPE,
+    configure_logging,
+    monitor_event_loop_lag,
+    render_metrics,
+    server_timing_header,
+    start_request_timing,
+)
+from app.worker import build_ingestion_worker
+
+configure_logging()
+logger = logging.getLogger(__name__)
+
+# Con "false" la API solo encola y la ingesta la hacen réplicas de `python -m app.worker`
+RUN_EMBEDDED_WORKER = os.getenv("RUN_EMBEDDED_WORKER", "true").lower() == "true"
+# Con "true" el arranque importa los loaders y las librerías del LLM antes de aceptar peticiones,
+# en lugar de que los pague el primer chat o la primera subida
+WARM_UP_ON_STARTUP = os.getenv("WARM_UP_ON_STARTUP", "false").lower() == "true"
+WARM_UP_MODULES = ("langchain_core.prompts", "langchain_core.output_parsers", "langchain_openai")
+INGESTION_WARM_UP_MODULES = ("app.core.services.rag_processor", "langchain.text_splitter")
+
+
+def warm_up():
+    """
+    Importa por adelantado lo que se carga bajo demanda: langchain_core y langchain_openai para
+    el chat, los tokenizers y, si este proceso ingesta documentos, el pipeline con los loaders.
+    """
+    started = time.perf_counter()
+    modules = list(WARM_UP_MODULES)
+    if RUN_EMBEDDED_WORKER:
+        modules += INGESTION_WARM_UP_MODULES
+    for module in modules:
+        importlib.import_module(module)
+    if RUN_EMBEDDED_WORKER:
+        for extension in LOADER_MAPPING:
+            get_loader_class(extension)
+    try:
+        for model in (EMBEDDING_MODEL, LLM_MODEL):
+            get_encoding(model)
+    except Exception:
+        # tiktoken descarga el vocabulario la primera vez; sin red se reintentará en el primer uso
+        logger.warning("No se pudieron cargar los tokenizers durante el calentamiento", exc_info=True)
+    logger.info("Calentamiento terminado", extra={"elapsed_seconds": round(time.perf_counter() - started, 2)})
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Los clientes (Mongo, Blob, embeddings, LLM) se crean una vez y se comparten entre peticiones
+    clients = get_clients()
+    if not RUN_EMBEDDED_WORKER:
+        require_shared_answer_cache()
+    await AgentRepository(clients.db).ensure_indexes()
+    await IngestionJobRepository(clients.db).ensure_indexes()
+    await ChatSessionRepository(clients.db).ensure_indexes()
+    await get_vector_store().initialize()
+    if WARM_UP_ON_STARTUP:
+        warm_up()
+    lag_monitor = asyncio.create_task(monitor_event_loop_lag())
+    worker = worker_task = None
+    if RUN_EMBEDDED_WORKER:
+        worker = build_ingestion_worker()
+        worker_task = asyncio.create_task(worker.run())
+    yield
+    if worker:
+        worker.stop()
+        await worker_task
+    lag_monitor.cancel()
+    shutdown_process_pool()
+    await close_vector_store()
+    await close_clients()
+
 
 app = FastAPI(
     title="Gestor de Agentes de IA",
     description="Una API para gestionar agentes de IA y su base de conocimiento.",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Orígenes permitidos 
@@ -24,9 +112,68 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def server_timing(request: Request, call_next):
+    """
+    Añade a cada respuesta la cabecera Server-Timing con las etapas medidas durante la petición
+    (visible en las herramientas de desarrollo del navegador) y registra la petición en el log.
+    En las respuestas en streaming solo incluye las etapas terminadas antes de enviar las cabeceras.
+    """
+    started = time.perf_counter()
+    spans = start_request_timing()
+    response = await call_next(request)
+    elapsed = time.perf_counter() - started
+    response.headers["Server-Timing"] = server_timing_header(spans, elapsed)
+    logger.info("request", extra={
+        "method": request.method,
+        "path": request.url.path,
+        "status": response.status_code,
+        "duration_ms": round(elapsed * 1000, 2),
+    })
+    return response
+
 # Incluir el router de los agentes
 app.include_router(agent_controller.router)
+app.include_router(admin_controller.router)
 
 @app.get("/", tags=["Root"])
 def read_root():
-    return {"message": "Bienvenido al Gestor de Agentes de IA"}
\ No newline at end of file
+    return {"message": "Bienvenido al Gestor de Agentes de IA"}
+
+@app.get("/metrics", tags=["Root"])
+def metrics():
+    """
+    Métricas en formato de texto de Prometheus: histogramas de duración por etapa y agente,
+    ingestas en curso, chats en curso, en cola, rechazados y unidos, y retraso del event loop.
+    """
+    return Response(content=render_metrics(), media_type=METRICS_CONTENT_TYPE)
+
+@app.get("/stats/clients", tags=["Root"])
+def client_stats():
+    """
+    Conexiones abiertas frente a reutilizadas por los clientes compartidos.
+    """
+    return get_clients().stats()
+
+@app.get("/stats/cache", tags=["Root"])
+def answer_cache_stats():
+    """
+    Aciertos (exactos y semánticos), fallos, expulsiones e invalidaciones de la caché de respuestas.
+    """
+    cache = get_answer_cache()
+    return cache.stats() if cache else {"backend": "none"}
+
+@app.get("/stats/agents", tags=["Root"])
+def agent_cache_stats():
+    """
+    Aciertos y fallos de la caché de lectura de agentes.
+    """
+    return get_agent_cache().stats()
+
+@app.get("/stats/admission", tags=["Root"])
+def admission_stats():
+    """
+    Chats en curso y en cola (en total y por agente), rechazados con 429 y unidos a otra petición idéntica.
+    """
+    coalescer = get_request_coalescer()
+    return {**get_admission_controller().stats(), "coalescing": coalescer.stats() if coalescer else None}
@@ -0,0 +1,209 @@
+# app/maintenance.py
+# Tareas de mantenimiento por línea de comandos:
+#   python -m app.maintenance compact-vectors [--dry-run]
+#   python -m app.maintenance migrate-documents
+#   python -m app.maintenance reindex [--agent-id ID] [--wait]
+from dotenv import load_dotenv
+load_dotenv()
+
+import argparse
+import asyncio
+from typing import Optional
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import UpdateOne
+
+from app.adapters.repositories.agent_repository import AgentRepository
+from app.adapters.repositories.ingestion_job_repository import IngestionJobRepository
+from app.core.domain.job_model import JobStatus
+from app.core.domain.reindex_model import ReindexPhase
+from app.infrastructure.clients import get_clients, close_clients
+from app.infrastructure.process_pool import shutdown_process_pool
+from app.infrastructure.vector_store import get_vector_store, close_vector_store
+from app.worker import build_ingestion_worker, build_reindex_service
+
+# Cada cuánto informa del progreso `reindex --wait`
+REINDEX_POLL_SECONDS = 5
+
+async def compact_vectors(dry_run: bool) -> dict:
+    """
+    Elimina del almacén de vectores los chunks huérfanos: los de agentes que ya no existen,
+    los de documentos que ya no figuran en su agente y los de versiones del índice que ya no
+    se usan (ni la activa ni una en construcción). También los de versiones de documentos
+    ocultas (ingestas que fallaron o sustituidas) cuyo borrado se perdió.
+    """
+    db = get_clients().db
+    vector_store = get_vector_store()
+    await vector_store.initialize()
+    repository = AgentRepository(db)
+    report = {"orphan_agents": 0, "orphan_documents": 0, "deleted_chunks": 0, "stale_version_chunks": 0, "hidden_version_chunks": 0}
+
+    for agent_id, sources in (await vector_store.list_sources()).items():
+        try:
+            agent = await db.agents.find_one({"_id": ObjectId(agent_id)}, {"_id": 1, "index_version": 1, "reindex": 1})
+        except (InvalidId, TypeError):
+            agent = None
+
+        if agent is None:
+            report["orphan_agents"] += 1
+            print(f"Agente inexistente {agent_id}: {len(sources)} documentos huérfanos")
+            if not dry_run:
+                report["deleted_chunks"] += await vector_store.delete({"agent_id": agent_id})
+            continue
+
+        known = set(await db.agent_documents.distinct("file_name", {"agent_id": agent_id}))
+        for source in sources - known:
+            report["orphan_documents"] += 1
+            print(f"Documento huérfano {agent_id}/{source}")
+            if not dry_run:
+                report["deleted_chunks"] += await vector_store.delete({"agent_id": agent_id, "source": source})
+
+        # Las versiones ocultas de un documento sin trabajos pendientes ya no se van a activar
+        hidden = db.agent_documents.find({"agent_id": agent_id, "hidden_versions": {"$gt": 0}}, {"file_name": 1, "hidden_versions": 1})
+        async for document in hidden:
+            file_name = document["file_name"]
+            pending = await db.ingestion_jobs.find_one({
+                "agent_id": agent_id, "file_name": file_name, "status": {"$in": [JobStatus.QUEUED.value, JobStatus.RUNNING.value]},
+            }, {"_id": 1})
+            if pending is not None or dry_run:
+                continue
+            versions = document["hidden_versions"]
+            deleted = await vector_store.delete({"agent_id": agent_id, "source": file_name, "version": {"$in": versions}})
+            await repository.release_document_versions(agent_id, file_name, versions)
+            if deleted:
+                print(f"Documento {agent_id}/{file_name}: {deleted} chunks de versiones ocultas")
+            report["hidden_version_chunks"] += deleted
+
+        # Versiones retiradas cuyo borrado se perdió (p. ej. el worker se reinició antes) o
+        # escritas por una ingesta que terminó después del cambio de versión
+        live = [agent.get("index_version", 0)]
+        reindex = agent.get("reindex")
+        if reindex and reindex["phase"] != ReindexPhase.DONE.value:
+            live.append(reindex["index_version"])
+        if 0 in live:
+            live.append(None)
+        if not dry_run:
+            stale = await vector_store.delete({"agent_id": agent_id, "index_version": {"$nin": live}})
+            if stale:
+                print(f"Agente {agent_id}: {stale} chunks de versiones del índice que ya no se usan")
+            report["stale_version_chunks"] += stale
+
+    return report
+
+async def migrate_documents() -> dict:
+    """
+    Mueve el array embebido `documents` de cada agente a la colección agent_documents
+    y deja el contador document_count en el agente. Se puede ejecutar varias veces.
+    """
+    db = get_clients().db
+    repository = AgentRepository(db)
+    await repository.ensure_indexes()
+    report = {"migrated_agents": 0, "migrated_documents": 0}
+
+    async for agent in db.agents.find({"documents": {"$exists": True}}, {"documents": 1}):
+        agent_id = str(agent["_id"])
+        operations = [
+            UpdateOne(
+                {"agent_id": agent_id, "file_name": document["file_name"]},
+                {"$set": {**document, "agent_id": agent_id}},
+                upsert=True,
+            )
+            for document in agent.get("documents", [])
+        ]
+        if operations:
+            await db.agent_documents.bulk_write(operations, ordered=False)
+        document_count = await db.agent_documents.count_documents({"agent_id": agent_id})
+        await db.agents.update_one(
+            {"_id": agent["_id"]},
+            {"$set": {"document_count": document_count}, "$unset": {"documents": ""}},
+        )
+        report["migrated_agents"] += 1
+        report["migrated_documents"] += len(operations)
+        print(f"Agente {agent_id}: {len(operations)} documentos migrados")
+
+    return report
+
+async def reindex(agent_id: Optional[str], wait: bool) -> dict:
+    """
+    Empieza (o reanuda) la reindexación de un agente o de todos. Sin `wait` los trabajos los
+    procesan los workers de ingesta; con `wait` se procesan en este proceso, se informa del
+    progreso y, cuando se activa cada versión nueva, se borra la anterior.
+    """
+    db = get_clients().db
+    await AgentRepository(db).ensure_indexes()
+    await IngestionJobRepository(db).ensure_indexes()
+    await get_vector_store().initialize()
+    service = build_reindex_service()
+
+    statuses = [await service.start(agent_id)] if agent_id else await service.start_all()
+    for status in statuses:
+        print(f"Agente {status.agent_id}: versión {status.building_index_version or status.index_version}, {status.files_total} archivos ({status.phase.value})")
+    report = {"started": len(statuses), "activated": 0, "failed": 0, "retired_chunks": 0}
+    if not wait:
+        return report
+
+    worker = build_ingestion_worker()
+    worker_task = asyncio.create_task(worker.run())
+    pending = {status.agent_id for status in statuses}
+    retirements = []
+    try:
+        while True:
+            for current in sorted(pending):
+                status = await service.get_status(current)
+                done = status.counts.get("done", 0)
+                print(
+                    f"Agente {current}: {status.phase.value}, {done}/{status.files_total} archivos, {status.chunks} chunks, "
+                    f"{status.files_per_second or 0} archivos/s, {status.chunks_per_second or 0} chunks/s"
+                )
+                if status.phase == ReindexPhase.DONE:
+                    pending.discard(current)
+                    report["activated"] += 1
+                    retirements.append(service.retire_index_version(current, status.previous_index_version))
+                elif status.phase == ReindexPhase.FAILED:
+                    pending.discard(current)
+                    report["failed"] += 1
+            if not pending:
+                break
+            await asyncio.sleep(REINDEX_POLL_SECONDS)
+    finally:
+        worker.stop()
+        await worker_task
+    # Las réplicas de la API con el agente en caché siguen buscando en la versión anterior
+    # hasta que caduca su entrada: se espera REINDEX_RETIRE_DELAY_SECONDS antes de borrarla
+    report["retired_chunks"] = sum(await asyncio.gather(*retirements))
+    return report
+
+async def run(args):
+    try:
+        if args.command == "compact-vectors":
+            report = await compact_vectors(args.dry_run)
+            print(report)
+        elif args.command == "migrate-documents":
+            report = await migrate_documents()
+            print(report)
+        elif args.command == "reindex":
+            report = await reindex(args.agent_id, args.wait)
+            print(report)
+    finally:
+        shutdown_process_pool()
+        await close_vector_store()
+        await close_clients()
+
+def main():
+    parser = argparse.ArgumentParser(description="Tareas de mantenimiento del Gestor de Agentes de IA")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    compact = subparsers.add_parser("compact-vectors", help="Elimina vectores de agentes o documentos que ya no existen")
+    compact.add_argument("--dry-run", action="store_true", help="Solo informa, no borra nada")
+
+    subparsers.add_parser("migrate-documents", help="Mueve los documentos embebidos de los agentes a la colección agent_documents")
+
+    reindex_parser = subparsers.add_parser("reindex", help="Reindexa los documentos de los agentes en una versión nueva del índice")
+    reindex_parser.add_argument("--agent-id", help="Solo este agente (por defecto, todos)")
+    reindex_parser.add_argument("--wait", action="store_true", help="Procesa los trabajos en este proceso y espera a que termine")
+
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+# app/worker.py
+# Punto de entrada del worker de ingesta: `python -m app.worker`.
+# Se pueden lanzar tantas réplicas como se necesite; se reparten los trabajos mediante leases.
+from dotenv import load_dotenv
+load_dotenv()
+
+import asyncio
+import os
+import signal
+
+from app.adapters.repositories.agent_repository import AgentRepository
+from app.adapters.repositories.ingestion_job_repository import IngestionJobRepository
+from app.adapters.repositories.storage_repository import StorageRepository
+from app.core.services.ingestion_worker import IngestionWorker
+from app.core.services.reindex_service import ReindexService
+from app.infrastructure.answer_cache import get_answer_cache, require_shared_answer_cache
+from app.infrastructure.clients import get_clients, close_clients
+from app.infrastructure.observability import configure_logging, monitor_event_loop_lag, serve_metrics
+from app.infrastructure.process_pool import shutdown_process_pool
+from app.infrastructure.vector_store import get_vector_store, close_vector_store
+
+# Puerto del endpoint /metrics del worker; 0 lo desactiva
+WORKER_METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT", "0"))
+
+def build_reindex_service() -> ReindexService:
+    clients = get_clients()
+    # Sin caché de agentes: el worker tiene que ver enseguida una reindexación recién empezada
+    return ReindexService(
+        AgentRepository(clients.db),
+        StorageRepository(clients.blob_service),
+        IngestionJobRepository(clients.db),
+        get_vector_store(),
+        get_answer_cache(),
+    )
+
+def build_ingestion_worker() -> IngestionWorker:
+    clients = get_clients()
+    return IngestionWorker(
+        IngestionJobRepository(clients.db),
+        StorageRepository(clients.blob_service),
+        get_answer_cache(),
+        build_reindex_service(),
+        get_vector_store(),
+        AgentRepository(clients.db),
+    )
+
+async def main():
+    configure_logging()
+    if WORKER_METRICS_PORT:
+        serve_metrics(WORKER_METRICS_PORT)
+    lag_monitor = asyncio.create_task(monitor_event_loop_lag())
+    # Las invalidaciones de este proceso tienen que llegar a la caché de la API
+    require_shared_answer_cache()
+    await IngestionJobRepository(get_clients().db).ensure_indexes()
+    await get_vector_store().initialize()
+    worker = build_ingestion_worker()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, worker.stop)
+    try:
+        await worker.run()
+    finally:
+        lag_monitor.cancel()
+        shutdown_process_pool()
+        await close_vector_store()
+        await close_clients()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,179 @@
+# benchmarks/blob_deletion.py
+# Comprueba StorageRepository.delete_agent_folder (el real, no el de benchmarks/fakes.py) contra
+# un ContainerClient falso que imita Blob Batch: lotes de como máximo BLOB_DELETE_BATCH_SIZE
+# blobs, como mucho BLOB_DELETE_MAX_CONCURRENCY lotes a la vez, borrado mientras sigue el listado
+# y el resultado por blob (202/404 borrados; 403, lote fallido o listado cortado en `failed`).
+# Falla con un mensaje por cada comprobación que no se cumple.
+#
+#   python -m benchmarks.blob_deletion --blobs 1000
+import argparse
+import asyncio
+import sys
+import time
+from dataclasses import dataclass
+from typing import AsyncIterator, List, Optional
+
+from app.adapters.repositories import storage_repository
+from app.adapters.repositories.storage_repository import StorageRepository
+
+AGENT_ID = "agent"
+# Blobs por página del listado y latencias simuladas
+LIST_PAGE_SIZE = 100
+LIST_PAGE_SECONDS = 0.005
+BATCH_SECONDS = 0.02
+
+
+@dataclass
+class FakeBlob:
+    name: str
+
+
+@dataclass
+class FakeResponse:
+    status_code: int
+    reason: str
+
+
+def expected_status(name: str) -> int:
+    # Mezcla de respuestas según el número del blob: ya borrado (404) o sin permiso (403)
+    number = int(name.rsplit("-", 1)[1].split(".")[0])
+    if number % 10 == 3:
+        return 404
+    if number % 10 == 7:
+        return 403
+    return 202
+
+
+class FakeContainerClient:
+    """
+    list_blobs pagina con latencia y puede cortarse tras `list_fail_after` blobs; delete_blobs
+    registra el tamaño de cada lote y cuántos hay en curso, y puede fallar entero para los
+    lotes que contienen `failing_blob`.
+    """
+
+    def __init__(self, names: List[str], list_fail_after: Optional[int] = None, failing_blob: Optional[str] = None):
+        self.names = names
+        self.list_fail_after = list_fail_after
+        self.failing_blob = failing_blob
+        self.batch_sizes: List[int] = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.first_delete_at: Optional[float] = None
+        self.listing_done_at: Optional[float] = None
+
+    async def list_blobs(self, name_starts_with: str) -> AsyncIterator[FakeBlob]:
+        for index, name in enumerate(name for name in self.names if name.startswith(name_starts_with)):
+            if index % LIST_PAGE_SIZE == 0:
+                await asyncio.sleep(LIST_PAGE_SECONDS)
+            if self.list_fail_after is not None and index == self.list_fail_after:
+                raise ConnectionError("connection reset while listing")
+            yield FakeBlob(name)
+        self.listing_done_at = time.perf_counter()
+
+    async def delete_blobs(self, *names: str, raise_on_any_failure: bool = True) -> AsyncIterator[FakeResponse]:
+        assert not raise_on_any_failure, "delete_blobs debe pedirse con raise_on_any_failure=False"
+        self.batch_sizes.append(len(names))
+        if self.first_delete_at is None:
+            self.first_delete_at = time.perf_counter()
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(BATCH_SECONDS)
+            if self.failing_blob in names:
+                raise ConnectionError("batch request failed")
+        finally:
+            self.in_flight -= 1
+
+        async def responses():
+            for name in names:
+                status = expected_status(name)
+                yield FakeResponse(status, {202: "Accepted", 404: "Not Found", 403: "Forbidden"}[status])
+        return responses()
+
+
+class FakeBlobServiceClient:
+    def __init__(self, container: FakeContainerClient):
+        self.container = container
+
+    def get_container_client(self, container: str) -> FakeContainerClient:
+        return self.container
+
+
+def blob_names(count: int) -> List[str]:
+    # Blobs de otro agente con un prefijo parecido: no deben tocarse
+    return [f"{AGENT_ID}/doc-{index}.pdf" for index in range(count)] + [f"{AGENT_ID}-other/doc-{index}.pdf" for index in range(10)]
+
+
+async def check_mixed_statuses(count: int) -> List[str]:
+    failures = []
+    container = FakeContainerClient(blob_names(count))
+    result = await StorageRepository(FakeBlobServiceClient(container)).delete_agent_folder(AGENT_ID)
+
+    batch_size = storage_repository.BLOB_DELETE_BATCH_SIZE
+    expected_batches = [batch_size] * (count // batch_size) + ([count % batch_size] if count % batch_size else [])
+    if sorted(container.batch_sizes, reverse=True) != expected_batches:
+        failures.append(f"lotes {container.batch_sizes}, se esperaban {expected_batches}")
+    if container.max_in_flight > storage_repository.BLOB_DELETE_MAX_CONCURRENCY:
+        failures.append(f"{container.max_in_flight} lotes a la vez, el máximo es {storage_repository.BLOB_DELETE_MAX_CONCURRENCY}")
+    if len(expected_batches) > 1 and container.max_in_flight < 2:
+        failures.append("los lotes no se borran en paralelo")
+    if count > batch_size and container.first_delete_at >= container.listing_done_at:
+        failures.append("el primer lote no empieza hasta terminar el listado")
+
+    forbidden = {f"{AGENT_ID}/doc-{index}.pdf" for index in range(count) if index % 10 == 7}
+    failed = {failure.blob_name for failure in result.failed}
+    if failed != forbidden:
+        failures.append(f"failed tiene {len(failed)} blobs, se esperaban los {len(forbidden)} con 403")
+    if any(not failure.error.startswith("403") for failure in result.failed):
+        failures.append("el error de un blob fallido no lleva su estado 403")
+    if result.deleted != count - len(forbidden):
+        failures.append(f"deleted={result.deleted}, se esperaban {count - len(forbidden)} (202 y 404)")
+    return failures
+
+
+async def check_failed_batch(count: int) -> List[str]:
+    # Si la petición de un lote falla, todos sus blobs quedan en `failed` y el resto sigue
+    failures = []
+    batch_size = storage_repository.BLOB_DELETE_BATCH_SIZE
+    container = FakeContainerClient(blob_names(count), failing_blob=f"{AGENT_ID}/doc-0.pdf")
+    result = await StorageRepository(FakeBlobServiceClient(container)).delete_agent_folder(AGENT_ID)
+    first_batch = {f"{AGENT_ID}/doc-{index}.pdf" for index in range(min(batch_size, count))}
+    batch_errors = {failure.blob_name for failure in result.failed if "batch request failed" in failure.error}
+    if batch_errors != first_batch:
+        failures.append(f"lote fallido: {len(batch_errors)} blobs en failed, se esperaban {len(first_batch)}")
+    if len(container.batch_sizes) != -(-count // batch_size):
+        failures.append("un lote fallido impide borrar los demás")
+    return failures
+
+
+async def check_listing_failure(count: int) -> List[str]:
+    # Un listado cortado se informa con el prefijo del agente; los lotes ya lanzados terminan
+    failures = []
+    batch_size = storage_repository.BLOB_DELETE_BATCH_SIZE
+    cut = min(count - 1, batch_size + batch_size // 2)
+    container = FakeContainerClient(blob_names(count), list_fail_after=cut)
+    result = await StorageRepository(FakeBlobServiceClient(container)).delete_agent_folder(AGENT_ID)
+    listing = [failure for failure in result.failed if failure.blob_name == f"{AGENT_ID}/"]
+    if len(listing) != 1 or "Listing failed" not in listing[0].error:
+        failures.append("el fallo del listado no aparece en failed con el prefijo del agente")
+    if sum(container.batch_sizes) != (cut // batch_size) * batch_size:
+        failures.append(f"tras cortarse el listado se borraron {sum(container.batch_sizes)} blobs, se esperaban los lotes completos ya lanzados")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Comprobación del borrado por lotes de la carpeta de un agente")
+    parser.add_argument("--blobs", type=int, default=1000, help="Blobs del agente (más de un lote)")
+    args = parser.parse_args()
+
+    failures = []
+    for name, check in (("mixed_statuses", check_mixed_statuses), ("failed_batch", check_failed_batch), ("listing_failure", check_listing_failure)):
+        problems = asyncio.run(check(args.blobs))
+        print(f"{name}: {'ok' if not problems else 'FALLA'}")
+        failures.extend(f"{name}: {problem}" for problem in problems)
+    if failures:
+        sys.exit("\n".join(failures))
+
+
+if __name__ == "__main__":
+    main()
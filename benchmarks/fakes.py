@@ -0,0 +1,482 @@
+# benchmarks/fakes.py
+# Implementaciones en memoria de los puertos y de los clientes externos para los benchmarks.
+# Son deterministas y cada operación puede llevar una latencia artificial que imita la red.
+import asyncio
+import hashlib
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, AsyncIterator, BinaryIO, Dict, List, Optional, Tuple
+
+import numpy as np
+from bson import ObjectId
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from app.adapters.repositories.agent_repository import encode_document_cursor
+from app.core.domain.agent_model import AgentCreate, AgentUpdate, Document
+from app.core.domain.job_model import JobKind, JobStatus
+from app.core.domain.reindex_model import ReindexPhase
+from app.core.domain.storage_model import FolderDeletionResult
+from app.core.ports.agent_repository_port import IAgentRepository
+from app.core.ports.ingestion_job_repository_port import IIngestionJobRepository
+from app.core.ports.storage_repository_port import AsyncReadable, IStorageRepository
+from app.infrastructure.clients import ClientRegistry
+
+EMBEDDING_DIMENSIONS = 256
+READ_CHUNK = 1024 * 1024
+
+
+@dataclass
+class Latencies:
+    """
+    Latencias artificiales en segundos.
+    """
+    mongo: float = 0.002
+    blob: float = 0.01
+    embedding: float = 0.05
+    llm_first_token: float = 0.3
+    llm_token: float = 0.01
+    llm_tokens: int = 40
+
+
+def fake_embedding(text: str) -> List[float]:
+    # Vector unitario determinista a partir del hash del texto
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big")
+    vector = np.random.default_rng(seed).standard_normal(EMBEDDING_DIMENSIONS)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+class FakeEmbeddings(Embeddings):
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [fake_embedding(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return fake_embedding(text)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return self.embed_documents(texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return self.embed_query(text)
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Modelo de chat que responde siempre lo mismo: espera `first_token_latency`, y después
+    emite `tokens` fragmentos separados por `token_latency`.
+    """
+    first_token_latency: float = 0.3
+    token_latency: float = 0.01
+    tokens: int = 40
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-benchmark-chat"
+
+    def _answer_tokens(self) -> List[str]:
+        return [f"token{index} " for index in range(self.tokens)]
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(self._answer_tokens())))])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self.first_token_latency + self.token_latency * (self.tokens - 1))
+        return self._generate(messages, stop)
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        await asyncio.sleep(self.first_token_latency)
+        for index, token in enumerate(self._answer_tokens()):
+            if index:
+                await asyncio.sleep(self.token_latency)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+
+class FakeClients(ClientRegistry):
+    """
+    Registro de clientes con embeddings y LLM falsos. Mongo y Blob no se usan: los
+    repositorios se sustituyen por las implementaciones en memoria de este módulo.
+    """
+
+    def __init__(self, latencies: Latencies):
+        super().__init__()
+        self._fake_embeddings = FakeEmbeddings(latencies.embedding)
+        self._fake_llm = FakeChatModel(
+            first_token_latency=latencies.llm_first_token,
+            token_latency=latencies.llm_token,
+            tokens=latencies.llm_tokens,
+        )
+
+    @property
+    def embeddings(self) -> FakeEmbeddings:
+        return self._fake_embeddings
+
+    @property
+    def llm(self) -> FakeChatModel:
+        return self._fake_llm
+
+
+class FakeEmbeddingCache:
+    """
+    Mismo contrato que EmbeddingCache.embed_documents, sin caché: todo va a los embeddings falsos.
+    """
+
+    def __init__(self, embeddings: FakeEmbeddings):
+        self.embeddings = embeddings
+
+    async def embed_documents(self, texts: List[str]):
+        return await self.embeddings.aembed_documents(texts), 0
+
+
+class FakeAgentRepository(IAgentRepository):
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.agents: Dict[str, dict] = {}
+        self.documents: Dict[str, Dict[str, dict]] = {}
+
+    async def _io(self):
+        await asyncio.sleep(self.latency)
+
+    async def create_agent(self, agent_data: AgentCreate) -> dict:
+        await self._io()
+        agent_id = ObjectId()
+        agent = {"_id": agent_id, **agent_data.model_dump(), "created_at": datetime.utcnow(), "document_count": 0}
+        self.agents[str(agent_id)] = agent
+        self.documents[str(agent_id)] = {}
+        return dict(agent)
+
+    async def find_agent_by_id(self, agent_id: str) -> Optional[dict]:
+        await self._io()
+        agent = self.agents.get(agent_id)
+        return dict(agent) if agent else None
+
+    async def find_chat_settings(self, agent_id: str) -> Optional[dict]:
+        await self._io()
+        agent = self.agents.get(agent_id)
+        return {"prompt": agent["prompt"], "index_version": agent.get("index_version", 0)} if agent else None
+
+    def _page(self, limit: Optional[int], after: Optional[str], fields: Optional[List[str]]) -> List[dict]:
+        agent_ids = sorted(self.agents, key=ObjectId)
+        if after:
+            agent_ids = [agent_id for agent_id in agent_ids if ObjectId(agent_id) > ObjectId(after)]
+        if limit:
+            agent_ids = agent_ids[:limit]
+        keys = set(fields or ["name", "prompt", "document_count"])
+        return [
+            {"_id": self.agents[agent_id]["_id"], **{key: value for key, value in self.agents[agent_id].items() if key in keys}}
+            for agent_id in agent_ids
+        ]
+
+    async def get_all_agents(self, limit: Optional[int] = None, after: Optional[str] = None, fields: Optional[List[str]] = None) -> List[dict]:
+        await self._io()
+        return self._page(limit, after, fields)
+
+    async def iter_agents(self, limit: Optional[int] = None, after: Optional[str] = None, fields: Optional[List[str]] = None) -> AsyncIterator[dict]:
+        await self._io()
+        for agent in self._page(limit, after, fields):
+            yield agent
+
+    async def update_agent(self, agent_id: str, update_data: AgentUpdate) -> Optional[dict]:
+        await self._io()
+        agent = self.agents.get(agent_id)
+        if agent is None:
+            return None
+        agent.update(update_data.model_dump(exclude_unset=True))
+        return dict(agent)
+
+    async def add_document_to_agent(self, agent_id: str, document: Document) -> bool:
+        await self._io()
+        if agent_id not in self.agents:
+            return False
+        documents = self.documents[agent_id]
+        if document.file_name not in documents:
+            self.agents[agent_id]["document_count"] += 1
+        documents[document.file_name] = {"_id": ObjectId(), "agent_id": agent_id, **document.model_dump()}
+        return True
+
+    async def add_documents_to_agent(self, agent_id: str, documents: List[Document]) -> int:
+        await self._io()
+        stored = self.documents.setdefault(agent_id, {})
+        added = 0
+        for document in documents:
+            if document.file_name not in stored:
+                added += 1
+                stored[document.file_name] = {"_id": ObjectId(), "agent_id": agent_id}
+            stored[document.file_name].update(document.model_dump())
+        if added and agent_id in self.agents:
+            self.agents[agent_id]["document_count"] += added
+        return added
+
+    async def list_documents(self, agent_id: str, limit: int, after: Optional[str] = None) -> List[dict]:
+        await self._io()
+        rows = sorted(self.documents.get(agent_id, {}).values(), key=lambda row: (row["uploaded_at"], row["_id"]))
+        rows = [{**row, "cursor": encode_document_cursor(row)} for row in rows]
+        if after:
+            rows = [row for row in rows if row["cursor"] > after]
+        return rows[:limit]
+
+    async def remove_document_from_agent(self, agent_id: str, file_name: str) -> bool:
+        await self._io()
+        removed = self.documents.get(agent_id, {}).pop(file_name, None)
+        if removed:
+            self.agents[agent_id]["document_count"] -= 1
+        return removed is not None
+
+    async def start_document_version(self, agent_id: str, file_name: str, index_version: int, version: int) -> bool:
+        await self._io()
+        document = self.documents.get(agent_id, {}).get(file_name)
+        if document is None:
+            return False
+        document.setdefault("pending_versions", []).append({"index_version": index_version, "version": version})
+        document.setdefault("hidden_versions", set()).add(version)
+        return True
+
+    async def activate_document_version(self, agent_id: str, file_name: str, index_version: int, version: int) -> List[int]:
+        await self._io()
+        document = self.documents.get(agent_id, {}).get(file_name)
+        if document is None:
+            return []
+        pending = document.get("pending_versions", [])
+        retired = [entry["version"] for entry in pending if entry["index_version"] == index_version and entry["version"] < version]
+        active = document.setdefault("active_versions", {}).get(str(index_version))
+        if active is not None and active != version:
+            retired.append(active)
+        document["active_versions"][str(index_version)] = version
+        document["pending_versions"] = [
+            entry for entry in pending if not (entry["index_version"] == index_version and entry["version"] <= version)
+        ]
+        document["hidden_versions"] = (document.get("hidden_versions", set()) - {version}) | set(retired)
+        return retired
+
+    async def release_document_versions(self, agent_id: str, file_name: str, versions: List[int]) -> None:
+        await self._io()
+        document = self.documents.get(agent_id, {}).get(file_name)
+        if document is not None:
+            document["pending_versions"] = [entry for entry in document.get("pending_versions", []) if entry["version"] not in versions]
+            document["hidden_versions"] = document.get("hidden_versions", set()) - set(versions)
+
+    async def find_hidden_versions(self, agent_id: str) -> List[int]:
+        await self._io()
+        return sorted({version for document in self.documents.get(agent_id, {}).values() for version in document.get("hidden_versions", ())})
+
+    async def start_reindex(self, agent_id: str, reindex: dict) -> bool:
+        await self._io()
+        agent = self.agents.get(agent_id)
+        if agent is None or agent.get("reindex", {}).get("phase", ReindexPhase.DONE.value) != ReindexPhase.DONE.value:
+            return False
+        agent["reindex"] = dict(reindex)
+        return True
+
+    async def update_reindex(self, agent_id: str, index_version: int, fields: dict) -> bool:
+        await self._io()
+        reindex = self.agents.get(agent_id, {}).get("reindex")
+        if not reindex or reindex["index_version"] != index_version:
+            return False
+        reindex.update(fields)
+        return True
+
+    async def switch_index_version(self, agent_id: str, index_version: int) -> bool:
+        await self._io()
+        agent = self.agents.get(agent_id)
+        reindex = (agent or {}).get("reindex")
+        if not reindex or reindex["index_version"] != index_version or reindex["phase"] != ReindexPhase.INDEXING.value:
+            return False
+        agent["index_version"] = index_version
+        reindex.update(phase=ReindexPhase.DONE.value, finished_at=datetime.utcnow())
+        return True
+
+    async def delete_agent(self, agent_id: str) -> bool:
+        await self._io()
+        self.documents.pop(agent_id, None)
+        return self.agents.pop(agent_id, None) is not None
+
+
+class FakeStorageRepository(IStorageRepository):
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.blobs: Dict[str, bytes] = {}
+
+    async def upload_file(self, agent_id: str, file_name: str, file_content: bytes) -> str:
+        await asyncio.sleep(self.latency)
+        self.blobs[f"{agent_id}/{file_name}"] = file_content
+        return f"https://fake.blob.core.windows.net/knowledge-base/{agent_id}/{file_name}"
+
+    async def upload_stream(self, agent_id: str, file_name: str, stream: AsyncReadable) -> str:
+        parts = []
+        while True:
+            data = await stream.read(READ_CHUNK)
+            if not data:
+                break
+            parts.append(data)
+        return await self.upload_file(agent_id, file_name, b"".join(parts))
+
+    async def download_to_file(self, agent_id: str, file_name: str, target: BinaryIO) -> int:
+        await asyncio.sleep(self.latency)
+        content = self.blobs[f"{agent_id}/{file_name}"]
+        target.write(content)
+        target.flush()
+        return len(content)
+
+    async def list_files(self, agent_id: str) -> AsyncIterator[str]:
+        await asyncio.sleep(self.latency)
+        prefix = f"{agent_id}/"
+        for name in [name for name in self.blobs if name.startswith(prefix)]:
+            yield name[len(prefix):]
+
+    async def delete_file(self, agent_id: str, file_name: str) -> bool:
+        await asyncio.sleep(self.latency)
+        self.blobs.pop(f"{agent_id}/{file_name}", None)
+        return True
+
+    async def delete_agent_folder(self, agent_id: str) -> FolderDeletionResult:
+        await asyncio.sleep(self.latency)
+        names = [name for name in self.blobs if name.startswith(f"{agent_id}/")]
+        for name in names:
+            del self.blobs[name]
+        return FolderDeletionResult(deleted=len(names))
+
+
+class FakeIngestionJobRepository(IIngestionJobRepository):
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.jobs: Dict[str, dict] = {}
+
+    async def _io(self):
+        await asyncio.sleep(self.latency)
+
+    def _find_or_create(self, agent_id: str, file_name: str, idempotency_key: str, max_attempts: int, index_version: Optional[int] = None) -> dict:
+        for job in self.jobs.values():
+            if job["idempotency_key"] == idempotency_key:
+                return job
+        now = datetime.utcnow()
+        job_id = ObjectId()
+        job = {
+            "_id": job_id, "idempotency_key": idempotency_key, "agent_id": agent_id, "file_name": file_name,
+            "status": JobStatus.QUEUED.value, "attempts": 0, "max_attempts": max_attempts, "progress": {},
+            "error": None, "batch_id": None, "index_version": index_version, "created_at": now, "updated_at": now, "available_at": now,
+            "enqueued_at": now,
+        }
+        self.jobs[str(job_id)] = job
+        return job
+
+    def _requeue_if_stale(self, job: dict):
+        # Igual que el repositorio: fallido, o hecho y con otro trabajo del mismo archivo encolado después
+        overwritten = any(
+            other is not job and other["agent_id"] == job["agent_id"] and other["file_name"] == job["file_name"]
+            and other.get("index_version") == job.get("index_version") and other["enqueued_at"] > job["enqueued_at"]
+            for other in self.jobs.values()
+        )
+        if job["status"] == JobStatus.FAILED.value or (job["status"] == JobStatus.DONE.value and overwritten):
+            now = datetime.utcnow()
+            job.update(status=JobStatus.QUEUED.value, attempts=0, error=None, progress={}, updated_at=now, available_at=now, enqueued_at=now)
+
+    async def enqueue(self, agent_id: str, file_name: str, idempotency_key: str, max_attempts: int) -> dict:
+        await self._io()
+        job = self._find_or_create(agent_id, file_name, idempotency_key, max_attempts)
+        self._requeue_if_stale(job)
+        return dict(job)
+
+    async def enqueue_many(
+        self,
+        agent_id: str,
+        files: List[Tuple[str, str]],
+        max_attempts: int,
+        batch_id: str,
+        index_version: Optional[int] = None,
+    ) -> int:
+        await self._io()
+        for file_name, idempotency_key in files:
+            job = self._find_or_create(agent_id, file_name, idempotency_key, max_attempts, index_version)
+            job["batch_id"] = batch_id
+            self._requeue_if_stale(job)
+        return len(files)
+
+    async def enqueue_agent_cleanup(self, agent_id: str, max_attempts: int) -> dict:
+        await self._io()
+        job = self._find_or_create(agent_id, "", f"delete-agent/{agent_id}", max_attempts)
+        job["kind"] = JobKind.DELETE_AGENT.value
+        if job["status"] in (JobStatus.FAILED.value, JobStatus.DONE.value):
+            now = datetime.utcnow()
+            job.update(status=JobStatus.QUEUED.value, attempts=0, error=None, progress={}, updated_at=now, available_at=now, enqueued_at=now)
+        return dict(job)
+
+    async def claim_next(self, worker_id: str, lease_seconds: int, batch_id: Optional[str] = None) -> Optional[dict]:
+        await self._io()
+        now = datetime.utcnow()
+        for job in sorted(self.jobs.values(), key=lambda job: job["available_at"]):
+            if batch_id is not None and job.get("batch_id") != batch_id:
+                continue
+            if job["status"] == JobStatus.QUEUED.value and job["available_at"] <= now:
+                job.update(status=JobStatus.RUNNING.value, worker_id=worker_id, attempts=job["attempts"] + 1,
+                           lease_expires_at=now + timedelta(seconds=lease_seconds), updated_at=now)
+                return dict(job)
+        return None
+
+    async def extend_lease(self, job_id: str, worker_id: str, lease_seconds: int) -> bool:
+        await self._io()
+        job = self.jobs.get(job_id)
+        if job is None or job.get("worker_id") != worker_id:
+            return False
+        job["lease_expires_at"] = datetime.utcnow() + timedelta(seconds=lease_seconds)
+        return True
+
+    async def update_progress(self, job_id: str, progress: dict) -> None:
+        await self._io()
+        if job_id in self.jobs:
+            self.jobs[job_id].update(progress=progress, updated_at=datetime.utcnow())
+
+    async def mark_done(self, job_id: str) -> None:
+        await self._io()
+        if job_id in self.jobs:
+            self.jobs[job_id].update(status=JobStatus.DONE.value, error=None, updated_at=datetime.utcnow())
+
+    async def mark_failed(self, job_id: str, error: str, retry_at: Optional[datetime] = None) -> None:
+        await self._io()
+        if job_id in self.jobs:
+            status = JobStatus.QUEUED if retry_at else JobStatus.FAILED
+            self.jobs[job_id].update(status=status.value, error=error, updated_at=datetime.utcnow())
+            if retry_at:
+                self.jobs[job_id]["available_at"] = retry_at
+
+    async def find_latest(self, agent_id: str, file_name: str) -> Optional[dict]:
+        await self._io()
+        jobs = [job for job in self.jobs.values() if job["agent_id"] == agent_id and job["file_name"] == file_name]
+        return dict(max(jobs, key=lambda job: job["enqueued_at"])) if jobs else None
+
+    async def find_batch(self, agent_id: str, batch_id: str) -> List[dict]:
+        await self._io()
+        jobs = [job for job in self.jobs.values() if job["agent_id"] == agent_id and job.get("batch_id") == batch_id]
+        return [dict(job) for job in sorted(jobs, key=lambda job: job["file_name"])]
+
+    async def summarize_batch(self, agent_id: str, batch_id: str) -> Dict[str, dict]:
+        await self._io()
+        summary: Dict[str, dict] = {}
+        for job in self.jobs.values():
+            if job["agent_id"] == agent_id and job.get("batch_id") == batch_id:
+                group = summary.setdefault(job["status"], {"files": 0, "chunks": 0})
+                group["files"] += 1
+                group["chunks"] += job["progress"].get("chunks", 0)
+        return summary
+
+    async def delete_jobs(self, agent_id: str, file_name: Optional[str] = None) -> int:
+        await self._io()
+        job_ids = [
+            job_id for job_id, job in self.jobs.items()
+            if job["agent_id"] == agent_id and (file_name is None or job["file_name"] == file_name)
+        ]
+        for job_id in job_ids:
+            del self.jobs[job_id]
+        return len(job_ids)
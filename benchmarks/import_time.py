@@ -0,0 +1,141 @@
+# benchmarks/import_time.py
+# Mide lo que cuesta importar la API (`import app.main`) en un proceso limpio, con
+# `python -X importtime`, y falla si supera el presupuesto o si al arrancar se importa alguno
+# de los módulos que deben cargarse bajo demanda (loaders, LLM). Cada réplica paga este
+# tiempo en cada arranque, así que afecta al autoescalado y a los despliegues.
+#
+#   python -m benchmarks.import_time --budget-ms 1500 --runs 5
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+# Solo los necesitan la ingesta o el primer chat: se importan en el primer uso
+LAZY_MODULES = [
+    "langchain",
+    "langchain_community",
+    "langchain_core",
+    "langchain_openai",
+    "openai",
+    "unstructured",
+    "pypdf",
+    "docx",
+    "openpyxl",
+    "pptx",
+]
+
+Timings = Dict[str, Tuple[int, int, int]]
+
+
+def run_importtime(target: str) -> Timings:
+    """
+    Importa `target` en un intérprete nuevo y devuelve, por módulo, (µs propios, µs acumulados,
+    profundidad de anidamiento) según la salida de `-X importtime`.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {target}"],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        sys.exit(f"No se pudo importar {target}:\n{result.stderr[-2000:]}")
+
+    timings: Timings = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3:
+            continue
+        try:
+            self_us, cumulative_us = int(fields[0]), int(fields[1])
+        except ValueError:
+            # Cabecera "self [us] | cumulative | imported package"
+            continue
+        name = fields[2][1:]
+        depth = (len(name) - len(name.lstrip())) // 2
+        timings[name.strip()] = (self_us, cumulative_us, depth)
+    return timings
+
+
+def target_roots(target: str) -> set:
+    # Imports de primer nivel del paquete objetivo (p. ej. "app" y "app.main")
+    parts = target.split(".")
+    return {".".join(parts[:length]) for length in range(1, len(parts) + 1)}
+
+
+def target_timings(timings: Timings, target: str) -> Timings:
+    """
+    Se queda con los módulos que importa el objetivo. `-X importtime` escribe cada módulo después
+    de sus dependencias, así que son los que siguen a la última entrada de primer nivel del
+    arranque del intérprete (site, encodings...).
+    """
+    roots = target_roots(target)
+    entries = list(timings.items())
+    start = 0
+    for index, (name, (_, _, depth)) in enumerate(entries):
+        if depth == 0 and name in roots:
+            break
+        if depth == 0:
+            start = index + 1
+    return dict(entries[start:])
+
+
+def total_ms(timings: Timings, target: str) -> float:
+    roots = target_roots(target)
+    return sum(cumulative for name, (_, cumulative, depth) in timings.items() if depth == 0 and name in roots) / 1000
+
+
+def heaviest_packages(timings: Timings, top: int) -> List[dict]:
+    # Tiempo propio agrupado por paquete raíz: dónde se va el arranque
+    packages: Dict[str, int] = {}
+    for name, (self_us, _, _) in timings.items():
+        root = name.split(".")[0]
+        packages[root] = packages.get(root, 0) + self_us
+    ranked = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+    return [{"package": package, "self_ms": round(self_us / 1000, 1)} for package, self_us in ranked]
+
+
+def eager_lazy_modules(timings: Timings, allowed: List[str]) -> List[str]:
+    watched = [module for module in LAZY_MODULES if module not in allowed]
+    return sorted({module for module in watched for name in timings if name == module or name.startswith(module + ".")})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tiempo de importación de la API con python -X importtime")
+    parser.add_argument("--target", default="app.main", help="Módulo a importar")
+    parser.add_argument("--runs", type=int, default=5, help="Procesos nuevos; se usa la mediana")
+    parser.add_argument("--budget-ms", type=float, default=1500.0, help="Tiempo máximo de importación permitido")
+    parser.add_argument("--top", type=int, default=15, help="Paquetes más pesados a mostrar")
+    parser.add_argument("--allow", nargs="*", default=[], help="Módulos de LAZY_MODULES que se permite importar al arrancar")
+    args = parser.parse_args()
+
+    runs = [target_timings(run_importtime(args.target), args.target) for _ in range(args.runs)]
+    totals = [total_ms(timings, args.target) for timings in runs]
+    # La primera ejecución suele incluir la compilación de los .pyc: la mediana la descarta
+    median = statistics.median(totals)
+    median_run = runs[totals.index(statistics.median_low(totals))]
+    eager = eager_lazy_modules(runs[-1], args.allow)
+
+    print(json.dumps({
+        "target": args.target,
+        "runs_ms": [round(total, 1) for total in totals],
+        "median_ms": round(median, 1),
+        "budget_ms": args.budget_ms,
+        "heaviest_packages": heaviest_packages(median_run, args.top),
+        "eager_lazy_modules": eager,
+    }, indent=2))
+
+    failures = []
+    if median > args.budget_ms:
+        failures.append(f"importar {args.target} tarda {median:.0f} ms, por encima de {args.budget_ms:.0f} ms")
+    if eager:
+        failures.append(f"{args.target} importa al arrancar módulos que deben cargarse bajo demanda: {', '.join(eager)}")
+    if failures:
+        sys.exit("\n".join(failures))
+
+
+if __name__ == "__main__":
+    main()
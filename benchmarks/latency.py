@@ -0,0 +1,424 @@
+# benchmarks/latency.py
+# Benchmark de carga y latencia de la API completa, sin servicios externos. La app de FastAPI
+# corre en el propio proceso (httpx + ASGITransport) con los repositorios en memoria de
+# benchmarks/fakes.py, el NumpyVectorStore en un directorio temporal y embeddings y LLM falsos
+# con latencia configurable. Mide p50/p95/p99 y throughput por escenario, concurrencia y
+# tamaño de corpus, y puede compararse con un resultado anterior guardado.
+#
+#   python -m benchmarks.latency --scenarios chat list upload delete --concurrency 1 8 32 \
+#       --corpus-sizes 100 1000 --output bench.json --baseline baseline.json
+#
+# El escenario chat_ingest mide el chat en reposo y mientras se ingiere un PDF grande, y falla si
+# el p95 empeora más de --max-ingest-slowdown o si el event loop se bloquea más de --max-loop-lag-ms.
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import httpx
+import numpy as np
+from prometheus_client import REGISTRY
+
+from app.core.domain.agent_model import AgentCreate
+from app.core.domain.vector_model import VectorRecord
+from app.core.services import ingestion_worker
+from app.core.services.agent_service import AgentService
+from app.core.services.ingestion_worker import IngestionWorker
+from app.adapters.controllers.agent_controller import get_agent_service
+from app.adapters.repositories.numpy_vector_store import NumpyVectorStore
+from app.infrastructure import clients as clients_module
+from app.infrastructure import embedding_cache as embedding_cache_module
+from app.infrastructure import vector_store as vector_store_module
+from app.infrastructure.observability import monitor_event_loop_lag
+from app.infrastructure.process_pool import shutdown_process_pool
+from app.main import app
+from benchmarks.fakes import (
+    FakeAgentRepository,
+    FakeClients,
+    FakeEmbeddingCache,
+    FakeIngestionJobRepository,
+    FakeStorageRepository,
+    Latencies,
+    fake_embedding,
+)
+from benchmarks.parse_memory import write_pdf
+
+SCENARIOS = ["chat", "list", "upload", "delete", "chat_ingest"]
+STATUS_POLL_SECONDS = 0.05
+# Cada cuánto se mide el retraso del event loop durante chat_ingest
+LOOP_LAG_SAMPLE_SECONDS = 0.05
+SEED_BATCH = 1000
+
+
+class BenchEnvironment:
+    """
+    Monta la app con los fakes: sustituye la dependencia de AgentService y los singletons
+    de clientes, almacén de vectores y caché de embeddings, y los restaura al salir.
+    """
+
+    def __init__(self, latencies: Latencies, directory: str):
+        self.latencies = latencies
+        self.clients = FakeClients(latencies)
+        self.agent_repo = FakeAgentRepository(latencies.mongo)
+        self.storage_repo = FakeStorageRepository(latencies.blob)
+        self.job_repo = FakeIngestionJobRepository(latencies.mongo)
+        self.vector_store = NumpyVectorStore(directory, flush_delay=60)
+
+    async def __aenter__(self) -> "BenchEnvironment":
+        self._saved = (clients_module._registry, vector_store_module._vector_store, embedding_cache_module._cache)
+        clients_module._registry = self.clients
+        vector_store_module._vector_store = self.vector_store
+        embedding_cache_module._cache = FakeEmbeddingCache(self.clients.embeddings)
+        # Sin caché de respuestas: cada petición de chat hace el recorrido completo
+        app.dependency_overrides[get_agent_service] = lambda: AgentService(
+            self.agent_repo, self.storage_repo, self.job_repo, self.vector_store, None
+        )
+        await self.vector_store.initialize()
+        self.http = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://benchmark", timeout=None)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.http.aclose()
+        await self.vector_store.close()
+        app.dependency_overrides.pop(get_agent_service, None)
+        clients_module._registry, vector_store_module._vector_store, embedding_cache_module._cache = self._saved
+
+    async def create_agent(self, index: int) -> str:
+        agent = await self.agent_repo.create_agent(AgentCreate(name=f"Agente {index}", prompt="Eres un asistente de pruebas de rendimiento."))
+        return str(agent["_id"])
+
+    async def seed_chunks(self, agent_id: str, count: int):
+        # Los chunks se insertan directamente en el almacén, sin pasar por la ingesta
+        for start in range(0, count, SEED_BATCH):
+            texts = [f"Fragmento {index} del agente {agent_id}: contenido de prueba." for index in range(start, min(start + SEED_BATCH, count))]
+            await self.vector_store.add([
+                VectorRecord(text=text, embedding=fake_embedding(text), metadata={
+                    "agent_id": agent_id, "source": "corpus.pdf", "document_id": f"{agent_id}/corpus.pdf",
+                    "version": 1, "chunk_hash": str(start + offset), "chunk_index": start + offset,
+                })
+                for offset, text in enumerate(texts)
+            ])
+
+
+def summarize(latencies_ms: List[float], errors: int, elapsed: float) -> dict:
+    samples = np.asarray(latencies_ms) if latencies_ms else np.zeros(1)
+    return {
+        "requests": len(latencies_ms) + errors,
+        "errors": errors,
+        "p50_ms": round(float(np.percentile(samples, 50)), 2),
+        "p95_ms": round(float(np.percentile(samples, 95)), 2),
+        "p99_ms": round(float(np.percentile(samples, 99)), 2),
+        "mean_ms": round(float(samples.mean()), 2),
+        "throughput_rps": round(len(latencies_ms) / elapsed, 2) if elapsed else 0.0,
+    }
+
+
+async def run_load(request: Callable[[int], Awaitable[None]], total: Optional[int], concurrency: int, until: Optional[asyncio.Event] = None) -> dict:
+    """
+    Lanza `total` peticiones con como mucho `concurrency` a la vez y devuelve sus estadísticas.
+    Con `until` se siguen lanzando (sin límite si `total` es None) hasta que el evento se activa.
+    """
+    latencies_ms: List[float] = []
+    errors = 0
+    next_index = iter(range(total)) if total is not None else itertools.count()
+
+    async def client():
+        nonlocal errors
+        for index in next_index:
+            if until is not None and until.is_set():
+                return
+            started = time.perf_counter()
+            try:
+                await request(index)
+                latencies_ms.append((time.perf_counter() - started) * 1000)
+            except Exception as e:
+                errors += 1
+                if errors == 1:
+                    print(f"  primer error: {e}", file=sys.stderr)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return summarize(latencies_ms, errors, time.perf_counter() - started)
+
+
+def check(response: httpx.Response):
+    if response.status_code >= 400:
+        raise RuntimeError(f"{response.request.method} {response.request.url.path}: {response.status_code} {response.text[:200]}")
+
+
+async def scenario_chat(env: BenchEnvironment, corpus: int, total: int, concurrency: int) -> dict:
+    # Un agente con `corpus` chunks; cada petición es una pregunta distinta
+    agent_id = await env.create_agent(0)
+    await env.seed_chunks(agent_id, corpus)
+
+    async def request(index: int):
+        check(await env.http.post(f"/agents/{agent_id}/chat", json={"query": f"¿Qué dice el fragmento {index}?"}))
+    return await run_load(request, total, concurrency)
+
+
+async def scenario_list(env: BenchEnvironment, corpus: int, total: int, concurrency: int) -> dict:
+    # `corpus` agentes; cada petición pide una página empezando en un cursor distinto
+    agent_ids = [await env.create_agent(index) for index in range(corpus)]
+
+    async def request(index: int):
+        params = {"limit": 100}
+        if index % 2:
+            params["after"] = agent_ids[(index * 7919) % len(agent_ids)]
+        check(await env.http.get("/agents/", params=params))
+    return await run_load(request, total, concurrency)
+
+
+async def scenario_upload(env: BenchEnvironment, corpus: int, total: int, concurrency: int, directory: str) -> dict:
+    # Subida + ingesta completa de un PDF de `corpus` páginas: la latencia va desde la
+    # subida hasta que el trabajo de ingesta termina; hay tantos workers como concurrencia
+    path = os.path.join(directory, f"upload-{corpus}.pdf")
+    write_pdf(path, corpus)
+    with open(path, "rb") as pdf:
+        content = pdf.read()
+    agent_ids = [await env.create_agent(index) for index in range(total)]
+
+    ingestion_worker.INGESTION_POLL_SECONDS = STATUS_POLL_SECONDS
+    workers = [IngestionWorker(env.job_repo, env.storage_repo) for _ in range(concurrency)]
+    worker_tasks = [asyncio.create_task(worker.run()) for worker in workers]
+    upload_ms: List[float] = []
+
+    async def request(index: int):
+        agent_id = agent_ids[index]
+        started = time.perf_counter()
+        check(await env.http.post(f"/agents/{agent_id}/documents", files={"file": ("document.pdf", content, "application/pdf")}))
+        upload_ms.append((time.perf_counter() - started) * 1000)
+        while True:
+            response = await env.http.get(f"/agents/{agent_id}/documents/document.pdf/status")
+            check(response)
+            job = response.json()
+            if job["status"] == "done":
+                return
+            if job["status"] == "failed":
+                raise RuntimeError(f"Ingesta fallida: {job['error']}")
+            await asyncio.sleep(STATUS_POLL_SECONDS)
+
+    try:
+        result = await run_load(request, total, concurrency)
+    finally:
+        for worker in workers:
+            worker.stop()
+        await asyncio.gather(*worker_tasks)
+    result["upload_only"] = summarize(upload_ms, 0, sum(upload_ms) / 1000)
+    return result
+
+
+async def scenario_delete(env: BenchEnvironment, corpus: int, total: int, concurrency: int) -> dict:
+    # Cada petición borra un agente con 10 blobs y `corpus` chunks
+    agent_ids = []
+    for index in range(total):
+        agent_id = await env.create_agent(index)
+        for blob in range(10):
+            env.storage_repo.blobs[f"{agent_id}/doc{blob}.pdf"] = b"%PDF"
+        await env.seed_chunks(agent_id, corpus)
+        agent_ids.append(agent_id)
+
+    async def request(index: int):
+        check(await env.http.delete(f"/agents/{agent_ids[index]}"))
+    return await run_load(request, total, concurrency)
+
+
+async def wait_for_ingestion(env: BenchEnvironment, agent_id: str, file_name: str):
+    while True:
+        response = await env.http.get(f"/agents/{agent_id}/documents/{file_name}/status")
+        check(response)
+        job = response.json()
+        if job["status"] == "done":
+            return
+        if job["status"] == "failed":
+            raise RuntimeError(f"Ingesta fallida: {job['error']}")
+        await asyncio.sleep(STATUS_POLL_SECONDS)
+
+
+async def sample_loop_lag(samples: List[float]):
+    # monitor_event_loop_lag publica la última medida en el gauge; aquí se recogen todas
+    while True:
+        await asyncio.sleep(LOOP_LAG_SAMPLE_SECONDS)
+        samples.append(REGISTRY.get_sample_value("rag_event_loop_lag_seconds") or 0.0)
+
+
+async def scenario_chat_ingest(
+    env: BenchEnvironment, corpus: int, total: int, concurrency: int, directory: str,
+    ingest_pages: int, max_slowdown: float, max_loop_lag_ms: float,
+) -> dict:
+    """
+    Chat contra un agente con `corpus` chunks: primero `total` peticiones en reposo y después
+    tantas como dé tiempo mientras un worker ingiere un PDF de `ingest_pages` páginas en otro
+    agente. El p95 durante la ingesta no debe empeorar más de `max_slowdown` y el event loop no
+    debe quedarse bloqueado más de `max_loop_lag_ms` (el parseo va al pool de procesos).
+    """
+    agent_id = await env.create_agent(0)
+    await env.seed_chunks(agent_id, corpus)
+
+    async def request(index: int):
+        check(await env.http.post(f"/agents/{agent_id}/chat", json={"query": f"¿Qué dice el fragmento {index}?"}))
+
+    lag_samples: List[float] = []
+    lag_monitor = asyncio.create_task(monitor_event_loop_lag(LOOP_LAG_SAMPLE_SECONDS))
+    lag_sampler = asyncio.create_task(sample_loop_lag(lag_samples))
+    try:
+        idle = await run_load(request, total, concurrency)
+        idle_lag_ms = max(lag_samples, default=0.0) * 1000
+
+        path = os.path.join(directory, f"ingest-{ingest_pages}.pdf")
+        write_pdf(path, ingest_pages)
+        with open(path, "rb") as pdf:
+            content = pdf.read()
+        ingest_agent_id = await env.create_agent(1)
+        ingestion_worker.INGESTION_POLL_SECONDS = STATUS_POLL_SECONDS
+        worker = IngestionWorker(env.job_repo, env.storage_repo)
+        worker_task = asyncio.create_task(worker.run())
+        try:
+            ingest_started = time.perf_counter()
+            check(await env.http.post(f"/agents/{ingest_agent_id}/documents", files={"file": ("large.pdf", content, "application/pdf")}))
+            lag_samples.clear()
+            ingested = asyncio.Event()
+            ingestion = asyncio.create_task(wait_for_ingestion(env, ingest_agent_id, "large.pdf"))
+            ingestion.add_done_callback(lambda _: ingested.set())
+            # Solo cuentan las peticiones lanzadas mientras la ingesta está en curso
+            busy = await run_load(request, None, concurrency, until=ingested)
+            await ingestion
+            ingest_seconds = time.perf_counter() - ingest_started
+        finally:
+            worker.stop()
+            await worker_task
+    finally:
+        lag_sampler.cancel()
+        lag_monitor.cancel()
+
+    busy_lag_ms = max(lag_samples, default=0.0) * 1000
+    slowdown = (busy["p95_ms"] - idle["p95_ms"]) / idle["p95_ms"] if idle["p95_ms"] else 0.0
+    failures = []
+    if busy["requests"] < concurrency:
+        failures.append(f"solo {busy['requests']} peticiones durante la ingesta: usar más --ingest-pages")
+    if slowdown > max_slowdown:
+        failures.append(f"p95 del chat {idle['p95_ms']} ms en reposo -> {busy['p95_ms']} ms durante la ingesta ({slowdown:+.0%})")
+    if busy_lag_ms > max_loop_lag_ms:
+        failures.append(f"retraso máximo del event loop durante la ingesta {busy_lag_ms:.0f} ms (límite {max_loop_lag_ms:.0f} ms)")
+    return {
+        **busy,
+        "idle": idle,
+        "p95_slowdown": round(slowdown, 3),
+        "ingest_pages": ingest_pages,
+        "ingest_seconds": round(ingest_seconds, 2),
+        "event_loop_lag_max_ms": {"idle": round(idle_lag_ms, 2), "ingesting": round(busy_lag_ms, 2)},
+        "failures": failures,
+    }
+
+
+async def run_scenario(name: str, corpus: int, total: int, concurrency: int, latencies: Latencies, args) -> dict:
+    with tempfile.TemporaryDirectory() as directory:
+        async with BenchEnvironment(latencies, os.path.join(directory, "vectors")) as env:
+            if name == "chat":
+                return await scenario_chat(env, corpus, total, concurrency)
+            if name == "list":
+                return await scenario_list(env, corpus, total, concurrency)
+            if name == "upload":
+                return await scenario_upload(env, corpus, total, concurrency, directory)
+            if name == "chat_ingest":
+                return await scenario_chat_ingest(
+                    env, corpus, total, concurrency, directory, args.ingest_pages, args.max_ingest_slowdown, args.max_loop_lag_ms,
+                )
+            return await scenario_delete(env, corpus, total, concurrency)
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], max_regression: float) -> List[str]:
+    """
+    Compara p95 y throughput con la línea base. Devuelve las regresiones que superan `max_regression`.
+    """
+    regressions = []
+    print(f"\n{'caso':<28}{'p95 base':>12}{'p95 ahora':>12}{'Δ p95':>9}{'rps base':>11}{'rps ahora':>11}")
+    for key, current in results.items():
+        previous = baseline.get(key)
+        if previous is None:
+            continue
+        delta = (current["p95_ms"] - previous["p95_ms"]) / previous["p95_ms"] if previous["p95_ms"] else 0.0
+        print(f"{key:<28}{previous['p95_ms']:>12.1f}{current['p95_ms']:>12.1f}{delta:>+9.0%}"
+              f"{previous['throughput_rps']:>11.1f}{current['throughput_rps']:>11.1f}")
+        if delta > max_regression:
+            regressions.append(f"{key}: p95 {previous['p95_ms']} ms -> {current['p95_ms']} ms ({delta:+.0%})")
+    return regressions
+
+
+async def run(args) -> dict:
+    latencies = Latencies(
+        mongo=args.mongo_latency,
+        blob=args.blob_latency,
+        embedding=args.embedding_latency,
+        llm_first_token=args.llm_first_token,
+        llm_token=args.llm_token,
+        llm_tokens=args.llm_tokens,
+    )
+    results: Dict[str, dict] = {}
+    try:
+        for name in args.scenarios:
+            for corpus in args.corpus_sizes:
+                for concurrency in args.concurrency:
+                    key = f"{name}/n={corpus}/c={concurrency}"
+                    print(f"Ejecutando {key}...", file=sys.stderr)
+                    results[key] = await run_scenario(name, corpus, args.requests, concurrency, latencies, args)
+    finally:
+        shutdown_process_pool()
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "requests": args.requests,
+            "latencies": vars(latencies),
+        },
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latencia y throughput de la API con dependencias falsas")
+    parser.add_argument("--scenarios", nargs="+", default=SCENARIOS, choices=SCENARIOS)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--corpus-sizes", type=int, nargs="+", default=[100, 1000],
+                        help="chat/delete/chat_ingest: chunks por agente; list: agentes; upload: páginas del PDF")
+    parser.add_argument("--requests", type=int, default=100, help="Peticiones por caso")
+    parser.add_argument("--mongo-latency", type=float, default=0.002)
+    parser.add_argument("--blob-latency", type=float, default=0.01)
+    parser.add_argument("--embedding-latency", type=float, default=0.05)
+    parser.add_argument("--llm-first-token", type=float, default=0.3)
+    parser.add_argument("--llm-token", type=float, default=0.01)
+    parser.add_argument("--llm-tokens", type=int, default=40)
+    parser.add_argument("--ingest-pages", type=int, default=2000, help="chat_ingest: páginas del PDF que se ingiere durante el chat")
+    parser.add_argument("--max-ingest-slowdown", type=float, default=0.5, help="chat_ingest: aumento del p95 del chat tolerado durante la ingesta")
+    parser.add_argument("--max-loop-lag-ms", type=float, default=100.0, help="chat_ingest: retraso máximo del event loop tolerado durante la ingesta")
+    parser.add_argument("--output", help="Archivo JSON donde guardar los resultados")
+    parser.add_argument("--baseline", help="Resultados anteriores (JSON) con los que comparar")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="Aumento de p95 tolerado frente a la línea base")
+    args = parser.parse_args()
+
+    # Una línea de log por petición falsearía las medidas
+    logging.getLogger().setLevel(logging.WARNING)
+    report = asyncio.run(run(args))
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            json.dump(report, output, indent=2)
+
+    failures = [f"{key}: {failure}" for key, result in report["results"].items() for failure in result.get("failures", [])]
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare(report["results"], baseline["results"], args.max_regression)
+        if regressions:
+            failures.append("Regresiones de latencia:\n" + "\n".join(regressions))
+    if failures:
+        sys.exit("\n".join(failures))
+
+
+if __name__ == "__main__":
+    main()
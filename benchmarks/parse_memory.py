@@ -0,0 +1,153 @@
+# benchmarks/parse_memory.py
+# Compara el pico de memoria (tracemalloc) de parsear y dividir un documento cargándolo entero
+# (`loader.load()` + `split_documents`) frente al pipeline en streaming de document_parser
+# (`lazy_load` página a página + división incremental). Genera documentos sintéticos de los
+# cuatro tipos de LOADER_MAPPING, así que no necesita archivos de ejemplo.
+#
+#   python -m benchmarks.parse_memory --pages 500 --types .pdf .docx .xlsx .pptx
+import argparse
+import json
+import os
+import sys
+import tempfile
+import tracemalloc
+
+from app.core.services.document_parser import build_text_splitter, get_loader_class, iter_chunks
+
+LINES_PER_PAGE = 40
+LINE = "Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor {page}-{line}."
+
+
+def page_lines(page: int):
+    return [LINE.format(page=page, line=line) for line in range(LINES_PER_PAGE)]
+
+
+def write_pdf(path: str, pages: int):
+    # PDF mínimo escrito a mano: una fuente estándar y un stream de texto por página
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for page in range(pages):
+        text = "".join(f"({line}) Tj T* " for line in page_lines(page))
+        content = f"BT /F1 9 Tf 12 TL 40 800 Td {text}ET".encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream")
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>"
+            % len(objects)
+        )
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {pages} >>".encode()
+
+    with open(path, "wb") as pdf:
+        pdf.write(b"%PDF-1.4\n")
+        offsets = []
+        for number, body in enumerate(objects, start=1):
+            offsets.append(pdf.tell())
+            pdf.write(b"%d 0 obj\n" % number + body + b"\nendobj\n")
+        xref = pdf.tell()
+        pdf.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+        for offset in offsets:
+            pdf.write(b"%010d 00000 n \n" % offset)
+        pdf.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+
+
+def write_docx(path: str, pages: int):
+    from docx import Document
+
+    document = Document()
+    for page in range(pages):
+        for line in page_lines(page):
+            document.add_paragraph(line)
+    document.save(path)
+
+
+def write_xlsx(path: str, pages: int):
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("data")
+    for page in range(pages):
+        for line in page_lines(page):
+            sheet.append([page, line])
+    workbook.save(path)
+
+
+def write_pptx(path: str, pages: int):
+    from pptx import Presentation
+    from pptx.util import Inches
+
+    presentation = Presentation()
+    for page in range(pages):
+        slide = presentation.slides.add_slide(presentation.slide_layouts[6])
+        box = slide.shapes.add_textbox(Inches(0.5), Inches(0.5), Inches(9), Inches(6))
+        box.text_frame.text = "\n".join(page_lines(page))
+    presentation.save(path)
+
+
+WRITERS = {".pdf": write_pdf, ".docx": write_docx, ".xlsx": write_xlsx, ".pptx": write_pptx}
+
+
+def load_all(path: str, extension: str) -> int:
+    # El pipeline anterior: todas las páginas y todos los chunks en memoria a la vez
+    documents = get_loader_class(extension)(path).load()
+    return len(build_text_splitter().split_documents(documents))
+
+
+def stream(path: str, extension: str) -> int:
+    # Cada chunk se consume y se descarta, como hace la etapa de embebido con cada lote
+    return sum(1 for _ in iter_chunks(path, extension))
+
+
+def measure(function, path: str, extension: str) -> dict:
+    tracemalloc.start()
+    chunks = function(path, extension)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"chunks": chunks, "peak_mb": round(peak / (1024 * 1024), 2)}
+
+
+def run_type(extension: str, pages: int, directory: str) -> dict:
+    path = os.path.join(directory, f"document{extension}")
+    WRITERS[extension](path, pages)
+    # Calentamiento: los loaders importan sus dependencias en la primera llamada
+    warmup = os.path.join(directory, f"warmup{extension}")
+    WRITERS[extension](warmup, 1)
+    stream(warmup, extension)
+
+    streaming = measure(stream, path, extension)
+    loaded = measure(load_all, path, extension)
+    return {
+        "type": extension,
+        "pages": pages,
+        "file_mb": round(os.path.getsize(path) / (1024 * 1024), 2),
+        "load_all": loaded,
+        "streaming": streaming,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pico de memoria del parseo en streaming frente a cargar el documento entero")
+    parser.add_argument("--pages", type=int, default=500)
+    parser.add_argument("--types", nargs="+", default=list(WRITERS), choices=list(WRITERS))
+    parser.add_argument("--budget-mb", type=float, default=16.0, help="Pico máximo permitido para el PDF en streaming")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        results = [run_type(extension, args.pages, directory) for extension in args.types]
+    print(json.dumps(results, indent=2))
+
+    failures = []
+    for result in results:
+        if result["streaming"]["chunks"] != result["load_all"]["chunks"]:
+            failures.append(f"{result['type']}: el streaming produce {result['streaming']['chunks']} chunks y la carga completa {result['load_all']['chunks']}")
+        if result["streaming"]["peak_mb"] > result["load_all"]["peak_mb"] * 1.1:
+            failures.append(f"{result['type']}: el streaming usa más memoria que cargar el documento entero")
+        # PyPDFLoader lee página a página; los loaders de Unstructured particionan el archivo
+        # entero antes de devolver la primera página, así que solo se exige el límite al PDF
+        if result["type"] == ".pdf" and result["streaming"]["peak_mb"] > args.budget_mb:
+            failures.append(f".pdf: pico de {result['streaming']['peak_mb']} MB, por encima de {args.budget_mb} MB")
+    if failures:
+        sys.exit("\n".join(failures))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+# benchmarks/upload_memory.py
+# Mide el pico de RSS de StorageRepository.upload_stream para archivos de distinto tamaño.
+# Usa un BlobServiceClient falso (sin red) y ejecuta cada tamaño en un subproceso para que
+# ru_maxrss refleje solo esa subida.
+#
+#   python -m benchmarks.upload_memory --sizes-mb 10 50 100 200
+import argparse
+import asyncio
+import json
+import resource
+import subprocess
+import sys
+import tempfile
+
+from app.adapters.repositories import storage_repository
+from app.adapters.repositories.storage_repository import StorageRepository
+
+WRITE_CHUNK = 1024 * 1024
+
+
+class FakeBlobClient:
+    url = "https://fake.blob.core.windows.net/knowledge-base/blob"
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.staged_bytes = 0
+
+    async def stage_block(self, block_id: str, data: bytes):
+        await asyncio.sleep(self.latency)
+        self.staged_bytes += len(data)
+
+    async def commit_block_list(self, block_list):
+        await asyncio.sleep(self.latency)
+
+
+class FakeBlobServiceClient:
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def get_blob_client(self, container: str, blob: str) -> FakeBlobClient:
+        return FakeBlobClient(self.latency)
+
+
+class SpooledUpload:
+    """
+    Imita fastapi.UploadFile: el contenido vive en un SpooledTemporaryFile que pasa a disco
+    al superar 1 MB y la lectura se hace fuera del event loop.
+    """
+
+    def __init__(self, size: int):
+        self.file = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+        block = b"x" * WRITE_CHUNK
+        for _ in range(size // WRITE_CHUNK):
+            self.file.write(block)
+        self.file.seek(0)
+
+    async def read(self, size: int = -1) -> bytes:
+        return await asyncio.to_thread(self.file.read, size)
+
+
+def peak_rss_mb() -> float:
+    # En Linux ru_maxrss viene en KB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def run_single(size_mb: int, latency: float) -> dict:
+    upload = SpooledUpload(size_mb * 1024 * 1024)
+    baseline = peak_rss_mb()
+    repo = StorageRepository(FakeBlobServiceClient(latency))
+    await repo.upload_stream("agent", "file.pdf", upload)
+    return {"size_mb": size_mb, "baseline_rss_mb": round(baseline, 1), "peak_rss_mb": round(peak_rss_mb(), 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pico de RSS de la subida por bloques según el tamaño del archivo")
+    parser.add_argument("--sizes-mb", type=int, nargs="+", default=[10, 50, 100, 200])
+    parser.add_argument("--latency", type=float, default=0.005, help="Latencia simulada por bloque (s)")
+    parser.add_argument("--single", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single is not None:
+        print(json.dumps(asyncio.run(run_single(args.single, args.latency))))
+        return
+
+    results = []
+    for size_mb in args.sizes_mb:
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.upload_memory", "--single", str(size_mb), "--latency", str(args.latency)],
+            check=True, capture_output=True, text=True,
+        )
+        results.append(json.loads(output.stdout))
+
+    growth = [r["peak_rss_mb"] - r["baseline_rss_mb"] for r in results]
+    # Como máximo deberían convivir BLOB_UPLOAD_MAX_CONCURRENCY bloques (+ uno leyéndose)
+    budget_mb = (storage_repository.BLOB_UPLOAD_MAX_CONCURRENCY + 1) * storage_repository.BLOB_UPLOAD_BLOCK_SIZE / (1024 * 1024)
+    report = {"results": results, "rss_growth_mb": growth, "budget_mb": budget_mb}
+    print(json.dumps(report, indent=2))
+    if max(growth) > budget_mb * 2:
+        sys.exit(f"El pico de RSS crece con el tamaño del archivo: {growth}")
+
+
+if __name__ == "__main__":
+    main()